@@ -0,0 +1,45 @@
+"""
+Measure the throughput of the message parser on typical, large and
+adversarial messages.
+
+Usage: python benchmarks/bench_parser.py
+"""
+
+import os
+import timeit
+
+os.environ.setdefault("ACCESS_TOKEN", "benchmark")
+os.environ.setdefault("SERVER_URL", "https://server.test")
+os.environ.setdefault("MODERATORS_USERNAMES", "mod@server.test")
+
+from shyraccoon import parser  # noqa: E402
+
+MENTION = (
+    '<span class="h-card"><a href="https://server.test/@ShyRaccoon" '
+    'class="u-url mention">@<span>ShyRaccoon</span></a></span>'
+)
+MESSAGES = {
+    "typical": f"<p>{MENTION} for ?user@server.test:</p><p>How old are you?</p>",
+    "large": f"<p>{MENTION} for ?user@server.test:</p>"
+    + "<p>Lorem ipsum dolor sit amet, consectetur adipiscing elit.<br />"
+    "Fish &amp; chips &#39;n&#39; stuff</p>" * 500,
+    "many usernames": f"<p>{MENTION} for ?user@server.test:</p><p>"
+    + "?a ?b ?c ?! ? " * 2000
+    + "</p>",
+    "unterminated tags": "<p>for ?user</p><p>" + "<a " * 10000 + "</p>",
+    "entities": "<p>for ?user</p><p>" + "&amp;&#39;&lt;&nosuchentity;&" * 5000,
+}
+
+
+def main():
+    print(f"{'message':<20}{'size':>10}{'msg/s':>14}{'MB/s':>10}")
+    for name, content in MESSAGES.items():
+        timer = timeit.Timer(lambda: parser.parse_message(content, "?"))
+        number, _ = timer.autorange()
+        best = min(timer.repeat(repeat=5, number=number)) / number
+        size = len(content.encode())
+        print(f"{name:<20}{size:>10}{1 / best:>14.0f}{size / best / 1e6:>10.1f}")
+
+
+if __name__ == "__main__":
+    main()
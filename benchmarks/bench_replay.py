@@ -0,0 +1,226 @@
+"""
+Replay a notification trace against a local fake Mastodon server, through
+start_stream and the notification handler of the CLI, and report throughput,
+end-to-end latency and API calls per message.
+
+Usage: python benchmarks/bench_replay.py [--messages 1000] [--rate 50]
+       [--latency 0.01] [--rate-limit-every 50] [--trace notifications.jsonl]
+
+A recorded trace is a JSON lines file of notifications, as returned by
+/api/v1/notifications. By default, a synthetic trace of mentions, reports
+and follows is used.
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import random
+import socket
+import statistics
+import sys
+import time
+
+import fake_mastodon
+
+
+def get_free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+PORT = get_free_port()
+STREAMING_PORT = get_free_port()
+
+os.environ.setdefault("ACCESS_TOKEN", "benchmark")
+os.environ["SERVER_URL"] = f"http://127.0.0.1:{PORT}"
+os.environ.setdefault("MODERATORS_USERNAMES", "mod@fake.test")
+os.environ.setdefault("DATABASE_PATH", ":memory:")
+os.environ.setdefault("RATE_LIMIT_USER", "1000000/day")
+os.environ.setdefault("RATE_LIMIT_USER_COUPLE", "1000000/hour")
+os.environ.setdefault("API_RATE", "100000")
+os.environ.setdefault("API_BURST", "1000")
+os.environ.setdefault("OUTBOX_RETRY_DELAY", "0.01")
+os.environ.setdefault("LOGLEVEL", "ERROR")
+
+from shyraccoon import cli  # noqa: E402
+from shyraccoon import main  # noqa: E402
+from shyraccoon import settings  # noqa: E402
+from shyraccoon import workers  # noqa: E402
+
+MENTION = (
+    '<span class="h-card"><a href="http://fake.test/@ShyRaccoon" '
+    'class="u-url mention">@<span>ShyRaccoon</span></a></span>'
+)
+
+
+def get_synthetic_trace(messages, senders=50, recipients=20, seed=0):
+    """
+    Mostly forwarded messages, with a few reports, follows and messages
+    to unknown recipients.
+    """
+    rng = random.Random(seed)
+    trace = []
+    for i in range(messages):
+        notification_id = str(i + 1)
+        sender = fake_mastodon.get_account(f"sender{rng.randrange(senders)}@fake.test")
+        kind = rng.choices(["forward", "report", "follow", "invalid"], [85, 5, 5, 5])[0]
+        if kind == "follow":
+            trace.append({"id": notification_id, "type": "follow", "account": sender})
+            continue
+        recipient = f"recipient{rng.randrange(recipients)}@fake.test"
+        status = {
+            "id": str(10**12 + i),
+            "visibility": "direct",
+            "account": sender,
+            "mentions": [{"id": fake_mastodon.BOT["id"]}],
+            "tags": [],
+            "spoiler_text": "",
+            "in_reply_to_id": None,
+        }
+        if kind == "report":
+            status["tags"] = [{"name": settings.REPORT_HASHTAGS[0]}]
+            status["in_reply_to_id"] = str(10**13 + i)
+            status["content"] = f"<p>{MENTION} #{settings.REPORT_HASHTAGS[0]}</p>"
+        elif kind == "invalid":
+            status["content"] = f"<p>{MENTION} How are you?</p>"
+        else:
+            status["content"] = (
+                f"<p>{MENTION} for {settings.MENTION_PLACEHOLDER}{recipient}:</p>"
+                f"<p>Question number {i}?</p>"
+            )
+        trace.append(
+            {
+                "id": notification_id,
+                "type": "mention",
+                "account": sender,
+                "status": status,
+            }
+        )
+    return trace
+
+
+def load_trace(path):
+    with open(path) as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+async def replay(trace, server, rate=0):
+    bot_data = await main.get_data(
+        server_url=settings.SERVER_URL,
+        access_token=settings.ACCESS_TOKEN,
+        path="/api/v1/accounts/verify_credentials",
+    )
+    latencies = []
+    errors = 0
+    done = asyncio.Event()
+
+    # the notification handler of the CLI, so the production path is measured
+    current_bot = main.get_bots()[0]
+    handle_notification = cli.get_notification_handler(current_bot, bot_data)
+
+    async def handle_event(event):
+        nonlocal errors
+        try:
+            await main.run_as(current_bot, handle_notification(event))
+        except Exception:
+            # e.g. a rejected lookup, which isn't retried
+            errors += 1
+        finally:
+            latencies.append(time.perf_counter() - server.sent_at[event["data"]["id"]])
+            if len(latencies) == len(trace):
+                done.set()
+
+    pool = workers.WorkerPool(
+        handle_event,
+        key=main.get_event_sender,
+        size=settings.WORKERS,
+        high_water=settings.QUEUE_HIGH_WATER,
+    )
+    pool.start()
+    connected = asyncio.Event()
+
+    async def on_connect():
+        connected.set()
+
+    stream = asyncio.create_task(
+        main.start_stream(
+            server_url=settings.SERVER_URL.replace(str(PORT), str(STREAMING_PORT)),
+            streaming_url=settings.STREAMING_URL,
+            stream=settings.STREAMING_STREAM,
+            access_token=settings.ACCESS_TOKEN,
+            callback=pool.submit,
+            on_connect=on_connect,
+            events={"notification"},
+        )
+    )
+    await connected.wait()
+    server.calls.clear()
+    start = time.perf_counter()
+    for notification in trace:
+        server.push(notification)
+        if rate:
+            await asyncio.sleep(1 / rate)
+    await done.wait()
+    duration = time.perf_counter() - start
+    stream.cancel()
+    await pool.stop()
+    return duration, latencies, errors
+
+
+async def run(args):
+    if args.trace:
+        trace = load_trace(args.trace)
+    else:
+        trace = get_synthetic_trace(args.messages)
+    server = fake_mastodon.FakeMastodon(
+        latency=args.latency,
+        rate_limit_every=args.rate_limit_every,
+        retry_after=args.retry_after,
+    )
+    await server.start("127.0.0.1", PORT, STREAMING_PORT)
+    try:
+        duration, latencies, errors = await replay(trace, server, args.rate)
+    finally:
+        await main.close_http_client()
+        await server.stop()
+
+    quantiles = statistics.quantiles(latencies, n=100)
+    calls = sum(server.calls.values())
+    print(f"messages:          {len(trace)}")
+    print(f"throughput:        {len(trace) / duration:.0f} msg/s")
+    print(f"p50 latency:       {quantiles[49] * 1000:.1f} ms")
+    print(f"p99 latency:       {quantiles[98] * 1000:.1f} ms")
+    print(f"API calls/message: {calls / len(trace):.2f}")
+    print(f"rejected (429):    {server.rejected}")
+    print(f"failed messages:   {errors}")
+    for call, count in server.calls.most_common():
+        print(f"  {call:<45}{count / len(trace):>8.2f}")
+
+
+def get_parser():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--messages", type=int, default=1000)
+    parser.add_argument("--trace", help="JSON lines file of notifications")
+    parser.add_argument(
+        "--rate",
+        type=float,
+        default=0,
+        help="notifications sent per second, all at once if 0",
+    )
+    parser.add_argument(
+        "--latency", type=float, default=0.005, help="API latency, in seconds"
+    )
+    parser.add_argument(
+        "--rate-limit-every",
+        type=int,
+        default=0,
+        help="reject every Nth API request with a 429",
+    )
+    parser.add_argument("--retry-after", type=int, default=0)
+    return parser
+
+
+if __name__ == "__main__":
+    asyncio.run(run(get_parser().parse_args(sys.argv[1:])))
@@ -0,0 +1,174 @@
+"""
+A minimal stand-in for a Mastodon server, serving the REST endpoints used by
+the bot and a streaming websocket, with configurable latency and rate limits.
+
+Only meant for benchmarks: requests are answered with plausible data, but
+nothing is validated.
+"""
+
+import asyncio
+import collections
+import itertools
+import json
+import time
+import urllib.parse
+
+import websockets
+
+BOT = {
+    "id": "1",
+    "username": "ShyRaccoon",
+    "acct": "ShyRaccoon",
+    "url": "http://fake.test/@ShyRaccoon",
+}
+
+
+def get_account(acct):
+    account_id = str(abs(hash(acct)) % 10**12 + 10)
+    return {"id": account_id, "acct": acct, "url": f"http://fake.test/@{acct}"}
+
+
+class FakeMastodon:
+    """
+    `latency` (in seconds) is added to every REST response. If
+    `rate_limit_every` is set, every Nth request is rejected with a 429 that
+    can be retried after `retry_after` seconds.
+    """
+
+    def __init__(self, latency=0, rate_limit_every=0, retry_after=0):
+        self.latency = latency
+        self.rate_limit_every = rate_limit_every
+        self.retry_after = retry_after
+        self.calls = collections.Counter()
+        self.rejected = 0
+        self.requests = 0
+        self.status_ids = itertools.count(10**15)
+        self.events = asyncio.Queue()
+        self.sent_at = {}
+        self.servers = []
+
+    async def start(self, host, port, streaming_port):
+        self.servers = [
+            await asyncio.start_server(self.handle_connection, host, port),
+            await websockets.serve(self.handle_stream, host, streaming_port),
+        ]
+
+    async def stop(self):
+        for server in self.servers:
+            server.close()
+            await server.wait_closed()
+
+    def push(self, notification):
+        """
+        Send a notification on the stream.
+        """
+        self.events.put_nowait(notification)
+
+    async def handle_stream(self, websocket):
+        closed = asyncio.ensure_future(websocket.wait_closed())
+        while True:
+            get = asyncio.ensure_future(self.events.get())
+            await asyncio.wait([get, closed], return_when=asyncio.FIRST_COMPLETED)
+            if not get.done():
+                get.cancel()
+                return
+            notification = get.result()
+            self.sent_at[notification["id"]] = time.perf_counter()
+            await websocket.send(
+                json.dumps(
+                    {
+                        "stream": ["user:notification"],
+                        "event": "notification",
+                        "payload": json.dumps(notification),
+                    }
+                )
+            )
+
+    async def handle_connection(self, reader, writer):
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line:
+                    break
+                method, target, _ = request_line.decode().split(" ", 2)
+                headers = {}
+                while True:
+                    line = (await reader.readline()).decode().strip()
+                    if not line:
+                        break
+                    name, value = line.split(":", 1)
+                    headers[name.strip().lower()] = value.strip()
+                body = await reader.readexactly(int(headers.get("content-length", 0)))
+                status, response_headers, data = await self.handle_request(
+                    method, target, body
+                )
+                content = json.dumps(data).encode()
+                response_headers = {
+                    "content-type": "application/json",
+                    "content-length": str(len(content)),
+                    **response_headers,
+                }
+                writer.write(
+                    f"HTTP/1.1 {status}\r\n".encode()
+                    + "".join(
+                        f"{k}: {v}\r\n" for k, v in response_headers.items()
+                    ).encode()
+                    + b"\r\n"
+                    + content
+                )
+                await writer.drain()
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    async def handle_request(self, method, target, body):
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        url = urllib.parse.urlsplit(target)
+        query = urllib.parse.parse_qs(url.query)
+        path = url.path.split("/")
+        endpoint = "/".join(p if not p.isdigit() else ":id" for p in path)
+        self.requests += 1
+        if self.rate_limit_every and self.requests % self.rate_limit_every == 0:
+            self.rejected += 1
+            return (
+                "429 Too Many Requests",
+                {"retry-after": str(self.retry_after)},
+                {"error": "Too many requests"},
+            )
+        self.calls[f"{method} {endpoint}"] += 1
+        if method == "POST" and url.path == "/api/v1/statuses":
+            status_id = str(next(self.status_ids))
+            return (
+                "200 OK",
+                {},
+                {"id": status_id, "url": f"http://fake.test/{status_id}"},
+            )
+        if method == "POST":
+            # bookmarks
+            return "200 OK", {}, {}
+        if url.path == "/api/v1/accounts/verify_credentials":
+            return "200 OK", {}, BOT
+        if url.path == "/api/v1/accounts/lookup":
+            return "200 OK", {}, get_account(query["acct"][0])
+        if url.path == "/api/v1/accounts/relationships":
+            # everyone follows the bot
+            ids = query.get("id[]", [])
+            return "200 OK", {}, [{"id": i, "followed_by": True} for i in ids]
+        if url.path == "/api/v1/notifications":
+            return "200 OK", {}, []
+        if endpoint == "/api/v1/statuses/:id":
+            return (
+                "200 OK",
+                {},
+                {
+                    "id": path[-1],
+                    "url": f"http://fake.test/{path[-1]}",
+                    "account": BOT,
+                    "in_reply_to_account_id": "2",
+                },
+            )
+        if endpoint == "/api/v1/accounts/:id":
+            return "200 OK", {}, get_account(f"anonymous{path[-1]}@fake.test")
+        return "404 Not Found", {}, {"error": "Record not found"}
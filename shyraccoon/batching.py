@@ -0,0 +1,53 @@
+import asyncio
+
+
+class Batcher:
+    """
+    Coalesce lookups made within `delay` seconds of each other into a single
+    call to `fetch`, which receives a list of keys and returns a dict of
+    results keyed by those keys.
+    """
+
+    def __init__(self, fetch, delay, max_size):
+        self.fetch = fetch
+        self.delay = delay
+        self.max_size = max_size
+        self.pending = {}
+        self.timer = None
+        self.tasks = set()
+
+    async def get(self, key):
+        future = self.pending.get(key)
+        if future is None:
+            loop = asyncio.get_running_loop()
+            future = loop.create_future()
+            self.pending[key] = future
+            if len(self.pending) >= self.max_size:
+                self.flush()
+            elif self.timer is None:
+                self.timer = loop.call_later(self.delay, self.flush)
+        # a cancelled caller shouldn't cancel the lookup for other callers
+        return await asyncio.shield(future)
+
+    def flush(self):
+        if self.timer is not None:
+            self.timer.cancel()
+            self.timer = None
+        batch, self.pending = self.pending, {}
+        if batch:
+            task = asyncio.create_task(self.run(batch))
+            # keep a reference until the task is done
+            self.tasks.add(task)
+            task.add_done_callback(self.tasks.discard)
+
+    async def run(self, batch):
+        try:
+            results = await self.fetch(list(batch))
+        except Exception as e:
+            for future in batch.values():
+                if not future.done():
+                    future.set_exception(e)
+            return
+        for key, future in batch.items():
+            if not future.done():
+                future.set_result(results.get(key))
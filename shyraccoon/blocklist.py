@@ -0,0 +1,125 @@
+import time
+
+
+def normalize(acct):
+    return acct.strip().lstrip("@").lower()
+
+
+class Blocklist:
+    """
+    Senders whose messages are dropped, either to everyone or to a given
+    recipient, keyed by lowercase acct.
+
+    Blocks are stored in the database, and kept in memory so messages can be
+    checked without a query. Blocks added by another process, e.g. with the
+    block command, are picked up within `reload_interval` seconds.
+
+    Reports are recorded too, so senders can be blocked automatically
+    after a number of reported messages.
+    """
+
+    # recipient of blocks applying to all recipients
+    ANYONE = ""
+
+    def __init__(self, connection, reload_interval, clock=time.monotonic):
+        self.connection = connection
+        self.reload_interval = reload_interval
+        self.clock = clock
+        self.connection.executescript("""
+            CREATE TABLE IF NOT EXISTS blocked_senders (
+                sender TEXT NOT NULL,
+                recipient TEXT NOT NULL,
+                reason TEXT,
+                created_at REAL NOT NULL,
+                PRIMARY KEY (sender, recipient)
+            );
+            CREATE TABLE IF NOT EXISTS reported_statuses (
+                id TEXT PRIMARY KEY,
+                sender TEXT NOT NULL,
+                created_at REAL NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS reported_statuses_sender
+                ON reported_statuses (sender);
+            """)
+        self.load()
+
+    def get_version(self):
+        row = self.connection.execute(
+            "SELECT value FROM state WHERE key = 'blocklist_version'"
+        ).fetchone()
+        return row["value"] if row else None
+
+    def load(self):
+        self.version = self.get_version()
+        self.loaded_at = self.clock()
+        rows = self.connection.execute(
+            "SELECT sender, recipient FROM blocked_senders"
+        ).fetchall()
+        self.blocked = {(row["sender"], row["recipient"]) for row in rows}
+
+    def refresh(self):
+        if self.clock() - self.loaded_at < self.reload_interval:
+            return
+        if self.get_version() != self.version:
+            self.load()
+        else:
+            self.loaded_at = self.clock()
+
+    def is_blocked(self, sender, recipient=None):
+        self.refresh()
+        sender = normalize(sender)
+        if (sender, self.ANYONE) in self.blocked:
+            return True
+        return recipient is not None and (sender, normalize(recipient)) in self.blocked
+
+    def block(self, sender, recipient=None, reason=None):
+        """
+        Block messages from `sender`, to `recipient` only if given.
+        """
+        key = (normalize(sender), normalize(recipient or self.ANYONE))
+        with self.connection:
+            self.connection.execute("BEGIN")
+            self.connection.execute(
+                "INSERT OR REPLACE INTO blocked_senders "
+                "(sender, recipient, reason, created_at) VALUES (?, ?, ?, ?)",
+                key + (reason, time.time()),
+            )
+            self.bump_version()
+        self.blocked.add(key)
+
+    def unblock(self, sender, recipient=None):
+        """
+        Remove a block, and return False if there was none.
+        """
+        key = (normalize(sender), normalize(recipient or self.ANYONE))
+        with self.connection:
+            self.connection.execute("BEGIN")
+            cursor = self.connection.execute(
+                "DELETE FROM blocked_senders WHERE sender = ? AND recipient = ?", key
+            )
+            self.bump_version()
+        self.blocked.discard(key)
+        return cursor.rowcount == 1
+
+    def bump_version(self):
+        # tells other processes to reload the blocklist
+        self.connection.execute(
+            "INSERT INTO state (key, value) VALUES ('blocklist_version', 1) "
+            "ON CONFLICT (key) DO UPDATE SET value = value + 1"
+        )
+
+    def add_report(self, status_id, sender):
+        """
+        Record a report of the status `status_id`, forwarded from `sender`,
+        and return the number of reported statuses from the sender.
+        """
+        self.connection.execute(
+            "INSERT OR IGNORE INTO reported_statuses (id, sender, created_at) "
+            "VALUES (?, ?, ?)",
+            (status_id, normalize(sender), time.time()),
+        )
+        row = self.connection.execute(
+            "SELECT COUNT(*) AS reports FROM reported_statuses WHERE sender = ?",
+            (normalize(sender),),
+        ).fetchone()
+        return row["reports"]
@@ -0,0 +1,45 @@
+from . import cache
+from . import followers
+from . import settings
+from . import templates
+from . import throttle
+
+
+class Bot:
+    """
+    A bot account, with its settings and the state kept while it runs.
+
+    `profile` is the result of settings.load_profile(). Several bots can run
+    in the same process, and share the HTTP client, the rate limits and the
+    workers.
+    """
+
+    def __init__(self, profile):
+        self.settings = profile
+        self.name = profile.BOT_NAME
+        # compiled on startup, so invalid templates are reported right away
+        self.templates = templates.load(profile)
+        # paces all requests to the API
+        self.throttle = throttle.Throttle(
+            rate=profile.API_RATE, burst=profile.API_BURST
+        )
+        # recipients lookups, keyed by lowercase acct, and relationships with
+        # the bot account, keyed by account id
+        self.accounts_cache = cache.TTLCache(
+            maxsize=settings.CACHE_SIZE, ttl=settings.CACHE_TTL
+        )
+        self.relationships_cache = cache.TTLCache(
+            maxsize=settings.CACHE_SIZE, ttl=settings.CACHE_TTL
+        )
+        # the index is considered stale if a reload is late or has failed
+        self.followers = followers.FollowerIndex(
+            max_age=settings.FOLLOWERS_RELOAD_INTERVAL * 2
+        )
+        # created on first use
+        self.outbox = None
+        self.notifications = None
+        self.forwards = None
+        self.blocklist = None
+
+    def __repr__(self):
+        return f"<Bot {self.name or self.settings.SERVER_URL}>"
@@ -0,0 +1,53 @@
+import collections
+import time
+
+MISSING = object()
+
+
+class TTLCache:
+    """
+    In-memory cache where entries expire after `ttl` seconds, and the least
+    recently used entries are evicted once `maxsize` is reached.
+    """
+
+    def __init__(self, maxsize, ttl, clock=time.monotonic):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.clock = clock
+        self.entries = collections.OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self.entries)
+
+    def get(self, key, default=MISSING):
+        try:
+            expires_at, value = self.entries[key]
+        except KeyError:
+            self.misses += 1
+            return default
+        if expires_at <= self.clock():
+            del self.entries[key]
+            self.misses += 1
+            return default
+        self.entries.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def set(self, key, value):
+        self.entries[key] = (self.clock() + self.ttl, value)
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.maxsize:
+            self.entries.popitem(last=False)
+
+    def invalidate(self, key):
+        self.entries.pop(key, None)
+
+    def clear(self):
+        self.entries.clear()
+        self.hits = 0
+        self.misses = 0
+
+    def stats(self):
+        return {"size": len(self.entries), "hits": self.hits, "misses": self.misses}
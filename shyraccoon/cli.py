@@ -1,10 +1,20 @@
 import asyncio
 import logging
+import os
+import signal
+import socket
+import time
 
 import click
+import limits
 
+from . import blocklist
+from . import db
+from . import eventqueue
 from . import main
+from . import metrics
 from . import settings
+from . import workers
 
 
 @click.group()
@@ -12,50 +22,478 @@ def cli():
     pass
 
 
-@cli.command
-def stream():
+def echo_dry_run():
     if settings.DRY_RUN:
         click.echo(
             "Starting in DRY_RUN mode, no data will be modified, no statuses will be posted."
         )
+
+
+@cli.command
+def stream():
+    """
+    Receive notifications with the streaming API, and poll them while the
+    stream is down.
+    """
+    echo_dry_run()
+    asyncio.run(run(handle_events(streaming=True)))
+
+
+@cli.command
+def poll():
+    """
+    Poll notifications, for servers where the streaming API doesn't work.
+    """
+    echo_dry_run()
+    asyncio.run(run(handle_events(streaming=False)))
+
+
+@cli.command
+def reader():
+    """
+    Receive notifications and queue them for worker processes. Several
+    readers can be started, only one of them receives notifications at a time.
+    """
+    asyncio.run(run(read_events()))
+
+
+@cli.command
+def worker():
+    """
+    Handle notifications queued by the reader.
+    """
+    if isinstance(main.limits_storage, limits.storage.MemoryStorage):
+        raise click.ClickException(
+            "Workers must share rate limits, set RATE_LIMIT_STORAGE_URL to a "
+            "sqlite:// or redis:// storage."
+        )
+    echo_dry_run()
+    asyncio.run(run(work()))
+
+
+def get_cli_bot(name):
+    bots = main.get_bots()
+    if name is None and len(bots) == 1:
+        return bots[0]
+    for bot in bots:
+        if bot.name == name:
+            return bot
+    raise click.ClickException(
+        f"Choose a bot with --bot: {', '.join(bot.name for bot in bots)}"
+    )
+
+
+@cli.command
+@click.argument("sender")
+@click.option("--recipient", help="Only block messages to this account.")
+@click.option("--reason", help="Kept with the block, for moderators.")
+@click.option("--bot", "bot_name", help="Name of the bot, with several BOTS.")
+def block(sender, recipient, reason, bot_name):
+    """
+    Drop messages from SENDER, e.g. user@server.test, without any API call.
+    """
+    if not blocklist.normalize(sender):
+        raise click.BadParameter("empty account", param_hint="SENDER")
+    bot = get_cli_bot(bot_name)
+    token = main.CURRENT_BOT.set(bot)
+    try:
+        main.get_blocklist().block(sender, recipient=recipient, reason=reason)
+    finally:
+        main.CURRENT_BOT.reset(token)
+    target = f" to {recipient}" if recipient else ""
+    click.echo(f"Blocked messages from {sender}{target}")
+
+
+@cli.command
+@click.argument("sender")
+@click.option("--recipient", help="Remove the block of messages to this account.")
+@click.option("--bot", "bot_name", help="Name of the bot, with several BOTS.")
+def unblock(sender, recipient, bot_name):
+    """
+    Allow messages from SENDER again.
+    """
+    bot = get_cli_bot(bot_name)
+    token = main.CURRENT_BOT.set(bot)
+    try:
+        removed = main.get_blocklist().unblock(sender, recipient=recipient)
+    finally:
+        main.CURRENT_BOT.reset(token)
+    target = f" to {recipient}" if recipient else ""
+    if not removed:
+        raise click.ClickException(f"Messages from {sender}{target} weren't blocked")
+    click.echo(f"Unblocked messages from {sender}{target}")
+
+
+async def run(coroutine):
+    try:
+        await coroutine
+    finally:
+        await main.close_http_client()
+
+
+def start_tasks():
+    """
+    Start the tasks needed in every process, and return them.
+    """
+    tasks = [
+        asyncio.create_task(main.prune_limits(settings.RATE_LIMIT_PRUNE_INTERVAL)),
+    ]
+    if settings.METRICS_PORT:
+        tasks.append(
+            asyncio.create_task(
+                metrics.serve(settings.METRICS_HOST, settings.METRICS_PORT)
+            )
+        )
+    # reload settings with `systemctl reload` or `kill -HUP`
+    asyncio.get_running_loop().add_signal_handler(signal.SIGHUP, reload_settings)
+    if settings.ENV_FILE and settings.CONFIG_WATCH_INTERVAL:
+        tasks.append(
+            asyncio.create_task(
+                main.watch_file(
+                    settings.ENV_FILE, settings.CONFIG_WATCH_INTERVAL, reload_settings
+                )
+            )
+        )
+    return tasks
+
+
+def reload_settings():
+    logging.info("Reloading settings…")
+    try:
+        main.reload_settings()
+    except Exception as e:
+        logging.error("Invalid settings, keeping the current ones: %r", e)
+    else:
+        logging.info("Settings reloaded")
+
+
+def get_process_id():
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+
+def get_event_queue():
+    return eventqueue.EventQueue(db.get_connection(), lease=settings.QUEUE_LEASE)
+
+
+async def get_user_data(bot):
     click.echo("Getting user info…")
-    user_data = main.get_data(
-        server_url=settings.SERVER_URL,
-        access_token=settings.ACCESS_TOKEN,
+    user_data = await main.get_data(
+        server_url=bot.settings.SERVER_URL,
+        access_token=bot.settings.ACCESS_TOKEN,
         path="/api/v1/accounts/verify_credentials",
     )
     click.echo(f"Logged in as {user_data['url']}")
-    click.echo("Starting stream…")
+    return user_data
 
-    def handle_event(event):
+
+def get_notification_handler(bot, user_data):
+    async def handle_notification(event):
         logging.debug("Received event: %s", event)
         action = None
         if event["event"] == "notification" and event["data"]["type"] == "follow":
+            # the new follower may now receive messages
+            main.add_follower(event["data"]["account"])
             action = {
                 "action": "follow",
                 "sender": event["data"]["account"],
                 "bot_data": user_data,
             }
         elif event["event"] == "notification" and event["data"]["type"] == "mention":
-            action = main.handle_message(
-                event["data"]["status"],
-                bot_data=user_data,
-                server_url=settings.SERVER_URL,
-                access_token=settings.ACCESS_TOKEN,
-            )
+            with metrics.MESSAGE_SECONDS.time(action="error") as timer:
+                action = await main.handle_message(
+                    event["data"]["status"],
+                    bot_data=user_data,
+                    server_url=bot.settings.SERVER_URL,
+                    access_token=bot.settings.ACCESS_TOKEN,
+                )
+                timer.labels["action"] = action["action"] if action else "none"
         if action:
             logging.info("Handling action %s", action)
+            metrics.ACTIONS.inc(action=action["action"])
             handler = getattr(main, f'handle_{action["action"]}')
-            handler(action)
-
-    asyncio.run(
-        main.start_stream(
-            server_url=settings.SERVER_URL,
-            streaming_url=settings.STREAMING_URL,
-            access_token=settings.ACCESS_TOKEN,
-            callback=handle_event,
+            with metrics.ACTION_SECONDS.time(action=action["action"]):
+                await handler(action)
+
+    return handle_notification
+
+
+async def handle_events(streaming):
+    # all bots share the workers, events from a given sender are handled in
+    # order, but several senders can be handled concurrently
+    handlers = {}
+
+    async def handle_event(event):
+        bot = event["bot"]
+        await main.run_as(bot, handlers[bot](event))
+
+    def get_key(event):
+        return (event["bot"].name, main.get_event_sender(event))
+
+    pool = workers.WorkerPool(
+        handle_event,
+        key=get_key,
+        size=settings.WORKERS,
+        high_water=settings.QUEUE_HIGH_WATER,
+    )
+    pool.start()
+    metrics.QUEUE_DEPTH.set_function(lambda: pool.depth)
+    tasks = start_tasks()
+
+    async def serve_bot(bot):
+        user_data = await get_user_data(bot)
+        handle_notification = get_notification_handler(bot, user_data)
+        tracker = main.get_notification_tracker()
+
+        async def handle_event(event):
+            # the event is handled again if the process stops before it is
+            # finished, its actions are then resumed instead of sent again
+            token = main.EVENT_ID.set(f"{bot.name}:{event['data']['id']}")
+            try:
+                await handle_notification(event)
+            finally:
+                main.EVENT_ID.reset(token)
+                tracker.finish(event["data"]["id"])
+
+        handlers[bot] = handle_event
+
+        async def publish(event):
+            await pool.submit({**event, "bot": bot})
+
+        background_tasks = [
+            # finish actions interrupted by a previous shutdown or an outage
+            asyncio.create_task(main.resume_outbox(settings.OUTBOX_RESUME_INTERVAL)),
+            asyncio.create_task(main.prune_history(settings.OUTBOX_RETENTION / 10)),
+        ]
+        if settings.FOLLOWERS_RELOAD_INTERVAL:
+            background_tasks.append(
+                asyncio.create_task(
+                    main.sync_followers(
+                        server_url=bot.settings.SERVER_URL,
+                        account_id=user_data["id"],
+                        access_token=bot.settings.ACCESS_TOKEN,
+                        interval=settings.FOLLOWERS_RELOAD_INTERVAL,
+                    )
+                )
+            )
+        try:
+            await receive_events(bot, streaming, publish)
+        finally:
+            for task in background_tasks:
+                task.cancel()
+
+    try:
+        # compiles templates, so invalid ones are reported before connecting
+        bots = main.get_bots()
+        await asyncio.gather(*[main.run_as(bot, serve_bot(bot)) for bot in bots])
+    finally:
+        for task in tasks:
+            task.cancel()
+        await pool.stop()
+
+
+async def receive_events(bot, streaming, publish):
+    """
+    Receive the notifications of a bot, and pass the new ones to `publish`.
+    """
+    server_url = bot.settings.SERVER_URL
+    access_token = bot.settings.ACCESS_TOKEN
+    tracker = main.get_notification_tracker()
+
+    async def submit(event):
+        if event["event"] != "notification":
+            return
+        if not tracker.start(event["data"]["id"]):
+            logging.debug("Skipping already received event: %s", event)
+            return
+        await publish(event)
+
+    async def catch_up():
+        if not tracker.cursor:
+            # first run, nothing to catch up with
+            return
+        # live events may be handled meanwhile, the cursor must not move
+        # past the missed notifications until they are received
+        cursor = tracker.hold()
+        logging.info("Fetching notifications received since %s…", cursor)
+        try:
+            async for notification in main.fetch_notifications(
+                server_url=server_url,
+                access_token=access_token,
+                min_id=cursor,
+            ):
+                await submit({"event": "notification", "data": notification})
+        except Exception:
+            logging.exception("Could not fetch missed notifications")
+        finally:
+            tracker.release(cursor)
+
+    stream_state = {"connected": False, "down_since": time.monotonic()}
+
+    async def on_connect():
+        stream_state["connected"] = True
+        # catch up in the background, so live events are received meanwhile
+        background_tasks.append(asyncio.create_task(catch_up()))
+
+    async def on_disconnect():
+        stream_state["connected"] = False
+        stream_state["down_since"] = time.monotonic()
+
+    def should_poll():
+        if not streaming:
+            return True
+        return (
+            not stream_state["connected"]
+            and time.monotonic() - stream_state["down_since"]
+            > settings.STREAM_FALLBACK_DELAY
+        )
+
+    polling = asyncio.create_task(
+        main.poll_notifications(
+            server_url=server_url,
+            access_token=access_token,
+            callback=submit,
+            get_cursor=lambda: tracker.cursor,
+            min_interval=settings.POLL_MIN_INTERVAL,
+            max_interval=settings.POLL_MAX_INTERVAL,
+            should_poll=should_poll,
         )
     )
+    background_tasks = [polling]
+    try:
+        if streaming:
+            click.echo("Starting stream…")
+            await main.start_stream(
+                server_url=server_url,
+                streaming_url=bot.settings.STREAMING_URL,
+                stream=bot.settings.STREAMING_STREAM,
+                access_token=access_token,
+                callback=submit,
+                on_connect=on_connect,
+                on_disconnect=on_disconnect,
+                events={"notification"},
+            )
+        else:
+            click.echo("Polling notifications…")
+            await polling
+    finally:
+        for task in background_tasks:
+            task.cancel()
+
+
+async def read_events():
+    queue = get_event_queue()
+    reader_id = get_process_id()
+    bots = main.get_bots()
+    tasks = start_tasks()
+
+    async def read_bot(bot):
+        await get_user_data(bot)
+        tracker = main.get_notification_tracker()
+
+        async def publish(event):
+            # once queued, the event won't be lost, so the cursor can move on
+            queue.publish(bot.name, event, sender=main.get_event_sender(event))
+            tracker.finish(event["data"]["id"])
+
+        background_tasks = [
+            # workers may still be running recent actions
+            asyncio.create_task(
+                main.resume_outbox(
+                    settings.OUTBOX_RESUME_INTERVAL,
+                    older_than=settings.OUTBOX_RESUME_INTERVAL,
+                )
+            ),
+            asyncio.create_task(main.prune_history(settings.OUTBOX_RETENTION / 10)),
+        ]
+        try:
+            await receive_events(bot, streaming=True, publish=publish)
+        finally:
+            for task in background_tasks:
+                task.cancel()
+
+    async def prune_queue():
+        while True:
+            await asyncio.sleep(settings.QUEUE_RETENTION / 10)
+            deleted = queue.prune(settings.QUEUE_RETENTION)
+            logging.debug("[Queue] Pruned %s handled events", deleted)
+
+    try:
+        while True:
+            if not queue.acquire_lease("reader", reader_id):
+                await asyncio.sleep(settings.QUEUE_LEASE / 3)
+                continue
+            click.echo("Elected as reader")
+            reading = asyncio.gather(
+                *[main.run_as(bot, read_bot(bot)) for bot in bots],
+                prune_queue(),
+            )
+            try:
+                while not reading.done():
+                    await asyncio.wait([reading], timeout=settings.QUEUE_LEASE / 3)
+                    if not reading.done() and not queue.acquire_lease(
+                        "reader", reader_id
+                    ):
+                        # e.g. this process was paused, another reader took over
+                        logging.warning("[Queue] Lost the reader lease")
+                        break
+            finally:
+                if not reading.done():
+                    reading.cancel()
+                    await asyncio.wait([reading])
+            if not reading.cancelled():
+                # raises the error that stopped the reader
+                reading.result()
+    finally:
+        queue.release_lease("reader", reader_id)
+        for task in tasks:
+            task.cancel()
+
+
+async def work():
+    queue = get_event_queue()
+    worker_id = get_process_id()
+    main.CACHE_NOT_FOLLOWED = False
+    bots = {bot.name: bot for bot in main.get_bots()}
+    handlers = {}
+    for name, bot in bots.items():
+        user_data = await main.run_as(bot, get_user_data(bot))
+        handlers[name] = get_notification_handler(bot, user_data)
+    metrics.QUEUE_DEPTH.set_function(queue.depth)
+    tasks = start_tasks()
+
+    async def keep_lease(queue_id):
+        while True:
+            await asyncio.sleep(settings.QUEUE_LEASE / 3)
+            if not queue.extend(queue_id, worker_id):
+                logging.warning("[Queue] Lost the lease of event %s", queue_id)
+                return
+
+    async def consume():
+        while True:
+            claimed = queue.claim(worker_id)
+            if claimed is None:
+                await asyncio.sleep(settings.QUEUE_POLL_INTERVAL)
+                continue
+            queue_id, name, event = claimed
+            lease = asyncio.create_task(keep_lease(queue_id))
+            # if the event was claimed before, e.g. by a worker that died,
+            # its actions are resumed instead of being sent again
+            token = main.EVENT_ID.set(f"{name}:{event['data']['id']}")
+            try:
+                await main.run_as(bots[name], handlers[name](event))
+            except Exception:
+                logging.exception("Error while handling event %s", event)
+            finally:
+                main.EVENT_ID.reset(token)
+                lease.cancel()
+            queue.complete(queue_id)
+
+    click.echo("Waiting for events…")
+    try:
+        await asyncio.gather(*[consume() for _ in range(settings.WORKERS)])
+    finally:
+        for task in tasks:
+            task.cancel()
 
 
 if __name__ == "__main__":
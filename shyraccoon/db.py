@@ -0,0 +1,49 @@
+import sqlite3
+
+from . import settings
+
+# connections, keyed by database path
+connections = {}
+
+
+def get_connection(path=None):
+    """
+    Return the connection to a bot's SQLite database, where data that must
+    survive restarts is stored. Defaults to DATABASE_PATH.
+    """
+    path = path or settings.DATABASE_PATH
+    if path not in connections:
+        connection = sqlite3.connect(
+            path,
+            timeout=5,
+            isolation_level=None,
+            check_same_thread=False,
+        )
+        connection.row_factory = sqlite3.Row
+        connection.execute("PRAGMA journal_mode=WAL")
+        connection.execute(
+            "CREATE TABLE IF NOT EXISTS state (key TEXT PRIMARY KEY, value TEXT)"
+        )
+        connections[path] = connection
+    return connections[path]
+
+
+def get_value(key, default=None, path=None):
+    row = (
+        get_connection(path)
+        .execute("SELECT value FROM state WHERE key = ?", (key,))
+        .fetchone()
+    )
+    return row["value"] if row else default
+
+
+def set_value(key, value, path=None):
+    get_connection(path).execute(
+        "INSERT OR REPLACE INTO state (key, value) VALUES (?, ?)", (key, value)
+    )
+
+
+def close_connection():
+    while connections:
+        _, connection = connections.popitem()
+        connection.close()
@@ -0,0 +1,151 @@
+import json
+import time
+
+
+class EventQueue:
+    """
+    Durable queue of notification events, shared by a reader process and
+    several worker processes through a SQLite database.
+
+    Events are unique per bot and notification id, so an event published
+    twice, e.g. by a new reader catching up after a failover, is only
+    handled once. A claimed event is leased to a worker for `lease` seconds:
+    if the worker dies, the event is handed to another worker once the lease
+    expires. Events from a given sender are claimed in order, one at a time.
+    """
+
+    def __init__(self, connection, lease, clock=time.time):
+        self.connection = connection
+        self.lease = lease
+        self.clock = clock
+        self.connection.executescript("""
+            CREATE TABLE IF NOT EXISTS event_queue (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                bot TEXT NOT NULL,
+                notification_id TEXT NOT NULL,
+                sender TEXT,
+                event TEXT NOT NULL,
+                status TEXT NOT NULL DEFAULT 'pending',
+                worker TEXT,
+                locked_until REAL,
+                created_at REAL NOT NULL,
+                UNIQUE (bot, notification_id)
+            );
+            CREATE INDEX IF NOT EXISTS event_queue_status
+                ON event_queue (status, id);
+            -- previous events of a sender, without the handled ones kept
+            -- to detect duplicates
+            CREATE INDEX IF NOT EXISTS event_queue_sender
+                ON event_queue (bot, sender, id) WHERE status != 'done';
+            CREATE TABLE IF NOT EXISTS leases (
+                name TEXT PRIMARY KEY,
+                holder TEXT NOT NULL,
+                expires_at REAL NOT NULL
+            );
+            """)
+
+    def publish(self, bot, event, sender=None):
+        """
+        Add an event to the queue, and return False if it was already there.
+        """
+        cursor = self.connection.execute(
+            "INSERT OR IGNORE INTO event_queue "
+            "(bot, notification_id, sender, event, created_at) "
+            "VALUES (?, ?, ?, ?, ?)",
+            (bot, event["data"]["id"], sender, json.dumps(event), self.clock()),
+        )
+        return cursor.rowcount == 1
+
+    def claim(self, worker):
+        """
+        Lease the next available event to `worker`, and return it with its
+        queue id and bot name, or None if there is nothing to do.
+        """
+        now = self.clock()
+        with self.connection:
+            self.connection.execute("BEGIN IMMEDIATE")
+            row = self.connection.execute(
+                """
+                SELECT id, bot, event FROM event_queue AS e
+                WHERE (status = 'pending'
+                       OR (status = 'processing' AND locked_until < :now))
+                AND NOT EXISTS (
+                    SELECT 1 FROM event_queue AS previous
+                    WHERE previous.bot = e.bot
+                    AND previous.sender = e.sender
+                    AND previous.id < e.id
+                    AND previous.status != 'done'
+                )
+                ORDER BY id LIMIT 1
+                """,
+                {"now": now},
+            ).fetchone()
+            if row is None:
+                return None
+            self.connection.execute(
+                "UPDATE event_queue SET status = 'processing', worker = ?, "
+                "locked_until = ? WHERE id = ?",
+                (worker, now + self.lease, row["id"]),
+            )
+        return row["id"], row["bot"], json.loads(row["event"])
+
+    def extend(self, queue_id, worker):
+        """
+        Extend the lease of an event being handled, and return False if it
+        was lost to another worker.
+        """
+        cursor = self.connection.execute(
+            "UPDATE event_queue SET locked_until = ? "
+            "WHERE id = ? AND worker = ? AND status = 'processing'",
+            (self.clock() + self.lease, queue_id, worker),
+        )
+        return cursor.rowcount == 1
+
+    def complete(self, queue_id):
+        self.connection.execute(
+            "UPDATE event_queue SET status = 'done', locked_until = NULL "
+            "WHERE id = ?",
+            (queue_id,),
+        )
+
+    def depth(self):
+        row = self.connection.execute(
+            "SELECT COUNT(*) AS depth FROM event_queue WHERE status != 'done'"
+        ).fetchone()
+        return row["depth"]
+
+    def prune(self, max_age):
+        """
+        Delete events handled more than `max_age` seconds ago. They are kept
+        until then to detect duplicates.
+        """
+        cursor = self.connection.execute(
+            "DELETE FROM event_queue WHERE status = 'done' AND created_at < ?",
+            (self.clock() - max_age,),
+        )
+        return cursor.rowcount
+
+    def acquire_lease(self, name, holder):
+        """
+        Acquire or renew the lease `name`, e.g. the reader leadership, and
+        return True if `holder` has it.
+        """
+        now = self.clock()
+        with self.connection:
+            self.connection.execute("BEGIN IMMEDIATE")
+            self.connection.execute(
+                "INSERT INTO leases (name, holder, expires_at) VALUES (?, ?, ?) "
+                "ON CONFLICT (name) DO UPDATE "
+                "SET holder = excluded.holder, expires_at = excluded.expires_at "
+                "WHERE leases.holder = excluded.holder OR leases.expires_at < ?",
+                (name, holder, now + self.lease, now),
+            )
+            row = self.connection.execute(
+                "SELECT holder FROM leases WHERE name = ?", (name,)
+            ).fetchone()
+        return row["holder"] == holder
+
+    def release_lease(self, name, holder):
+        self.connection.execute(
+            "DELETE FROM leases WHERE name = ? AND holder = ?", (name, holder)
+        )
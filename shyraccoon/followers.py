@@ -0,0 +1,50 @@
+import time
+
+
+class FollowerIndex:
+    """
+    Local set of the ids of accounts following the bot.
+
+    The index is fully reloaded on a regular basis, and updated in between
+    with follow notifications. It is considered stale once `max_age` seconds
+    have passed since the last reload, and shouldn't be trusted then.
+    """
+
+    def __init__(self, max_age, clock=time.monotonic):
+        self.max_age = max_age
+        self.clock = clock
+        self.ids = set()
+        self.loaded_at = None
+        # followers received while a reload is in progress, so they aren't
+        # lost when the reloaded ids replace the current ones
+        self.added_during_reload = None
+
+    def __contains__(self, account_id):
+        return account_id in self.ids
+
+    def __len__(self):
+        return len(self.ids)
+
+    def is_stale(self):
+        return self.loaded_at is None or self.clock() - self.loaded_at > self.max_age
+
+    def add(self, account_id):
+        self.ids.add(account_id)
+        if self.added_during_reload is not None:
+            self.added_during_reload.add(account_id)
+
+    def start_reload(self):
+        self.added_during_reload = set()
+
+    def finish_reload(self, ids):
+        self.ids = set(ids) | (self.added_during_reload or set())
+        self.added_during_reload = None
+        self.loaded_at = self.clock()
+
+    def cancel_reload(self):
+        self.added_during_reload = None
+
+    def clear(self):
+        self.ids = set()
+        self.loaded_at = None
+        self.added_during_reload = None
@@ -0,0 +1,64 @@
+import time
+
+
+class ForwardIndex:
+    """
+    Statuses forwarded by the bot, with the account of their anonymous
+    author, keyed by status id.
+
+    Reports reply to one of these statuses, so they can be resolved without
+    fetching the reported status and its author from the API. Since the index
+    links anonymous messages to their author, only what reports need is
+    stored, and entries are deleted with prune().
+    """
+
+    def __init__(self, connection):
+        self.connection = connection
+        self.connection.executescript("""
+            CREATE TABLE IF NOT EXISTS forwards (
+                id TEXT PRIMARY KEY,
+                url TEXT,
+                author_acct TEXT NOT NULL,
+                author_url TEXT,
+                created_at REAL NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS forwards_created_at ON forwards (created_at);
+            """)
+
+    def add(self, status, author):
+        self.connection.execute(
+            "INSERT OR REPLACE INTO forwards "
+            "(id, url, author_acct, author_url, created_at) VALUES (?, ?, ?, ?, ?)",
+            (
+                status["id"],
+                status.get("url"),
+                author["acct"],
+                author.get("url"),
+                time.time(),
+            ),
+        )
+
+    def get(self, status_id):
+        """
+        Return the id and url of the forwarded status, and the acct and url
+        of its author, or None if the status isn't in the index.
+        """
+        row = self.connection.execute(
+            "SELECT * FROM forwards WHERE id = ?", (status_id,)
+        ).fetchone()
+        if row is None:
+            return None
+        return (
+            {"id": row["id"], "url": row["url"]},
+            {"acct": row["author_acct"], "url": row["author_url"]},
+        )
+
+    def prune(self, max_age):
+        """
+        Delete statuses forwarded more than `max_age` seconds ago, reports
+        about them are then resolved with the API.
+        """
+        cursor = self.connection.execute(
+            "DELETE FROM forwards WHERE created_at < ?", (time.time() - max_age,)
+        )
+        return cursor.rowcount
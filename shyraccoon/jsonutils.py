@@ -0,0 +1,30 @@
+import json
+import re
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover
+    orjson = None
+
+# matches the event name in a streaming API message. Quotes are escaped
+# inside the payload, so this can only match the envelope's own key
+EVENT_RE = re.compile(r'"event"\s*:\s*"([^"]*)"')
+
+
+def loads(data):
+    """
+    Decode JSON with orjson when it's installed, and the standard library
+    otherwise.
+    """
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
+
+def peek_event(message):
+    """
+    Return the event name of a raw streaming API message without decoding
+    it, or None if it can't be found.
+    """
+    match = EVENT_RE.search(message)
+    return match.group(1) if match else None
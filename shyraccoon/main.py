@@ -1,80 +1,464 @@
-import json
+import asyncio
+import contextvars
 import logging
+import os
+import urllib.parse
 
+import httpx
 import limits
-import requests
 import websockets
 
+from . import batching
+from . import blocklist
+from . import bots
+from . import cache
+from . import db
+from . import forwards
+from . import jsonutils
+from . import metrics
+from . import notifications
+from . import outbox
+from . import parser
+from . import ratelimit
 from . import settings
+from . import storage
+from . import templates
+from . import throttle
 
-
-memory_storage = limits.storage.MemoryStorage()
+# importing .storage registers the sqlite:// scheme
+limits_storage = limits.storage.storage_from_string(settings.RATE_LIMIT_STORAGE_URL)
 GLOBAL_LIMITS = limits.parse_many(settings.RATE_LIMIT_USER_RATE)
 COUPLE_LIMITS = limits.parse_many(settings.RATE_LIMIT_USER_COUPLE_RATE)
-LIMITER = limits.strategies.MovingWindowRateLimiter(memory_storage)
+BURST_LIMITS = limits.parse_many(settings.RATE_LIMIT_USER_BURST_RATE)
+LIMITER = ratelimit.get_limiter(settings.RATE_LIMIT_STRATEGY, limits_storage)
+
+# pending relationships lookups, grouped by server and access token
+RELATIONSHIPS_BATCHERS = {}
+
+# disabled in worker processes: a follow handled by another worker doesn't
+# invalidate this process' cache, so the new follower would be seen as not
+# following the bot until the cached relationship expires
+CACHE_NOT_FOLLOWED = True
+
+# bots run by this process, created on first use
+BOTS = None
+
+# bot handling the current event, see run_as()
+CURRENT_BOT = contextvars.ContextVar("bot", default=None)
+
+# unique id of the event being handled, if it may be handled more than once
+EVENT_ID = contextvars.ContextVar("event_id", default=None)
+
+
+def get_bots():
+    global BOTS
+    if BOTS is None:
+        BOTS = [bots.Bot(profile) for profile in settings.get_profiles()]
+    return BOTS
+
+
+def get_bot():
+    """
+    Return the bot handling the current event, or the first one.
+    """
+    return CURRENT_BOT.get() or get_bots()[0]
+
+
+async def run_as(bot, coroutine):
+    """
+    Run a coroutine on behalf of `bot`. Tasks started by the coroutine
+    inherit the bot.
+    """
+    token = CURRENT_BOT.set(bot)
+    try:
+        return await coroutine
+    finally:
+        CURRENT_BOT.reset(token)
+
+
+for name, attribute in [
+    ("accounts", "accounts_cache"),
+    ("relationships", "relationships_cache"),
+]:
+    metrics.CACHE_REQUESTS.set_function(
+        lambda attribute=attribute: sum(
+            getattr(bot, attribute).hits for bot in BOTS or []
+        ),
+        cache=name,
+        result="hit",
+    )
+    metrics.CACHE_REQUESTS.set_function(
+        lambda attribute=attribute: sum(
+            getattr(bot, attribute).misses for bot in BOTS or []
+        ),
+        cache=name,
+        result="miss",
+    )
+
+# shared HTTP client, so connections to the server are pooled and kept alive
+# between API calls
+http_client = None
+
+
+def get_http_client():
+    global http_client
+    if http_client is None or http_client.is_closed:
+        http_client = httpx.AsyncClient(
+            limits=httpx.Limits(
+                max_connections=settings.HTTP_POOL_SIZE,
+                max_keepalive_connections=settings.HTTP_POOL_SIZE,
+                keepalive_expiry=settings.HTTP_KEEPALIVE_EXPIRY,
+            ),
+            timeout=httpx.Timeout(
+                settings.HTTP_TIMEOUT, connect=settings.HTTP_CONNECT_TIMEOUT
+            ),
+        )
+    return http_client
+
+
+async def close_http_client():
+    global http_client
+    if http_client is not None:
+        await http_client.aclose()
+        http_client = None
 
 
 def pass_limits(sender, recipient):
     if sender.lower() in settings.RATE_LIMIT_EXEMPTED_USERS:
         return True
-    global_results = [LIMITER.hit(l, [sender.lower()]) for l in GLOBAL_LIMITS]
+    # accounts are only unique on a given server
+    namespace = [get_bot().name] if get_bot().name else []
+    global_results = [
+        LIMITER.hit(l, namespace + [sender.lower()]) for l in GLOBAL_LIMITS
+    ]
     couple_results = [
-        LIMITER.hit(l, [sender.lower(), (recipient or "*").lower()])
+        LIMITER.hit(l, namespace + [sender.lower(), (recipient or "*").lower()])
         for l in COUPLE_LIMITS
     ]
+    if not all(global_results):
+        metrics.RATE_LIMIT_REJECTIONS.inc(limit="user")
+    elif not all(couple_results):
+        metrics.RATE_LIMIT_REJECTIONS.inc(limit="couple")
     return all(global_results + couple_results)
 
 
-def get_data(server_url, path, access_token):
+def admit(sender):
+    """
+    Cheap check made before any API call: return False if the sender already
+    reached their global limit, or sends too many messages in a short time.
+    Global and couple limits are only hit by pass_limits(), once the
+    recipient is known.
+    """
+    if sender.lower() in settings.RATE_LIMIT_EXEMPTED_USERS:
+        return True
+    namespace = [get_bot().name] if get_bot().name else []
+    if not all(LIMITER.test(l, namespace + [sender.lower()]) for l in GLOBAL_LIMITS):
+        metrics.RATE_LIMIT_REJECTIONS.inc(limit="user")
+        return False
+    # every message counts, even those that are rejected later
+    burst_results = [
+        LIMITER.hit(l, ["burst"] + namespace + [sender.lower()]) for l in BURST_LIMITS
+    ]
+    if not all(burst_results):
+        metrics.RATE_LIMIT_REJECTIONS.inc(limit="burst")
+        return False
+    return True
+
+
+async def prune_limits(interval):
+    while True:
+        await asyncio.sleep(interval)
+        deleted = storage.prune(limits_storage)
+        logging.debug("[RL] Pruned %s expired rate limit entries", deleted)
+
+
+def reload_settings():
+    """
+    Read the settings again, and switch to the new rate limits, templates
+    and bots settings at once. Stored rate limits, caches, connections and
+    pending actions are kept. If the new settings are invalid, an error is
+    raised and the current ones are kept.
+    """
+    global GLOBAL_LIMITS, COUPLE_LIMITS, BURST_LIMITS, LIMITER
+    values = settings.read_env_file(settings.ENV_FILE) if settings.ENV_FILE else {}
+    new_settings, profiles = settings.load(values)
+    if new_settings.BOTS != settings.BOTS:
+        raise ValueError("Restart to change BOTS")
+    global_limits = limits.parse_many(new_settings.RATE_LIMIT_USER_RATE)
+    couple_limits = limits.parse_many(new_settings.RATE_LIMIT_USER_COUPLE_RATE)
+    burst_limits = limits.parse_many(new_settings.RATE_LIMIT_USER_BURST_RATE)
+    limiter = ratelimit.get_limiter(new_settings.RATE_LIMIT_STRATEGY, limits_storage)
+    updates = []
+    for bot, profile in zip(get_bots(), profiles):
+        for key in settings.PROFILE_RESTART_REQUIRED:
+            if getattr(profile, key) != getattr(bot.settings, key):
+                logging.warning("[Settings] Restart to apply the new %s", key)
+                setattr(profile, key, getattr(bot.settings, key))
+        updates.append((bot, profile, templates.load(profile)))
+
+    # everything is valid, switch without yielding to other tasks
+    settings.update(new_settings, values)
+    GLOBAL_LIMITS, COUPLE_LIMITS, LIMITER = global_limits, couple_limits, limiter
+    BURST_LIMITS = burst_limits
+    for bot, profile, bot_templates in updates:
+        bot.settings = profile
+        bot.templates = bot_templates
+        bot.throttle.configure(rate=profile.API_RATE, burst=profile.API_BURST)
+
+
+async def watch_file(path, interval, callback):
+    """
+    Call `callback` whenever the file at `path` is modified.
+    """
+
+    def get_mtime():
+        try:
+            return os.stat(path).st_mtime_ns
+        except OSError:
+            return None
+
+    mtime = get_mtime()
+    while True:
+        await asyncio.sleep(interval)
+        new_mtime = get_mtime()
+        if new_mtime != mtime:
+            mtime = new_mtime
+            callback()
+
+
+async def get_response(server_url, path, access_token, priority=throttle.NORMAL):
     headers = {
         "authorization": f"Bearer {access_token}",
     }
     url = f"{server_url}{path}"
     logging.debug("GET Requesting %s…", url)
-    response = requests.get(url, headers=headers)
+    path_label = metrics.get_path_label(path)
+    bot_throttle = get_bot().throttle
+    with metrics.API_SECONDS.time(method="GET", path=path_label):
+        await bot_throttle.acquire(priority)
+        response = await get_http_client().get(url, headers=headers)
+    metrics.API_RESPONSES.inc(
+        method="GET", path=path_label, status=response.status_code
+    )
+    bot_throttle.update(response.headers)
     response.raise_for_status()
+    return response
+
+
+async def get_data(server_url, path, access_token, priority=throttle.NORMAL):
+    response = await get_response(server_url, path, access_token, priority)
     data = response.json()
     logging.debug("Received %s", data)
     return data
 
 
-def post_data(server_url, path, access_token, data):
+async def get_page(server_url, path, access_token, priority=throttle.NORMAL):
+    """
+    Fetch a page from a paginated endpoint, and return its data with
+    the path of the next page, if any.
+    """
+    response = await get_response(server_url, path, access_token, priority)
+    data = response.json()
+    logging.debug("Received %s", data)
+    next_url = response.links.get("next", {}).get("url")
+    if not next_url:
+        return data, None
+    # the link may use another host than server_url, e.g. with a WEB_DOMAIN
+    next_url = urllib.parse.urlsplit(next_url)
+    query = f"?{next_url.query}" if next_url.query else ""
+    return data, f"{next_url.path}{query}"
+
+
+async def post_data(
+    server_url,
+    path,
+    access_token,
+    data,
+    idempotency_key=None,
+    priority=throttle.NORMAL,
+):
     headers = {
         "authorization": f"Bearer {access_token}",
     }
+    if idempotency_key:
+        headers["idempotency-key"] = idempotency_key
     url = f"{server_url}{path}"
     logging.debug("POST Requesting %s with data %s…", url, data)
     if settings.DRY_RUN:
         logging.info("DRY_RUN is on, not posting anything")
         return {}
-    response = requests.post(url, json=data, headers=headers)
+    path_label = metrics.get_path_label(path)
+    bot_throttle = get_bot().throttle
+    with metrics.API_SECONDS.time(method="POST", path=path_label):
+        await bot_throttle.acquire(priority)
+        response = await get_http_client().post(url, json=data, headers=headers)
+    metrics.API_RESPONSES.inc(
+        method="POST", path=path_label, status=response.status_code
+    )
+    bot_throttle.update(response.headers)
     response.raise_for_status()
     data = response.json()
     logging.debug("Received %s", data)
     return data
 
 
-async def start_stream(server_url, streaming_url, access_token, callback):
-    s = requests.Session()
+async def start_stream(
+    server_url,
+    streaming_url,
+    access_token,
+    callback,
+    on_connect=None,
+    on_disconnect=None,
+    events=None,
+    stream="user",
+):
+    """
+    Pass events received from the streaming API to `callback`. If `events`
+    is given, other events are dropped before being decoded.
+    """
     url = f"{server_url}{streaming_url}"
     url = url.replace("http://", "ws://")
     url = url.replace("https://", "wss://")
-    url += "?stream=user"
+    url += f"?stream={stream}"
     headers = {"authorization": f"Bearer {access_token}"}
     logging.info("[WS] Connecting on %s…", url)
     async for websocket in websockets.connect(url, extra_headers=headers):
         logging.info("[WS] Connected!")
+        if on_connect:
+            await on_connect()
         while True:
             try:
                 message = await websocket.recv()
             except websockets.ConnectionClosed:
                 logging.info("[WS] Connection closed")
+                if on_disconnect:
+                    await on_disconnect()
                 break
-            message = json.loads(message)
+            if events is not None:
+                with metrics.STAGE_SECONDS.time(stage="stream_filter"):
+                    event = jsonutils.peek_event(message)
+                if event is not None and event not in events:
+                    logging.debug("[WS] Ignoring %s event", event)
+                    continue
+            with metrics.STAGE_SECONDS.time(stage="stream_decode"):
+                message = jsonutils.loads(message)
+                event = {
+                    "event": message["event"],
+                    "data": jsonutils.loads(message["payload"]),
+                }
             logging.debug(f"[WS] Received: %s", message)
-            callback(
-                {"event": message["event"], "data": json.loads(message["payload"])}
-            )
+            # the callback is expected to queue the event for processing,
+            # so it only blocks reception when the queue is full
+            with metrics.STAGE_SECONDS.time(stage="queue_wait"):
+                await callback(event)
+
+
+def get_notification_tracker():
+    bot = get_bot()
+    if bot.notifications is None:
+        path = bot.settings.DATABASE_PATH
+        bot.notifications = notifications.NotificationTracker(
+            cursor=db.get_value("notifications_cursor", path=path),
+            save_cursor=lambda cursor: db.set_value(
+                "notifications_cursor", cursor, path=path
+            ),
+            seen_size=settings.NOTIFICATIONS_SEEN_SIZE,
+            seen_ttl=settings.NOTIFICATIONS_SEEN_TTL,
+        )
+    return bot.notifications
+
+
+NOTIFICATIONS_QUERY = "types[]=mention&types[]=follow"
+
+
+async def get_latest_notification_id(server_url, access_token):
+    page = await get_data(
+        server_url,
+        f"/api/v1/notifications?{NOTIFICATIONS_QUERY}&limit=1",
+        access_token=access_token,
+    )
+    return page[0]["id"] if page else None
+
+
+async def fetch_notifications(server_url, access_token, min_id):
+    """
+    Yield mentions and follows received after the notification `min_id`,
+    oldest first, or all of them if `min_id` is None.
+    """
+    while True:
+        # min_id returns the notifications right after min_id, whereas
+        # since_id would return the most recent ones and leave a gap
+        query = f"min_id={min_id}&" if min_id else ""
+        page = await get_data(
+            server_url,
+            f"/api/v1/notifications?{query}{NOTIFICATIONS_QUERY}&limit=40",
+            access_token=access_token,
+        )
+        if not page:
+            return
+        page.sort(key=lambda n: notifications.id_key(n["id"]))
+        for notification in page:
+            yield notification
+        min_id = page[-1]["id"]
+
+
+async def poll_notifications(
+    server_url,
+    access_token,
+    callback,
+    get_cursor,
+    min_interval,
+    max_interval,
+    should_poll=lambda: True,
+):
+    """
+    Fetch new notifications periodically, and pass them to `callback`.
+
+    The interval between two fetches is reset to `min_interval` when
+    notifications are received, and doubles up to `max_interval` otherwise.
+    Polling is paused whenever `should_poll` returns False.
+    """
+    started = False
+    last_id = None
+    interval = min_interval
+    while True:
+        if not should_poll():
+            interval = min_interval
+            await asyncio.sleep(interval)
+            continue
+        received = 0
+        try:
+            if not started:
+                # start from the last handled notification, or from now
+                # on first run
+                last_id = get_cursor() or await get_latest_notification_id(
+                    server_url, access_token
+                )
+                started = True
+            # notifications may have been handled by other means meanwhile
+            cursor = get_cursor()
+            if cursor and (
+                not last_id
+                or notifications.id_key(cursor) > notifications.id_key(last_id)
+            ):
+                last_id = cursor
+            async for notification in fetch_notifications(
+                server_url, access_token, min_id=last_id
+            ):
+                await callback({"event": "notification", "data": notification})
+                last_id = notification["id"]
+                received += 1
+        except httpx.HTTPError:
+            logging.exception("[Poll] Could not fetch notifications")
+        logging.debug("[Poll] Received %s notifications", received)
+        interval = min_interval if received else min(max_interval, interval * 2)
+        await asyncio.sleep(interval)
+
+
+def get_event_sender(event):
+    if event["event"] != "notification":
+        return None
+    return event["data"].get("account", {}).get("acct")
 
 
 SKIP = {"action": "skip"}
@@ -89,35 +473,53 @@ def reply(message, recipient, in_reply_to_id=None):
     }
 
 
-def handle_message(
+async def handle_message(
     payload,
     bot_data,
     server_url,
     access_token,
 ):
+    bot = get_bot()
     account_data = payload.get("account", {})
     if account_data.get("id") == bot_data["id"]:
         return SKIP
 
+    sender = account_data.get("acct", "")
+    if get_blocklist().is_blocked(sender):
+        logging.debug("[Blocklist] Dropping message from %s", sender)
+        return SKIP
+
     if payload["visibility"] != "direct":
         return SKIP
 
     tags = payload.get("tags", []) or []
 
     for tag in tags:
-        if tag["name"].lower() in settings.REPORT_HASHTAGS:
+        if tag["name"].lower() in bot.settings.REPORT_HASHTAGS:
             # this is a report, we check that the reported message is
             # from us
             reported_id = payload.get("in_reply_to_id")
             if not reported_id:
                 return SKIP
+            forwarded = get_forwards().get(reported_id)
+            if forwarded:
+                reported_message, reported_message_author = forwarded
+                return {
+                    "action": "report",
+                    "anonymous_sender": reported_message_author,
+                    "sender": payload["account"],
+                    "reported_message": reported_message,
+                    "report": payload,
+                }
+            # the status was forwarded before it could be recorded, e.g. by
+            # an older version of the bot
             try:
-                reported_message = get_data(
+                reported_message = await get_data(
                     server_url,
                     f"/api/v1/statuses/{reported_id}",
                     access_token=access_token,
                 )
-            except requests.RequestException:
+            except httpx.HTTPError:
                 return SKIP
 
             if reported_message["account"]["id"] != bot_data["id"]:
@@ -126,7 +528,7 @@ def handle_message(
             if not reported_message.get("in_reply_to_account_id"):
                 return SKIP
 
-            reported_message_author = get_data(
+            reported_message_author = await get_data(
                 server_url,
                 f"/api/v1/accounts/{reported_message['in_reply_to_account_id']}",
                 access_token=access_token,
@@ -152,78 +554,73 @@ def handle_message(
     if not mentioned:
         return SKIP
 
-    content = payload["content"]
-    # ugly HTML cleanup
-    if content.startswith("<p>"):
-        content = content[3:]
-    if content.endswith("</p>"):
-        content = content[:-4]
-    content = content.replace("</p><p>", "\n\n")
-    # end of ugly HTML cleanup
-
-    words = content.split(" ")
-    mentioned_username = None
-    raw_username = None
-    for word in words:
-        if is_username(word):
-            raw_username = word
-            mentioned_username = clean_username(word)
+    # drop abusive senders before looking up the recipient
+    if not admit(payload["account"]["acct"]):
+        logging.warning(
+            "[RL] User %s has reached rate limits", payload["account"]["acct"]
+        )
+        return SKIP
+
+    mentioned_username, forwarded_message = parser.parse_message(
+        payload["content"], bot.settings.MENTION_PLACEHOLDER
+    )
+    if mentioned_username and get_blocklist().is_blocked(sender, mentioned_username):
+        logging.debug("[Blocklist] Dropping message from %s", sender)
+        return SKIP
     if not mentioned_username:
         return reply(
-            settings.ERROR_INVALID_ACCOUNT.format(
-                account="",
-                bot_account=bot_data["acct"],
-                recipient=settings.EXAMPLE_USERNAME,
+            bot.templates["error_invalid_account"].format(
+                account="", bot_account=bot_data["acct"]
             ),
             recipient=payload["account"],
             in_reply_to_id=payload["id"],
         )
     try:
-        recipient = get_data(
-            server_url,
-            f"/api/v1/accounts/lookup?acct={mentioned_username}",
-            access_token=access_token,
+        recipient = await lookup_account(
+            server_url, mentioned_username, access_token=access_token
         )
-    except requests.RequestException:
+    except httpx.HTTPError:
         return reply(
-            settings.ERROR_INVALID_ACCOUNT.format(
-                account=mentioned_username,
-                bot_account=bot_data["acct"],
-                recipient=settings.EXAMPLE_USERNAME,
+            bot.templates["error_invalid_account"].format(
+                account=mentioned_username, bot_account=bot_data["acct"]
             ),
             recipient=payload["account"],
             in_reply_to_id=payload["id"],
         )
 
+    # the recipient may have been mentioned with another name. Unlike the
+    # checks above, this one comes after the lookup, which calls the API when
+    # the account isn't cached, but before checking the relationship
+    if get_blocklist().is_blocked(sender, recipient["acct"]):
+        logging.debug("[Blocklist] Dropping message from %s", sender)
+        return SKIP
+
     # check if the other mentioned account is following shy raccoon
-    relationship = get_data(
-        server_url,
-        f'/api/v1/accounts/relationships?id[]={recipient["id"]}',
-        access_token=access_token,
-    )[0]
+    if bot.followers.is_stale():
+        relationship = await get_relationship(
+            server_url, recipient["id"], access_token=access_token
+        )
+        followed_by = relationship["followed_by"]
+    else:
+        followed_by = recipient["id"] in bot.followers
 
-    if not relationship["followed_by"]:
+    if not followed_by:
         # trigger a rate limit increase to avoid abuse / checking many accounts
         pass_limits(payload["account"]["acct"], recipient["acct"])
         return reply(
-            settings.SUCCESS_FORWARD_MESSAGE.format(recipient["acct"]),
+            bot.templates["success_forward"].format(recipient["acct"]),
             recipient=payload["account"],
             in_reply_to_id=payload["id"],
         )
 
-    spoiler_text = [settings.DEFAULT_CONTENT_WARNING]
+    spoiler_text = [bot.settings.DEFAULT_CONTENT_WARNING]
 
     if payload.get("spoiler_text"):
         spoiler_text.append(payload["spoiler_text"])
 
-    forwarded_message = prepare_for_forward(content)
-
     if not forwarded_message:
         return reply(
-            settings.ERROR_INVALID_MESSAGE.format(
-                bot_account=bot_data["acct"],
-                recipient=settings.EXAMPLE_USERNAME,
-            ),
+            bot.templates["error_invalid_message"].format(bot_account=bot_data["acct"]),
             recipient=payload["account"],
             in_reply_to_id=payload["id"],
         )
@@ -244,157 +641,325 @@ def handle_message(
     }
 
 
-def is_username(word):
-    return word.startswith(settings.MENTION_PLACEHOLDER) and len(word) > 1
+async def lookup_account(server_url, acct, access_token):
+    accounts_cache = get_bot().accounts_cache
+    account = accounts_cache.get(acct.lower())
+    if account is cache.MISSING:
+        account = await get_data(
+            server_url,
+            f"/api/v1/accounts/lookup?acct={acct}",
+            access_token=access_token,
+        )
+        accounts_cache.set(acct.lower(), account)
+    return account
+
+
+async def get_relationships(server_url, account_ids, access_token):
+    query = "&".join(f"id[]={account_id}" for account_id in account_ids)
+    relationships = await get_data(
+        server_url,
+        f"/api/v1/accounts/relationships?{query}",
+        access_token=access_token,
+    )
+    return {
+        relationship.get("id", account_id): relationship
+        for account_id, relationship in zip(account_ids, relationships)
+    }
+
+
+def get_relationships_batcher(server_url, access_token):
+    key = (server_url, access_token)
+    if key not in RELATIONSHIPS_BATCHERS:
+
+        async def fetch(account_ids):
+            return await get_relationships(
+                server_url, account_ids, access_token=access_token
+            )
+
+        RELATIONSHIPS_BATCHERS[key] = batching.Batcher(
+            fetch,
+            delay=settings.RELATIONSHIPS_BATCH_DELAY,
+            max_size=settings.RELATIONSHIPS_BATCH_SIZE,
+        )
+    return RELATIONSHIPS_BATCHERS[key]
+
+
+async def get_relationship(server_url, account_id, access_token):
+    relationships_cache = get_bot().relationships_cache
+    relationship = relationships_cache.get(account_id)
+    if relationship is cache.MISSING:
+        batcher = get_relationships_batcher(server_url, access_token)
+        relationship = await batcher.get(account_id)
+        if relationship is None:
+            # unknown account, don't cache it
+            return {"id": account_id, "followed_by": False}
+        if relationship.get("followed_by") or CACHE_NOT_FOLLOWED:
+            relationships_cache.set(account_id, relationship)
+    return relationship
+
+
+async def load_followers(server_url, account_id, access_token):
+    ids = set()
+    path = f"/api/v1/accounts/{account_id}/followers?limit=80"
+    while path:
+        accounts, path = await get_page(
+            server_url, path, access_token=access_token, priority=throttle.LOW
+        )
+        ids.update(account["id"] for account in accounts)
+    return ids
+
+
+async def reload_followers(server_url, account_id, access_token):
+    followers = get_bot().followers
+    followers.start_reload()
+    try:
+        ids = await load_followers(server_url, account_id, access_token=access_token)
+    except Exception:
+        followers.cancel_reload()
+        raise
+    followers.finish_reload(ids)
+    logging.info("[Followers] Loaded %s followers", len(followers))
+
+
+async def sync_followers(server_url, account_id, access_token, interval):
+    while True:
+        try:
+            await reload_followers(server_url, account_id, access_token=access_token)
+        except httpx.HTTPError:
+            logging.exception("[Followers] Could not load followers")
+        await asyncio.sleep(interval)
+
+
+def add_follower(account):
+    get_bot().followers.add(account["id"])
+    invalidate_account(account)
+
+
+def invalidate_account(account):
+    get_bot().accounts_cache.invalidate(account["acct"].lower())
+    get_bot().relationships_cache.invalidate(account["id"])
+
+
+async def execute_step(step):
+    # statuses are seen by users, bookmarks are only housekeeping
+    if step["path"].endswith("/bookmark"):
+        priority = throttle.LOW
+    else:
+        priority = throttle.HIGH
+    bot = get_bot()
+    return await post_data(
+        server_url=bot.settings.SERVER_URL,
+        path=step["path"],
+        access_token=bot.settings.ACCESS_TOKEN,
+        data=step["data"],
+        idempotency_key=step["idempotency_key"],
+        priority=priority,
+    )
+
+
+async def resume_outbox(interval, older_than=0):
+    """
+    Complete pending actions every `interval` seconds, e.g. those that
+    failed while the server was down. Actions created less than `older_than`
+    seconds ago are left to the process that created them.
+    """
+    while True:
+        await get_outbox().resume(older_than)
+        await asyncio.sleep(interval)
+
+
+async def prune_history(interval):
+    """
+    Delete completed actions and forwarded statuses once they are older than
+    their retention period, as they link anonymous messages to their author.
+    """
+    while True:
+        deleted = get_outbox().prune(settings.OUTBOX_RETENTION)
+        logging.debug("[Outbox] Pruned %s completed actions", deleted)
+        deleted = get_forwards().prune(settings.FORWARDS_RETENTION)
+        logging.debug("[Forwards] Pruned %s forwarded statuses", deleted)
+        await asyncio.sleep(interval)
+
+
+def get_outbox():
+    bot = get_bot()
+    if bot.outbox is None:
+        bot.outbox = outbox.Outbox(
+            db.get_connection(bot.settings.DATABASE_PATH),
+            execute=execute_step,
+            max_attempts=settings.OUTBOX_MAX_ATTEMPTS,
+            retry_delay=settings.OUTBOX_RETRY_DELAY,
+            max_retry_delay=settings.OUTBOX_MAX_RETRY_DELAY,
+        )
+    return bot.outbox
+
 
+def get_forwards():
+    bot = get_bot()
+    if bot.forwards is None:
+        bot.forwards = forwards.ForwardIndex(
+            db.get_connection(bot.settings.DATABASE_PATH)
+        )
+    return bot.forwards
 
-def clean_username(word):
-    for char in [settings.MENTION_PLACEHOLDER, "?", ":", "!", ",", "(", ")"]:
-        word = word.replace(char, "")
-    return word.splitlines()[0]
 
+def get_blocklist():
+    bot = get_bot()
+    if bot.blocklist is None:
+        bot.blocklist = blocklist.Blocklist(
+            db.get_connection(bot.settings.DATABASE_PATH),
+            reload_interval=settings.BLOCKLIST_RELOAD_INTERVAL,
+        )
+    return bot.blocklist
 
-def prepare_for_forward(content):
-    lines = [l.strip() for l in content.splitlines() if l.strip()]
-    if len(lines) < 2:
-        return
 
-    return "\n\n".join(lines[1:])
+async def run_steps(kind, steps):
+    """
+    Store the steps of an action in the outbox, then execute them
+    """
+    outbox = get_outbox()
+    event_id = EVENT_ID.get()
+    action_id = outbox.add(
+        kind, steps, action_id=f"{event_id}:{kind}" if event_id else None
+    )
+    return await outbox.run(action_id)
 
 
-def handle_skip(action):
+async def handle_skip(action):
     return
 
 
-def handle_reply(action):
+async def handle_reply(action):
     data = {
         "visibility": "direct",
         "status": f'@{action["recipient"]["acct"]} {action["message"]}',
         "in_reply_to_id": action.get("in_reply_to_id"),
     }
 
-    return post_data(
-        server_url=settings.SERVER_URL,
-        path="/api/v1/statuses",
-        access_token=settings.ACCESS_TOKEN,
-        data=data,
+    return await run_steps(
+        "reply",
+        [{"name": "reply", "path": "/api/v1/statuses", "data": data}],
     )
 
 
-def handle_forward(action):
+async def handle_forward(action):
+    steps = []
     # first, forward the message
-    message = settings.FORWARD_MESSAGE.format(
-        message=action["message"],
-        report_hashtags=", ".join(f"#\\{t}" for t in settings.REPORT_HASHTAGS),
-    )
+    bot_templates = get_bot().templates
+    message = bot_templates["forward"].format(message=action["message"])
     data = {
         "visibility": "direct",
         "status": f'@{action["recipient"]["acct"]} {message}',
         "spoiler_text": action["spoiler_text"],
         "in_reply_to_id": action.get("in_reply_to_id"),
     }
-
-    post_data(
-        server_url=settings.SERVER_URL,
-        path="/api/v1/statuses",
-        access_token=settings.ACCESS_TOKEN,
-        data=data,
-    )
+    steps.append({"name": "forward", "path": "/api/v1/statuses", "data": data})
 
     # then, send a confirmation
-    message = settings.SUCCESS_FORWARD_MESSAGE.format(action["recipient"]["acct"])
+    message = bot_templates["success_forward"].format(action["recipient"]["acct"])
     data = {
         "visibility": "direct",
         "status": f'@{action["sender"]["acct"]} {message}',
         "in_reply_to_id": action.get("in_reply_to_id"),
     }
-
-    return post_data(
-        server_url=settings.SERVER_URL,
-        path="/api/v1/statuses",
-        access_token=settings.ACCESS_TOKEN,
-        data=data,
-    )
-
-
-def handle_follow(action):
-    message = settings.FOLLOW_MESSAGE.format(
-        bot_account=action["bot_data"]["acct"],
-        recipient=action["sender"]["acct"],
+    steps.append({"name": "confirmation", "path": "/api/v1/statuses", "data": data})
+
+    results = await run_steps("forward", steps)
+    status = results.get("forward")
+    if status and "id" in status:
+        # so reports about this status can be resolved without API calls
+        get_forwards().add(status, action["sender"])
+    return results
+
+
+async def handle_follow(action):
+    message = (
+        get_bot()
+        .templates["follow"]
+        .format(
+            bot_account=action["bot_data"]["acct"],
+            recipient=action["sender"]["acct"],
+        )
     )
     data = {
         "visibility": "direct",
         "status": f'@{action["sender"]["acct"]} {message}',
     }
 
-    return post_data(
-        server_url=settings.SERVER_URL,
-        path="/api/v1/statuses",
-        access_token=settings.ACCESS_TOKEN,
-        data=data,
+    return await run_steps(
+        "follow",
+        [{"name": "welcome", "path": "/api/v1/statuses", "data": data}],
     )
 
 
-def handle_report(action):
+async def handle_report(action):
+    anonymous_sender = action["anonymous_sender"]["acct"]
+    reports = get_blocklist().add_report(
+        action["reported_message"]["id"], anonymous_sender
+    )
+    if (
+        settings.BLOCK_AFTER_REPORTS
+        and reports >= settings.BLOCK_AFTER_REPORTS
+        and not get_blocklist().is_blocked(anonymous_sender)
+    ):
+        get_blocklist().block(anonymous_sender, reason=f"{reports} reported messages")
+        logging.warning(
+            "[Blocklist] Blocked %s after %s reported messages",
+            anonymous_sender,
+            reports,
+        )
+
+    steps = []
     # bookmark the reported message so it doesn't get deleted
-    post_data(
-        server_url=settings.SERVER_URL,
-        path=f"/api/v1/statuses/{action['reported_message']['id']}/bookmark",
-        access_token=settings.ACCESS_TOKEN,
-        data={},
+    steps.append(
+        {
+            "name": "reported_message_bookmark",
+            "path": f"/api/v1/statuses/{action['reported_message']['id']}/bookmark",
+        }
     )
 
     # notify the mods
-    mod_message = settings.REPORT_MOD_MESSAGE.format(
+    bot = get_bot()
+    mod_message = bot.templates["report_mod"].format(
         sender=action["sender"]["acct"],
         reported_message_url=action["reported_message"]["url"],
         anonymous_sender=action["anonymous_sender"]["acct"],
         anonymous_sender_url=action["anonymous_sender"]["url"],
     )
-    mods = [f"@{mod}" for mod in settings.MODERATORS_USERNAMES]
+    mods = [f"@{mod}" for mod in bot.settings.MODERATORS_USERNAMES]
 
     data = {
         "visibility": "direct",
         "status": f'{" ".join(mods)} {mod_message}',
         "in_reply_to_id": action["report"]["id"],
     }
-
-    mod_post = post_data(
-        server_url=settings.SERVER_URL,
-        path="/api/v1/statuses",
-        access_token=settings.ACCESS_TOKEN,
-        data=data,
-    )
+    steps.append({"name": "mod_post", "path": "/api/v1/statuses", "data": data})
 
     # bookmark the mod message so it isn't deleted
-    post_data(
-        server_url=settings.SERVER_URL,
-        path=f"/api/v1/statuses/{mod_post['id']}/bookmark",
-        access_token=settings.ACCESS_TOKEN,
-        data={},
+    steps.append(
+        {
+            "name": "mod_post_bookmark",
+            "path": "/api/v1/statuses/{mod_post[id]}/bookmark",
+            "depends_on": ["mod_post"],
+        }
     )
 
     # notify the report author that we have received the message
-    confirmation_message = settings.REPORT_CONFIRMATION_MESSAGE.format(
-        mods=", ".join(settings.MODERATORS_USERNAMES)
-    )
+    confirmation_message = bot.templates["report_confirmation"].format()
     data = {
         "visibility": "direct",
         "status": f'@{action["sender"]["acct"]} {confirmation_message}',
         "in_reply_to_id": action["report"]["id"],
     }
-
-    confirmation_post = post_data(
-        server_url=settings.SERVER_URL,
-        path="/api/v1/statuses",
-        access_token=settings.ACCESS_TOKEN,
-        data=data,
-    )
+    steps.append({"name": "confirmation", "path": "/api/v1/statuses", "data": data})
 
     # bookmark the confirmation message so it isn't deleted
-    return post_data(
-        server_url=settings.SERVER_URL,
-        path=f"/api/v1/statuses/{confirmation_post['id']}/bookmark",
-        access_token=settings.ACCESS_TOKEN,
-        data={},
+    steps.append(
+        {
+            "name": "confirmation_bookmark",
+            "path": "/api/v1/statuses/{confirmation[id]}/bookmark",
+            "depends_on": ["confirmation"],
+        }
     )
+
+    return await run_steps("report", steps)
@@ -0,0 +1,286 @@
+import asyncio
+import bisect
+import logging
+import re
+import time
+
+# API paths are grouped by endpoint, e.g. /api/v1/statuses/:id/bookmark
+ID_RE = re.compile(r"/\d+(?=/|$)")
+
+DEFAULT_BUCKETS = (
+    0.001,
+    0.0025,
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1,
+    2.5,
+    5,
+    10,
+)
+
+
+def get_path_label(path):
+    return ID_RE.sub("/:id", path.split("?", 1)[0])
+
+
+def format_labels(labels):
+    if not labels:
+        return ""
+    pairs = []
+    for name, value in labels:
+        value = str(value).replace("\\", "\\\\").replace('"', '\\"')
+        value = value.replace("\n", "\\n")
+        pairs.append(f'{name}="{value}"')
+    return "{" + ",".join(pairs) + "}"
+
+
+def format_value(value):
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Metric:
+    """
+    Instead of updating a value, a function returning the current value can
+    be given, so it is read on collection, e.g. from counts kept elsewhere.
+    """
+
+    type = None
+
+    def __init__(self, name, help, labels=()):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self.values = {}
+        self.functions = {}
+
+    def get_key(self, labels):
+        return tuple((name, labels[name]) for name in self.labels)
+
+    def set_function(self, function, **labels):
+        self.functions[self.get_key(labels)] = function
+
+    def get(self, **labels):
+        key = self.get_key(labels)
+        if key in self.functions:
+            return self.functions[key]()
+        return self.values.get(key, 0)
+
+    def reset(self):
+        self.values.clear()
+
+    def samples(self):
+        values = {**self.values}
+        for key, function in self.functions.items():
+            try:
+                values[key] = function()
+            except Exception:
+                logging.exception("[Metrics] Could not collect %s", self.name)
+        for key, value in sorted(values.items()):
+            yield self.name, key, value
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.type}"]
+        for name, key, value in self.samples():
+            lines.append(f"{name}{format_labels(key)} {format_value(value)}")
+        return "\n".join(lines)
+
+
+class Counter(Metric):
+    type = "counter"
+
+    def inc(self, amount=1, **labels):
+        key = self.get_key(labels)
+        self.values[key] = self.values.get(key, 0) + amount
+
+
+class Gauge(Metric):
+    """
+    A value that can go up and down.
+    """
+
+    type = "gauge"
+
+    def set(self, value, **labels):
+        self.values[self.get_key(labels)] = value
+
+
+class Histogram(Metric):
+    type = "histogram"
+
+    def __init__(self, name, help, labels=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, help, labels)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value, **labels):
+        # per bucket counts, then sum and count
+        values = self.values.setdefault(
+            self.get_key(labels), [[0] * (len(self.buckets) + 1), 0, 0]
+        )
+        values[0][bisect.bisect_left(self.buckets, value)] += 1
+        values[1] += value
+        values[2] += 1
+
+    def time(self, **labels):
+        return Timer(self, labels)
+
+    def get_count(self, **labels):
+        value = self.values.get(self.get_key(labels))
+        return value[2] if value else 0
+
+    def samples(self):
+        for key, (counts, total, count) in sorted(self.values.items()):
+            cumulated = 0
+            for bound, bucket_count in zip(self.buckets + (float("inf"),), counts):
+                cumulated += bucket_count
+                yield (
+                    f"{self.name}_bucket",
+                    key + (("le", format_value(float(bound))),),
+                    cumulated,
+                )
+            yield f"{self.name}_sum", key, total
+            yield f"{self.name}_count", key, count
+
+
+class Timer:
+    """
+    Context manager observing the time spent in its block. Labels can be
+    completed in the block, e.g. once the result is known.
+    """
+
+    def __init__(self, histogram, labels):
+        self.histogram = histogram
+        self.labels = labels
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *args):
+        self.histogram.observe(time.perf_counter() - self.start, **self.labels)
+
+
+class Registry:
+    def __init__(self):
+        self.metrics = []
+
+    def register(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def reset(self):
+        for metric in self.metrics:
+            metric.reset()
+
+    def render(self):
+        return "\n".join(metric.render() for metric in self.metrics) + "\n"
+
+
+REGISTRY = Registry()
+
+STAGE_SECONDS = REGISTRY.register(
+    Histogram(
+        "shyraccoon_stage_seconds",
+        "Time spent in each stage of event handling.",
+        labels=["stage"],
+    )
+)
+MESSAGE_SECONDS = REGISTRY.register(
+    Histogram(
+        "shyraccoon_handle_message_seconds",
+        "Time spent analyzing a mention, by resulting action.",
+        labels=["action"],
+    )
+)
+ACTION_SECONDS = REGISTRY.register(
+    Histogram(
+        "shyraccoon_action_seconds",
+        "Time spent executing an action.",
+        labels=["action"],
+    )
+)
+ACTIONS = REGISTRY.register(
+    Counter(
+        "shyraccoon_actions_total",
+        "Number of handled actions.",
+        labels=["action"],
+    )
+)
+API_SECONDS = REGISTRY.register(
+    Histogram(
+        "shyraccoon_api_request_seconds",
+        "Duration of API requests, including time spent waiting for the throttle.",
+        labels=["method", "path"],
+    )
+)
+API_RESPONSES = REGISTRY.register(
+    Counter(
+        "shyraccoon_api_responses_total",
+        "Number of API responses, by status code.",
+        labels=["method", "path", "status"],
+    )
+)
+RATE_LIMIT_REJECTIONS = REGISTRY.register(
+    Counter(
+        "shyraccoon_rate_limit_rejections_total",
+        "Number of messages rejected by the bot rate limits.",
+        labels=["limit"],
+    )
+)
+QUEUE_DEPTH = REGISTRY.register(
+    Gauge(
+        "shyraccoon_queue_depth",
+        "Number of events waiting to be handled.",
+    )
+)
+CACHE_REQUESTS = REGISTRY.register(
+    Counter(
+        "shyraccoon_cache_requests_total",
+        "Number of cache lookups since startup, by result.",
+        labels=["cache", "result"],
+    )
+)
+
+
+async def handle_request(reader, writer, registry):
+    try:
+        request_line = await reader.readline()
+        # skip headers
+        while (await reader.readline()).strip():
+            pass
+        parts = request_line.decode("latin-1").split()
+        if len(parts) >= 2 and parts[0] == "GET" and parts[1] in ("/", "/metrics"):
+            status = "200 OK"
+            body = registry.render().encode()
+        else:
+            status = "404 Not Found"
+            body = b"Not Found\n"
+        writer.write(
+            f"HTTP/1.1 {status}\r\n"
+            "Content-Type: text/plain; version=0.0.4; charset=utf-8\r\n"
+            f"Content-Length: {len(body)}\r\n"
+            "Connection: close\r\n\r\n".encode() + body
+        )
+        await writer.drain()
+    except ConnectionError:
+        pass
+    finally:
+        writer.close()
+
+
+async def serve(host, port, registry=REGISTRY):
+    """
+    Serve metrics in Prometheus text format until cancelled.
+    """
+    server = await asyncio.start_server(
+        lambda reader, writer: handle_request(reader, writer, registry), host, port
+    )
+    logging.info("[Metrics] Serving metrics on http://%s:%s/metrics", host, port)
+    async with server:
+        await server.serve_forever()
@@ -0,0 +1,73 @@
+from . import cache
+
+
+def id_key(id):
+    """
+    Sort key for Mastodon ids, which are numeric strings of variable length
+    """
+    return (len(id), id)
+
+
+class NotificationTracker:
+    """
+    Track which notifications have been handled, to skip duplicates and to
+    know where to resume after a disconnection.
+
+    The cursor is the id of the most recent notification such that it and
+    every notification received before it have been handled. It only moves
+    forward, and is saved through `save_cursor` each time it does. While
+    missed notifications are fetched, it is held with hold() so it doesn't
+    move past them.
+    """
+
+    def __init__(self, cursor, save_cursor, seen_size, seen_ttl):
+        self.cursor = cursor
+        self.save_cursor = save_cursor
+        self.seen = cache.TTLCache(maxsize=seen_size, ttl=seen_ttl)
+        self.pending = set()
+        self.done = set()
+        self.holds = []
+
+    def start(self, id):
+        """
+        Mark a notification as being handled, and return False if it was
+        already received.
+        """
+        if self.cursor and id_key(id) <= id_key(self.cursor):
+            return False
+        if self.seen.get(id, False):
+            return False
+        self.seen.set(id, True)
+        self.pending.add(id)
+        return True
+
+    def hold(self):
+        """
+        Keep the cursor where it is until release() is called, e.g. while
+        fetching notifications received after it, and return it.
+        """
+        self.holds.append(self.cursor)
+        return self.cursor
+
+    def release(self, cursor):
+        self.holds.remove(cursor)
+        self.advance()
+
+    def finish(self, id):
+        self.pending.discard(id)
+        self.done.add(id)
+        self.advance()
+
+    def advance(self):
+        if self.pending or self.holds:
+            oldest_pending = min(map(id_key, self.pending | set(self.holds)))
+            handled = {i for i in self.done if id_key(i) < oldest_pending}
+        else:
+            handled = self.done
+        if not handled:
+            return
+        self.done = self.done - handled
+        cursor = max(handled, key=id_key)
+        if not self.cursor or id_key(cursor) > id_key(self.cursor):
+            self.cursor = cursor
+            self.save_cursor(cursor)
@@ -0,0 +1,332 @@
+import asyncio
+import json
+import logging
+import random
+import time
+import uuid
+
+import httpx
+
+from . import throttle
+
+
+class Outbox:
+    """
+    Durable queue of outgoing actions.
+
+    An action is a list of steps, each step being a POST request to the API,
+    optionally depending on other steps of the action.
+    Steps are stored in the database before being executed, and marked as
+    done with their result afterwards, so an interrupted action can be
+    resumed without repeating completed steps. A step path can reference the
+    result of a previous step, e.g. ``/api/v1/statuses/{mod_post[id]}/bookmark``.
+
+    Each step is sent with a stable idempotency key, so a step that was sent
+    but not marked as done before a crash doesn't create a duplicate status.
+
+    Actions that failed with a retryable error, e.g. while the server is
+    down, stay pending so resume() can complete them later. Only actions
+    rejected by the server are marked as failed.
+    """
+
+    def __init__(self, connection, execute, max_attempts, retry_delay, max_retry_delay):
+        self.connection = connection
+        self.execute = execute
+        self.max_attempts = max_attempts
+        self.retry_delay = retry_delay
+        self.max_retry_delay = max_retry_delay
+        # tasks of the actions being run, keyed by action id
+        self.running = {}
+        self.connection.executescript("""
+            CREATE TABLE IF NOT EXISTS outbox_actions (
+                id TEXT PRIMARY KEY,
+                kind TEXT NOT NULL,
+                status TEXT NOT NULL DEFAULT 'pending',
+                created_at REAL NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS outbox_steps (
+                action_id TEXT NOT NULL REFERENCES outbox_actions (id),
+                position INTEGER NOT NULL,
+                name TEXT NOT NULL,
+                path TEXT NOT NULL,
+                data TEXT NOT NULL,
+                depends_on TEXT NOT NULL,
+                status TEXT NOT NULL DEFAULT 'pending',
+                attempts INTEGER NOT NULL DEFAULT 0,
+                result TEXT,
+                PRIMARY KEY (action_id, name)
+            );
+            CREATE INDEX IF NOT EXISTS outbox_actions_status
+                ON outbox_actions (status);
+            """)
+
+    def add(self, kind, steps, action_id=None):
+        """
+        Store an action and return its id. If `action_id` is given and the
+        action already exists, e.g. when an event is handled again after a
+        crash, the existing action is kept so it is resumed rather than
+        repeated.
+        """
+        names = {step["name"] for step in steps}
+        for step in steps:
+            for name in step.get("depends_on", []):
+                if name not in names:
+                    raise ValueError(f"Step {step['name']} depends on unknown {name}")
+        action_id = action_id or str(uuid.uuid4())
+        with self.connection:
+            self.connection.execute("BEGIN")
+            cursor = self.connection.execute(
+                "INSERT OR IGNORE INTO outbox_actions (id, kind, created_at) "
+                "VALUES (?, ?, ?)",
+                (action_id, kind, time.time()),
+            )
+            if cursor.rowcount == 0:
+                return action_id
+            self.connection.executemany(
+                "INSERT INTO outbox_steps "
+                "(action_id, position, name, path, data, depends_on) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                [
+                    (
+                        action_id,
+                        position,
+                        step["name"],
+                        step["path"],
+                        json.dumps(step.get("data", {})),
+                        json.dumps(step.get("depends_on", [])),
+                    )
+                    for position, step in enumerate(steps)
+                ],
+            )
+        return action_id
+
+    def get_steps(self, action_id):
+        rows = self.connection.execute(
+            "SELECT * FROM outbox_steps WHERE action_id = ? ORDER BY position",
+            (action_id,),
+        ).fetchall()
+        return [
+            {
+                "action_id": row["action_id"],
+                "name": row["name"],
+                "path": row["path"],
+                "data": json.loads(row["data"]),
+                "depends_on": json.loads(row["depends_on"]),
+                "status": row["status"],
+                "attempts": row["attempts"],
+                "result": json.loads(row["result"]) if row["result"] else None,
+                "idempotency_key": f"{row['action_id']}:{row['name']}",
+            }
+            for row in rows
+        ]
+
+    def get_pending_actions(self, older_than=0):
+        """
+        Return the ids of pending actions created at least `older_than`
+        seconds ago.
+        """
+        rows = self.connection.execute(
+            "SELECT id FROM outbox_actions WHERE status = 'pending' "
+            "AND created_at <= ? ORDER BY created_at",
+            (time.time() - older_than,),
+        ).fetchall()
+        return [row["id"] for row in rows]
+
+    def prune(self, max_age):
+        """
+        Delete actions completed or failed more than `max_age` seconds ago,
+        since their steps hold the content of the messages. Return the number
+        of deleted actions.
+        """
+        cutoff = time.time() - max_age
+        with self.connection:
+            self.connection.execute("BEGIN")
+            self.connection.execute(
+                "DELETE FROM outbox_steps WHERE action_id IN ("
+                "SELECT id FROM outbox_actions "
+                "WHERE status != 'pending' AND created_at < ?)",
+                (cutoff,),
+            )
+            cursor = self.connection.execute(
+                "DELETE FROM outbox_actions "
+                "WHERE status != 'pending' AND created_at < ?",
+                (cutoff,),
+            )
+        return cursor.rowcount
+
+    def set_action_status(self, action_id, status):
+        self.connection.execute(
+            "UPDATE outbox_actions SET status = ? WHERE id = ?", (status, action_id)
+        )
+
+    def set_step_status(self, step, status, result=None):
+        self.connection.execute(
+            "UPDATE outbox_steps SET status = ?, result = ?, attempts = ? "
+            "WHERE action_id = ? AND name = ?",
+            (
+                status,
+                json.dumps(result) if result is not None else None,
+                step["attempts"],
+                step["action_id"],
+                step["name"],
+            ),
+        )
+
+    async def run(self, action_id):
+        """
+        Execute the pending steps of an action, and return the results of all
+        its steps, keyed by step name.
+
+        Steps are started as soon as the steps they depend on are completed,
+        so independent steps run concurrently. If the action is already
+        running, e.g. resumed while its event is handled again, its results
+        are awaited instead.
+        """
+        if action_id in self.running:
+            return await asyncio.shield(self.running[action_id])
+        task = asyncio.ensure_future(self.run_steps(action_id))
+        self.running[action_id] = task
+        task.add_done_callback(lambda _: self.running.pop(action_id, None))
+        return await task
+
+    async def run_steps(self, action_id):
+        steps = self.get_steps(action_id)
+        results = {s["name"]: s["result"] for s in steps if s["status"] == "done"}
+        pending = [s for s in steps if s["status"] != "done"]
+        running = {}
+        error = None
+        try:
+            while pending or running:
+                if error is None:
+                    for step in [s for s in pending if self.is_ready(s, results)]:
+                        pending.remove(step)
+                        task = asyncio.create_task(self.run_step(step, results))
+                        running[task] = step["name"]
+                if not running:
+                    break
+                done, _ = await asyncio.wait(
+                    running, return_when=asyncio.FIRST_COMPLETED
+                )
+                for task in done:
+                    name = running.pop(task)
+                    if task.exception():
+                        # let running steps complete, but don't start new ones
+                        error = error or task.exception()
+                    else:
+                        results[name] = task.result()
+        except asyncio.CancelledError:
+            for task in running:
+                task.cancel()
+            raise
+        if pending and error is None:
+            error = ValueError(f"Circular dependencies between steps of {action_id}")
+        if error is not None:
+            if not is_retryable(error):
+                self.set_action_status(action_id, "failed")
+            raise error
+        self.set_action_status(action_id, "done")
+        return results
+
+    @staticmethod
+    def is_ready(step, results):
+        return all(name in results for name in step["depends_on"])
+
+    async def resume(self, older_than=0):
+        for action_id in self.get_pending_actions(older_than):
+            logging.info("[Outbox] Resuming action %s", action_id)
+            try:
+                await self.run(action_id)
+            except Exception:
+                logging.exception("[Outbox] Could not complete action %s", action_id)
+
+    def render(self, step, results):
+        try:
+            return {**step, "path": step["path"].format_map(results)}
+        except (KeyError, TypeError):
+            return None
+
+    async def run_step(self, step, results):
+        rendered = self.render(step, results)
+        if rendered is None:
+            # happens when a previous step didn't return anything, e.g in DRY_RUN
+            logging.warning(
+                "[Outbox] Skipping step %s, missing results from previous steps",
+                step["name"],
+            )
+            self.set_step_status(step, "skipped")
+            return None
+        attempt = 0
+        while True:
+            attempt += 1
+            step["attempts"] += 1
+            try:
+                result = await self.execute(rendered)
+            except Exception as e:
+                if not is_retryable(e):
+                    logging.error(
+                        "[Outbox] Step %s of action %s was rejected: %s",
+                        step["name"],
+                        step["action_id"],
+                        e,
+                    )
+                    self.set_step_status(step, "failed")
+                    raise
+                if attempt >= self.max_attempts:
+                    # kept pending, to be resumed later
+                    logging.error(
+                        "[Outbox] Step %s of action %s failed after %s attempt(s)",
+                        step["name"],
+                        step["action_id"],
+                        attempt,
+                    )
+                    self.set_step_status(step, "pending")
+                    raise
+                delay = self.get_retry_delay(e, attempt)
+                logging.warning(
+                    "[Outbox] Step %s of action %s failed (%s), retrying in %.1fs",
+                    step["name"],
+                    step["action_id"],
+                    e,
+                    delay,
+                )
+                self.set_step_status(step, "pending")
+                await asyncio.sleep(delay)
+            else:
+                self.set_step_status(step, "done", result)
+                return result
+
+    def get_retry_delay(self, error, attempt):
+        delay = get_server_delay(error)
+        if delay is not None:
+            return min(delay, self.max_retry_delay)
+        # exponential backoff with full jitter
+        backoff = min(self.max_retry_delay, self.retry_delay * 2 ** (attempt - 1))
+        return random.uniform(0, backoff)
+
+
+def is_retryable(error):
+    if isinstance(error, httpx.TransportError):
+        return True
+    if isinstance(error, httpx.HTTPStatusError):
+        status = error.response.status_code
+        return status == 429 or status >= 500
+    return False
+
+
+def get_server_delay(error):
+    """
+    Return the delay requested by the server before retrying, in seconds,
+    if any.
+    """
+    if not isinstance(error, httpx.HTTPStatusError):
+        return None
+    headers = error.response.headers
+    retry_after = headers.get("retry-after")
+    if retry_after:
+        try:
+            return max(0, float(retry_after))
+        except ValueError:
+            pass
+    if error.response.status_code == 429:
+        return throttle.parse_reset(headers.get("x-ratelimit-reset"))
+    return None
@@ -0,0 +1,79 @@
+import functools
+import html
+import re
+
+# tags and entities, in a single pattern so the content is scanned once.
+# Attributes can't contain "<", so unterminated tags fail fast instead of
+# scanning the rest of the content
+TOKEN_RE = re.compile(r"<(/?)([a-zA-Z][a-zA-Z0-9]*)[^<>]*>|&(#?[a-zA-Z0-9]+);")
+# characters stripped from usernames, e.g. in "for ?user@server.test:"
+USERNAME_STRIP = "?:!,()"
+
+
+@functools.lru_cache()
+def get_username_re(placeholder):
+    return re.compile(rf"(?<!\S){re.escape(placeholder)}(\S+)")
+
+
+@functools.lru_cache(maxsize=1024)
+def unescape(entity):
+    return html.unescape(entity)
+
+
+def replace_token(match):
+    closing, tag, entity = match.groups()
+    if entity:
+        return unescape(match.group(0))
+    tag = tag.lower()
+    if tag == "br":
+        return "\n"
+    if tag == "p" and closing:
+        return "\n\n"
+    # other tags such as links or mentions are replaced by their content
+    return ""
+
+
+def html_to_text(content):
+    return TOKEN_RE.sub(replace_token, content)
+
+
+def get_lines(text):
+    return [line for line in (l.strip() for l in text.splitlines()) if line]
+
+
+def find_username(text, placeholder):
+    """
+    Return the last username prefixed with `placeholder` in the text
+    """
+    username = None
+    strip = str.maketrans("", "", USERNAME_STRIP + placeholder)
+    for match in get_username_re(placeholder).finditer(text):
+        candidate = match.group(1).translate(strip)
+        if candidate:
+            username = candidate
+    return username
+
+
+def get_body(lines):
+    """
+    The first line holds the recipient, the following ones the message
+    """
+    if len(lines) < 2:
+        return None
+    return "\n\n".join(lines[1:])
+
+
+def parse_message(content, placeholder):
+    """
+    Parse the HTML content of a status sent to the bot, and return the
+    recipient username and the message to forward to them (or None).
+    """
+    lines = get_lines(html_to_text(content))
+    # the recipient is expected on the first line, but may be elsewhere in
+    # messages that don't follow the instructions
+    recipient = None
+    if lines:
+        recipient = find_username(lines[0], placeholder)
+    if not recipient:
+        recipient = find_username("\n".join(lines[1:]), placeholder)
+    return recipient, get_body(lines)
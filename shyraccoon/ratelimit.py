@@ -0,0 +1,77 @@
+import math
+import time
+
+import limits
+from limits.util import WindowStats
+
+
+class SlidingWindowCounterRateLimiter(limits.strategies.RateLimiter):
+    """
+    Approximate a moving window with two fixed window counters: the current
+    window's count, plus the previous window's count weighted by how much of
+    it still overlaps with the moving window.
+
+    Unlike the moving window strategy, it only stores two integers per key.
+    """
+
+    def get_keys(self, item, identifiers, now):
+        expiry = item.get_expiry()
+        window = int(now // expiry)
+        key = item.key_for(*identifiers)
+        return f"{key}/{window}", f"{key}/{window - 1}", window
+
+    def get_count(self, item, identifiers, now):
+        expiry = item.get_expiry()
+        current_key, previous_key, window = self.get_keys(item, identifiers, now)
+        elapsed = (now % expiry) / expiry
+        count = self.storage.get(previous_key) * (1 - elapsed) + self.storage.get(
+            current_key
+        )
+        return count, current_key, window
+
+    def hit(self, item, *identifiers, cost=1):
+        now = time.time()
+        expiry = item.get_expiry()
+        current_key, previous_key, _ = self.get_keys(item, identifiers, now)
+        # increment first, so concurrent hits from several processes sharing
+        # the storage can't all pass the check before any of them is counted.
+        # Counters must outlive the next window, where they are weighted in.
+        current = self.storage.incr(current_key, expiry * 2, amount=cost)
+        elapsed = (now % expiry) / expiry
+        count = self.storage.get(previous_key) * (1 - elapsed) + current
+        if count > item.amount:
+            self.storage.incr(current_key, expiry * 2, amount=-cost)
+            return False
+        return True
+
+    def test(self, item, *identifiers):
+        count, _, _ = self.get_count(item, identifiers, time.time())
+        return count < item.amount
+
+    def get_window_stats(self, item, *identifiers):
+        count, _, window = self.get_count(item, identifiers, time.time())
+        reset = (window + 1) * item.get_expiry()
+        return WindowStats(reset, max(0, item.amount - math.ceil(count)))
+
+    def clear(self, item, *identifiers):
+        current_key, previous_key, _ = self.get_keys(item, identifiers, time.time())
+        self.storage.clear(current_key)
+        self.storage.clear(previous_key)
+
+
+STRATEGIES = {
+    "moving-window": limits.strategies.MovingWindowRateLimiter,
+    "sliding-window-counter": SlidingWindowCounterRateLimiter,
+    "fixed-window": limits.strategies.FixedWindowRateLimiter,
+}
+
+
+def get_limiter(strategy, storage):
+    try:
+        limiter_class = STRATEGIES[strategy]
+    except KeyError:
+        raise ValueError(
+            f"Unknown rate limit strategy {strategy!r}, "
+            f"choose one of {', '.join(STRATEGIES)}"
+        )
+    return limiter_class(storage)
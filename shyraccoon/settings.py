@@ -1,68 +1,209 @@
+import importlib.util
 import os
 import logging
+import types
 
-ACCESS_TOKEN = os.environ["ACCESS_TOKEN"]
-SERVER_URL = os.environ["SERVER_URL"]  # no final slash
-STREAMING_URL = os.environ.get("STREAMING_URL", "/api/v1/streaming")
 DRY_RUN = os.environ.get("DRY_RUN") and os.environ.get("DRY_RUN") != "0"
 
+# SQLite database where data that must survive restarts is stored
+DATABASE_PATH = os.environ.get("DATABASE_PATH", "shyraccoon.sqlite3")
+
+# Outgoing actions are retried up to OUTBOX_MAX_ATTEMPTS times, with an
+# exponential backoff starting at OUTBOX_RETRY_DELAY seconds
+OUTBOX_MAX_ATTEMPTS = int(os.environ.get("OUTBOX_MAX_ATTEMPTS", "8"))
+OUTBOX_RETRY_DELAY = float(os.environ.get("OUTBOX_RETRY_DELAY", "1"))
+OUTBOX_MAX_RETRY_DELAY = float(os.environ.get("OUTBOX_MAX_RETRY_DELAY", "300"))
+# Actions still pending after that, e.g. because the server is down, are
+# resumed every OUTBOX_RESUME_INTERVAL seconds
+OUTBOX_RESUME_INTERVAL = float(os.environ.get("OUTBOX_RESUME_INTERVAL", "600"))
+# Completed actions hold the content of forwarded messages, they are deleted
+# after OUTBOX_RETENTION seconds
+OUTBOX_RETENTION = float(os.environ.get("OUTBOX_RETENTION", "86400"))
+
+# Forwarded statuses are linked to their anonymous author for
+# FORWARDS_RETENTION seconds, so reports can be resolved without API calls
+FORWARDS_RETENTION = float(os.environ.get("FORWARDS_RETENTION", "2592000"))
+
+# HTTP connection pool used for all API calls
+HTTP_POOL_SIZE = int(os.environ.get("HTTP_POOL_SIZE", "10"))
+HTTP_KEEPALIVE_EXPIRY = float(os.environ.get("HTTP_KEEPALIVE_EXPIRY", "60"))
+HTTP_TIMEOUT = float(os.environ.get("HTTP_TIMEOUT", "15"))
+HTTP_CONNECT_TIMEOUT = float(os.environ.get("HTTP_CONNECT_TIMEOUT", "5"))
+
+# Account lookups and relationships are cached for CACHE_TTL seconds
+CACHE_SIZE = int(os.environ.get("CACHE_SIZE", "1000"))
+CACHE_TTL = float(os.environ.get("CACHE_TTL", "300"))
+
+# Followers of the bot are loaded at startup and reloaded every
+# FOLLOWERS_RELOAD_INTERVAL seconds, so checking if a recipient opted in
+# doesn't need an API call. Follows are picked up immediately, but unfollows
+# are only picked up on reload. Set to 0 to always check with the API.
+FOLLOWERS_RELOAD_INTERVAL = float(os.environ.get("FOLLOWERS_RELOAD_INTERVAL", "600"))
+
+# Relationships checks made within RELATIONSHIPS_BATCH_DELAY seconds are
+# sent to the API as a single request, with up to RELATIONSHIPS_BATCH_SIZE ids
+RELATIONSHIPS_BATCH_DELAY = float(os.environ.get("RELATIONSHIPS_BATCH_DELAY", "0.005"))
+RELATIONSHIPS_BATCH_SIZE = int(os.environ.get("RELATIONSHIPS_BATCH_SIZE", "40"))
+
+# When polling notifications, the interval between two fetches is reduced
+# to POLL_MIN_INTERVAL seconds when notifications are received, and grows up
+# to POLL_MAX_INTERVAL seconds otherwise. With the stream command, polling
+# starts once the stream has been down for STREAM_FALLBACK_DELAY seconds.
+POLL_MIN_INTERVAL = float(os.environ.get("POLL_MIN_INTERVAL", "5"))
+POLL_MAX_INTERVAL = float(os.environ.get("POLL_MAX_INTERVAL", "60"))
+STREAM_FALLBACK_DELAY = float(os.environ.get("STREAM_FALLBACK_DELAY", "60"))
+
+# Ids of recently received notifications are kept to skip duplicates when
+# catching up with notifications missed during a disconnection
+NOTIFICATIONS_SEEN_SIZE = int(os.environ.get("NOTIFICATIONS_SEEN_SIZE", "10000"))
+NOTIFICATIONS_SEEN_TTL = float(os.environ.get("NOTIFICATIONS_SEEN_TTL", "86400"))
+
+# Number of events handled concurrently, and number of pending events
+# after which we stop reading the stream until workers catch up
+WORKERS = int(os.environ.get("WORKERS", "4"))
+QUEUE_HIGH_WATER = int(os.environ.get("QUEUE_HIGH_WATER", "100"))
+
+# With the reader and worker commands, events are passed through a queue in
+# DATABASE_PATH. Events and the reader leadership are leased for QUEUE_LEASE
+# seconds, and taken over by another process if not renewed in time. Idle
+# workers check the queue every QUEUE_POLL_INTERVAL seconds, and handled
+# events are kept QUEUE_RETENTION seconds to detect duplicates.
+QUEUE_LEASE = float(os.environ.get("QUEUE_LEASE", "30"))
+QUEUE_POLL_INTERVAL = float(os.environ.get("QUEUE_POLL_INTERVAL", "0.5"))
+QUEUE_RETENTION = float(os.environ.get("QUEUE_RETENTION", "86400"))
+
+# Serve metrics in Prometheus text format on this port, disabled if 0
+METRICS_PORT = int(os.environ.get("METRICS_PORT", "0"))
+METRICS_HOST = os.environ.get("METRICS_HOST", "127.0.0.1")
+
+# Variables in ENV_FILE (e.g. the .env file of the systemd unit) are read
+# again when the process receives SIGHUP, and when the file is modified if
+# CONFIG_WATCH_INTERVAL (in seconds) isn't 0. See RELOADABLE below for the
+# settings that can be changed this way.
+ENV_FILE = os.environ.get("ENV_FILE", "")
+CONFIG_WATCH_INTERVAL = float(os.environ.get("CONFIG_WATCH_INTERVAL", "0"))
+
 RATE_LIMIT_USER_RATE = os.environ.get("RATE_LIMIT_USER", "50/day")
 RATE_LIMIT_USER_COUPLE_RATE = os.environ.get("RATE_LIMIT_USER_COUPLE", "10/hour")
+# Messages sent in a short time, checked before any API call is made
+RATE_LIMIT_USER_BURST_RATE = os.environ.get("RATE_LIMIT_USER_BURST", "5/minute")
+# One of moving-window (exact, but stores a timestamp per hit),
+# sliding-window-counter (close approximation using two counters per key)
+# or fixed-window (one counter per key, but allows bursts at window boundaries)
+RATE_LIMIT_STRATEGY = os.environ.get("RATE_LIMIT_STRATEGY", "moving-window")
+# Where rate limits are stored, e.g. memory://, sqlite:///path/to/limits.sqlite3
+# or redis://localhost:6379. Use a persistent storage to keep limits
+# across restarts, or to share them between several processes.
+RATE_LIMIT_STORAGE_URL = os.environ.get("RATE_LIMIT_STORAGE_URL", "memory://")
+RATE_LIMIT_PRUNE_INTERVAL = float(os.environ.get("RATE_LIMIT_PRUNE_INTERVAL", "300"))
 RATE_LIMIT_EXEMPTED_USERS = [
     user.strip().lower()
     for user in os.environ.get("RATE_LIMIT_EXEMPTED_USERS", "").split(",")
     if user.strip()
 ]
 
+# Blocks added with the block command are applied by running bots within
+# BLOCKLIST_RELOAD_INTERVAL seconds. Senders are blocked automatically once
+# BLOCK_AFTER_REPORTS of their messages were reported, 0 to disable.
+BLOCKLIST_RELOAD_INTERVAL = float(os.environ.get("BLOCKLIST_RELOAD_INTERVAL", "10"))
+BLOCK_AFTER_REPORTS = int(os.environ.get("BLOCK_AFTER_REPORTS", "0"))
+
 logging.basicConfig(level=os.environ.get("LOGLEVEL", "INFO").upper())
 
-MODERATORS_USERNAMES = [
-    mod.strip() for mod in os.environ["MODERATORS_USERNAMES"].split(",") if mod.strip()
-]
-BOT_HASHTAGS = [
-    tag.strip() for tag in os.environ.get("BOT_HASHTAGS", "").split(",") if tag.strip()
-]
-BOT_HASHTAGS_STR = " ".join(f"#{t}" for t in BOT_HASHTAGS).strip()
+# Several bots can run in the same process: list their names in BOTS, e.g.
+# BOTS=en,fr, then prefix their own settings with their upper-case name,
+# e.g. FR_ACCESS_TOKEN or FR_FORWARD_MESSAGE. Settings without a prefix are
+# used by all bots that don't override them.
+BOTS = [name.strip() for name in os.environ.get("BOTS", "").split(",") if name.strip()]
 
-# Copy / wording
-REPORT_HASHTAGS = [
-    tag.lower().strip()
-    for tag in os.environ.get("REPORT_HASHTAGS", "report").split(",")
-    if tag.strip()
-]
+REQUIRED = object()
+
+
+def get_database_path(name):
+    if not name or DATABASE_PATH == ":memory:":
+        return DATABASE_PATH
+    root, ext = os.path.splitext(DATABASE_PATH)
+    return f"{root}-{name}{ext}"
+
+
+def load_profile(name=""):
+    """
+    Return the settings of a bot, with the same names as the module-level
+    settings. If `name` is given, variables prefixed with its upper-case name
+    take precedence.
+    """
+
+    def env(key, default=REQUIRED):
+        if name and f"{name.upper()}_{key}" in os.environ:
+            return os.environ[f"{name.upper()}_{key}"]
+        if default is REQUIRED:
+            return os.environ[key]
+        return os.environ.get(key, default)
 
-MENTION_PLACEHOLDER = os.environ.get("MENTION_PLACEHOLDER", "?")
-EXAMPLE_USERNAME = os.environ.get("EXAMPLE_USERNAME", "user@mastodon.test")
-EXAMPLE_MESSAGE = os.environ.get(
-    "EXAMPLE_MESSAGE",
-    """@{bot_account} for ?{recipient}:
+    BOT_NAME = name
+    ACCESS_TOKEN = env("ACCESS_TOKEN")
+    SERVER_URL = env("SERVER_URL")  # no final slash
+    STREAMING_URL = env("STREAMING_URL", "/api/v1/streaming")
+    # user:notification only includes notifications, whereas user would also
+    # include every status from the bot's home timeline
+    STREAMING_STREAM = env("STREAMING_STREAM", "user:notification")
+
+    # SQLite database of the bot, by default next to the shared DATABASE_PATH
+    DATABASE_PATH = env("DATABASE_PATH", get_database_path(name))
+
+    # Requests to the API are paced to stay within the server rate limits
+    # (300 requests every 5 minutes by default on Mastodon). The actual pace is
+    # adjusted with the rate limit headers returned by the server.
+    API_RATE = float(env("API_RATE", "1"))
+    API_BURST = int(env("API_BURST", "10"))
+
+    MODERATORS_USERNAMES = [
+        mod.strip() for mod in env("MODERATORS_USERNAMES").split(",") if mod.strip()
+    ]
+    BOT_HASHTAGS = [
+        tag.strip() for tag in env("BOT_HASHTAGS", "").split(",") if tag.strip()
+    ]
+    BOT_HASHTAGS_STR = " ".join(f"#{t}" for t in BOT_HASHTAGS).strip()
+
+    # Copy / wording
+    REPORT_HASHTAGS = [
+        tag.lower().strip()
+        for tag in env("REPORT_HASHTAGS", "report").split(",")
+        if tag.strip()
+    ]
+
+    MENTION_PLACEHOLDER = env("MENTION_PLACEHOLDER", "?")
+    EXAMPLE_USERNAME = env("EXAMPLE_USERNAME", "user@mastodon.test")
+    EXAMPLE_MESSAGE = env(
+        "EXAMPLE_MESSAGE",
+        """@{bot_account} for ?{recipient}:
 
 How are you?""",
-)
-FOLLOW_MESSAGE = (
-    os.environ.get(
-        "FOLLOW_MESSAGE",
-        """Welcome to Shy Raccoon!
+    )
+    FOLLOW_MESSAGE = (
+        env(
+            "FOLLOW_MESSAGE",
+            """Welcome to Shy Raccoon!
 
 Now that you follow me, I can forward you anonymous questions and messages. Whenever someone writes me a direct message like the one below, you will be notified. 
 
 ---
 """
-        + EXAMPLE_MESSAGE
-        + """
+            + EXAMPLE_MESSAGE
+            + """
 ---
 
 Give it a try yourself to see how it works!
 
 To stop receiving anonymous messages, unfollow this account. Check out my bio/pinned posts for more info.
 """,
+        )
+        + f" {BOT_HASHTAGS_STR}"
     )
-    + f" {BOT_HASHTAGS_STR}"
-)
-FORWARD_MESSAGE = (
-    os.environ.get(
-        "FORWARD_MESSAGE",
-        """{message}
+    FORWARD_MESSAGE = (
+        env(
+            "FORWARD_MESSAGE",
+            """{message}
 
 ---
 
@@ -70,21 +211,21 @@ To report it, reply to this message, including any relevant information and one
 
 If you don't want to receive anonymous messages in the future, please unfollow this account.
 """,
+        )
+        + f" {BOT_HASHTAGS_STR}"
     )
-    + f" {BOT_HASHTAGS_STR}"
-)
-DEFAULT_CONTENT_WARNING = os.environ.get(
-    "DEFAULT_CONTENT_WARNING", "You received a Shy Raccoon message"
-)
-FORWARD_INSTRUCTIONS_MESSAGE = (
-    os.environ.get(
-        "FORWARD_INSTRUCTIONS_MESSAGE",
-        """To send an anonymous message to someone, please use the following format:
+    DEFAULT_CONTENT_WARNING = env(
+        "DEFAULT_CONTENT_WARNING", "You received a Shy Raccoon message"
+    )
+    FORWARD_INSTRUCTIONS_MESSAGE = (
+        env(
+            "FORWARD_INSTRUCTIONS_MESSAGE",
+            """To send an anonymous message to someone, please use the following format:
 
 ---
 """
-        + EXAMPLE_MESSAGE
-        + """
+            + EXAMPLE_MESSAGE
+            + """
 ---
 
 The important parts are:
@@ -92,51 +233,158 @@ The important parts are:
 1. THE QUESTION MARK AT THE BEGINNING OF THE RECIPIENT USERNAME (INSTEAD OF AN @). THIS IS IMPORTANT TO ENSURE YOU DON'T MENTION THE PERSON DIRECTLY!
 2. A line break before your question
 """,
+        )
+        + f" {BOT_HASHTAGS_STR}"
     )
-    + f" {BOT_HASHTAGS_STR}"
-)
 
-ERROR_INVALID_ACCOUNT = (
-    os.environ.get(
-        "ERROR_INVALID_ACCOUNT",
-        "The account '{account}' does not exist. " + FORWARD_INSTRUCTIONS_MESSAGE,
+    ERROR_INVALID_ACCOUNT = (
+        env(
+            "ERROR_INVALID_ACCOUNT",
+            "The account '{account}' does not exist. " + FORWARD_INSTRUCTIONS_MESSAGE,
+        )
+        + f" {BOT_HASHTAGS_STR}"
     )
-    + f" {BOT_HASHTAGS_STR}"
-)
-ERROR_INVALID_MESSAGE = (
-    os.environ.get(
-        "ERROR_INVALID_MESSAGE",
-        """Your message is invalid. """ + FORWARD_INSTRUCTIONS_MESSAGE,
+    ERROR_INVALID_MESSAGE = (
+        env(
+            "ERROR_INVALID_MESSAGE",
+            """Your message is invalid. """ + FORWARD_INSTRUCTIONS_MESSAGE,
+        )
+        + f" {BOT_HASHTAGS_STR}"
     )
-    + f" {BOT_HASHTAGS_STR}"
-)
-SUCCESS_FORWARD_MESSAGE = (
-    os.environ.get(
-        "SUCCESS_FORWARD_MESSAGE",
-        "Received! I will forward your message to '{0}' immediatly if they enabled Shy Raccoon.",
+    SUCCESS_FORWARD_MESSAGE = (
+        env(
+            "SUCCESS_FORWARD_MESSAGE",
+            "Received! I will forward your message to '{0}' immediatly if they enabled Shy Raccoon.",
+        )
+        + f" {BOT_HASHTAGS_STR}"
     )
-    + f" {BOT_HASHTAGS_STR}"
-)
 
-REPORT_MOD_MESSAGE = (
-    os.environ.get(
-        "REPORT_MOD_MESSAGE",
-        """User '{sender}' has reported a Shy Raccoon message.
+    REPORT_MOD_MESSAGE = (
+        env(
+            "REPORT_MOD_MESSAGE",
+            """User '{sender}' has reported a Shy Raccoon message.
 
 Please check the reported message and conversation at {reported_message_url}.
 
 The anonymous message was sent by '{anonymous_sender}' ({anonymous_sender_url}).
 
 #ShyRaccoonReport""",
+        )
+        + f" {BOT_HASHTAGS_STR}"
     )
-    + f" {BOT_HASHTAGS_STR}"
-)
-REPORT_CONFIRMATION_MESSAGE = (
-    os.environ.get(
-        "REPORT_CONFIRMATION_MESSAGE",
-        """We have received your report, we'll contact you to let you know the actions that have been taken.
+    REPORT_CONFIRMATION_MESSAGE = (
+        env(
+            "REPORT_CONFIRMATION_MESSAGE",
+            """We have received your report, we'll contact you to let you know the actions that have been taken.
 
 If you need to contact a moderator directly, please reach out in private with {mods}""",
+        )
+        + f" {BOT_HASHTAGS_STR}"
+    )
+
+    return types.SimpleNamespace(
+        **{key: value for key, value in locals().items() if key.isupper()}
     )
-    + f" {BOT_HASHTAGS_STR}"
-)
+
+
+def get_profiles():
+    if not BOTS:
+        return [load_profile()]
+    return [load_profile(name) for name in BOTS]
+
+
+# Settings that can be changed without a restart, with the settings of each
+# bot, except PROFILE_RESTART_REQUIRED
+RELOADABLE = {
+    "DRY_RUN",
+    "RATE_LIMIT_USER_RATE",
+    "RATE_LIMIT_USER_COUPLE_RATE",
+    "RATE_LIMIT_USER_BURST_RATE",
+    "RATE_LIMIT_STRATEGY",
+    "RATE_LIMIT_EXEMPTED_USERS",
+    "BLOCK_AFTER_REPORTS",
+}
+PROFILE_RESTART_REQUIRED = {
+    "BOT_NAME",
+    "ACCESS_TOKEN",
+    "SERVER_URL",
+    "STREAMING_URL",
+    "STREAMING_STREAM",
+    "DATABASE_PATH",
+}
+
+
+def read_env_file(path):
+    """
+    Return the variables defined in an environment file, with one KEY=value
+    per line. Quoted values can span several lines.
+    """
+    values = {}
+    with open(path) as f:
+        lines = iter(f.read().splitlines())
+    for line in lines:
+        line = line.strip()
+        if not line or line.startswith("#"):
+            continue
+        if line.startswith("export "):
+            line = line[len("export ") :]
+        key, separator, value = line.partition("=")
+        if not separator:
+            raise ValueError(f"Invalid line in {path}: {line!r}")
+        value = value.strip()
+        if value[:1] in ("'", '"'):
+            quote = value[0]
+            while len(value) < 2 or not value.rstrip().endswith(quote):
+                try:
+                    value += "\n" + next(lines)
+                except StopIteration:
+                    raise ValueError(f"Unterminated value for {key} in {path}")
+            value = value.rstrip()[1:-1]
+        values[key.strip()] = value
+    return values
+
+
+def load(values):
+    """
+    Read the settings again from the environment, updated with `values`,
+    and return them as a new module along with the profiles of the bots.
+    The current settings are left untouched, invalid ones raise an error.
+    """
+    spec = importlib.util.find_spec(__name__)
+    module = importlib.util.module_from_spec(spec)
+    previous = {key: os.environ.get(key) for key in values}
+    os.environ.update(values)
+    try:
+        spec.loader.exec_module(module)
+        profiles = module.get_profiles()
+    finally:
+        for key, value in previous.items():
+            if value is None:
+                del os.environ[key]
+            else:
+                os.environ[key] = value
+    return module, profiles
+
+
+def update(module, values):
+    """
+    Switch to the reloadable settings of `module`, returned by load(values).
+    Other changes are ignored until the next restart.
+    """
+    reloadable = set(RELOADABLE)
+    if not BOTS:
+        reloadable |= set(vars(load_profile())) - PROFILE_RESTART_REQUIRED
+    for key, value in vars(module).items():
+        if not key.isupper() or key == "REQUIRED" or value == globals().get(key):
+            continue
+        if key in reloadable:
+            globals()[key] = value
+        else:
+            logging.warning("[Settings] Restart to apply the new %s", key)
+    # so profiles loaded later, e.g. by a new bot, use the new values
+    os.environ.update(values)
+
+
+if not BOTS:
+    # single bot, configured with unprefixed settings
+    globals().update(vars(load_profile()))
@@ -0,0 +1,191 @@
+import sqlite3
+import time
+
+from limits.storage import MemoryStorage, MovingWindowSupport, Storage
+
+
+def prune(storage):
+    """
+    Delete expired entries from the given storage, and return the number
+    of deleted keys or rows.
+
+    The memory storage expires entries by itself, but keeps an empty list
+    for every key used with the moving window strategy.
+    """
+    if isinstance(storage, SQLiteStorage):
+        return storage.prune()
+    if isinstance(storage, MemoryStorage):
+        # the expiry timer of the storage iterates over the keys without
+        # taking the lock, wait for it to be done. Hits, which start it,
+        # happen in this thread.
+        if storage.timer.is_alive():
+            return 0
+        deleted = 0
+        with storage.lock:
+            for key, events in list(storage.events.items()):
+                # expired events are removed by the timer
+                if not events:
+                    storage.events.pop(key, None)
+                    deleted += 1
+        return deleted
+    # other storages such as redis expire keys by themselves
+    return 0
+
+
+class SQLiteStorage(Storage, MovingWindowSupport):
+    """
+    Rate limit storage backed by a SQLite database, so limits survive
+    restarts and can be shared by several processes on the same host.
+
+    Use with a ``sqlite:///absolute/path.sqlite3`` or
+    ``sqlite://relative/path.sqlite3`` URI.
+    """
+
+    STORAGE_SCHEME = ["sqlite"]
+
+    def __init__(self, uri=None, **options):
+        super().__init__(uri, **options)
+        path = uri[len("sqlite://") :] if uri else ":memory:"
+        self.connection = sqlite3.connect(
+            path,
+            timeout=float(options.get("timeout", 5)),
+            isolation_level=None,
+            check_same_thread=False,
+        )
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.executescript("""
+            CREATE TABLE IF NOT EXISTS limits_counters (
+                key TEXT PRIMARY KEY,
+                value INTEGER NOT NULL,
+                expiry REAL NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS limits_events (
+                key TEXT NOT NULL,
+                atime REAL NOT NULL,
+                expiry REAL NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS limits_events_key_atime
+                ON limits_events (key, atime);
+            CREATE INDEX IF NOT EXISTS limits_events_expiry
+                ON limits_events (expiry);
+            """)
+
+    @property
+    def base_exceptions(self):
+        return sqlite3.Error
+
+    def transaction(self):
+        # BEGIN IMMEDIATE takes the write lock right away, so concurrent
+        # processes can't both read a counter then update it
+        self.connection.execute("BEGIN IMMEDIATE")
+
+    def incr(self, key, expiry, elastic_expiry=False, amount=1):
+        now = time.time()
+        with self.lock:
+            self.transaction()
+            try:
+                row = self.connection.execute(
+                    "SELECT value, expiry FROM limits_counters WHERE key = ?", (key,)
+                ).fetchone()
+                if row is None or row[1] <= now:
+                    value, expires_at = amount, now + expiry
+                else:
+                    value = row[0] + amount
+                    expires_at = now + expiry if elastic_expiry else row[1]
+                self.connection.execute(
+                    "INSERT OR REPLACE INTO limits_counters (key, value, expiry) "
+                    "VALUES (?, ?, ?)",
+                    (key, value, expires_at),
+                )
+            except Exception:
+                self.connection.execute("ROLLBACK")
+                raise
+            self.connection.execute("COMMIT")
+        return value
+
+    def get(self, key):
+        with self.lock:
+            row = self.connection.execute(
+                "SELECT value FROM limits_counters WHERE key = ? AND expiry > ?",
+                (key, time.time()),
+            ).fetchone()
+        return row[0] if row else 0
+
+    def get_expiry(self, key):
+        with self.lock:
+            row = self.connection.execute(
+                "SELECT expiry FROM limits_counters WHERE key = ?", (key,)
+            ).fetchone()
+        return int(row[0] if row else time.time())
+
+    def acquire_entry(self, key, limit, expiry, amount=1):
+        if amount > limit:
+            return False
+        now = time.time()
+        with self.lock:
+            self.transaction()
+            try:
+                # entries of this key that are out of the window are useless
+                self.connection.execute(
+                    "DELETE FROM limits_events WHERE key = ? AND atime < ?",
+                    (key, now - expiry),
+                )
+                (acquired,) = self.connection.execute(
+                    "SELECT COUNT(*) FROM limits_events WHERE key = ?", (key,)
+                ).fetchone()
+                success = acquired + amount <= limit
+                if success:
+                    self.connection.executemany(
+                        "INSERT INTO limits_events (key, atime, expiry) "
+                        "VALUES (?, ?, ?)",
+                        [(key, now, now + expiry)] * amount,
+                    )
+            except Exception:
+                self.connection.execute("ROLLBACK")
+                raise
+            self.connection.execute("COMMIT")
+        return success
+
+    def get_moving_window(self, key, limit, expiry):
+        now = time.time()
+        with self.lock:
+            start, acquired = self.connection.execute(
+                "SELECT MIN(atime), COUNT(*) FROM limits_events "
+                "WHERE key = ? AND atime >= ?",
+                (key, now - expiry),
+            ).fetchone()
+        return int(start if start is not None else now), acquired
+
+    def prune(self):
+        """
+        Delete expired counters and moving window entries, and return the
+        number of deleted rows.
+        """
+        now = time.time()
+        with self.lock:
+            deleted = self.connection.execute(
+                "DELETE FROM limits_events WHERE expiry <= ?", (now,)
+            ).rowcount
+            deleted += self.connection.execute(
+                "DELETE FROM limits_counters WHERE expiry <= ?", (now,)
+            ).rowcount
+        return deleted
+
+    def check(self):
+        try:
+            with self.lock:
+                self.connection.execute("SELECT 1")
+        except sqlite3.Error:
+            return False
+        return True
+
+    def reset(self):
+        with self.lock:
+            deleted = self.connection.execute("DELETE FROM limits_events").rowcount
+            deleted += self.connection.execute("DELETE FROM limits_counters").rowcount
+        return deleted
+
+    def clear(self, key):
+        with self.lock:
+            self.connection.execute("DELETE FROM limits_events WHERE key = ?", (key,))
+            self.connection.execute("DELETE FROM limits_counters WHERE key = ?", (key,))
@@ -0,0 +1,120 @@
+import string
+
+FORMATTER = string.Formatter()
+
+
+class Template:
+    """
+    Message template, parsed once.
+
+    `fields` are the values given on each call, `static` the values known in
+    advance, which are rendered right away. Referencing any other field
+    raises a ValueError, so broken templates are detected on startup rather
+    than when sending a message.
+    """
+
+    def __init__(self, name, source, fields=(), static=None):
+        self.name = name
+        static = static or {}
+        # list of literal strings and (field, conversion, format_spec) tuples
+        self.chunks = []
+        auto_index = 0
+        try:
+            parsed = list(FORMATTER.parse(source))
+        except ValueError as e:
+            raise ValueError(f"Invalid template {name}: {e}") from e
+        for literal, field, format_spec, conversion in parsed:
+            if literal:
+                self.add_literal(literal)
+            if field is None:
+                continue
+            if field == "":
+                field = str(auto_index)
+                auto_index += 1
+            root = field.split(".")[0].split("[")[0]
+            if root in static:
+                value, _ = FORMATTER.get_field(field, [], static)
+                self.add_literal(self.render_field(value, conversion, format_spec))
+            elif root in fields:
+                self.chunks.append((field, conversion, format_spec))
+            else:
+                raise ValueError(
+                    f"Invalid template {name}: unknown field {{{field}}}, "
+                    f"available fields are {', '.join(list(fields) + list(static))}"
+                )
+
+    def add_literal(self, text):
+        if self.chunks and isinstance(self.chunks[-1], str):
+            self.chunks[-1] += text
+        else:
+            self.chunks.append(text)
+
+    @staticmethod
+    def render_field(value, conversion, format_spec):
+        if conversion:
+            value = FORMATTER.convert_field(value, conversion)
+        return format(value, format_spec or "")
+
+    def format(self, *args, **kwargs):
+        parts = []
+        for chunk in self.chunks:
+            if isinstance(chunk, str):
+                parts.append(chunk)
+            else:
+                field, conversion, format_spec = chunk
+                value, _ = FORMATTER.get_field(field, args, kwargs)
+                parts.append(self.render_field(value, conversion, format_spec))
+        return "".join(parts)
+
+
+def load(settings):
+    """
+    Compile the message templates from the settings, and return them
+    keyed by name.
+    """
+    report_hashtags = ", ".join(f"#\\{t}" for t in settings.REPORT_HASHTAGS)
+    return {
+        "follow": Template(
+            "FOLLOW_MESSAGE",
+            settings.FOLLOW_MESSAGE,
+            fields=["bot_account", "recipient"],
+        ),
+        "forward": Template(
+            "FORWARD_MESSAGE",
+            settings.FORWARD_MESSAGE,
+            fields=["message"],
+            static={"report_hashtags": report_hashtags},
+        ),
+        "success_forward": Template(
+            "SUCCESS_FORWARD_MESSAGE",
+            settings.SUCCESS_FORWARD_MESSAGE,
+            fields=["0"],
+        ),
+        "error_invalid_account": Template(
+            "ERROR_INVALID_ACCOUNT",
+            settings.ERROR_INVALID_ACCOUNT,
+            fields=["account", "bot_account"],
+            static={"recipient": settings.EXAMPLE_USERNAME},
+        ),
+        "error_invalid_message": Template(
+            "ERROR_INVALID_MESSAGE",
+            settings.ERROR_INVALID_MESSAGE,
+            fields=["bot_account"],
+            static={"recipient": settings.EXAMPLE_USERNAME},
+        ),
+        "report_mod": Template(
+            "REPORT_MOD_MESSAGE",
+            settings.REPORT_MOD_MESSAGE,
+            fields=[
+                "sender",
+                "reported_message_url",
+                "anonymous_sender",
+                "anonymous_sender_url",
+            ],
+        ),
+        "report_confirmation": Template(
+            "REPORT_CONFIRMATION_MESSAGE",
+            settings.REPORT_CONFIRMATION_MESSAGE,
+            static={"mods": ", ".join(settings.MODERATORS_USERNAMES)},
+        ),
+    }
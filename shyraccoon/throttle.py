@@ -0,0 +1,112 @@
+import asyncio
+import datetime
+import heapq
+import itertools
+import logging
+import time
+
+# lower values are served first
+HIGH = 0
+NORMAL = 1
+LOW = 2
+
+
+def parse_reset(value):
+    """
+    Parse a X-RateLimit-Reset header and return the number of seconds
+    until the reset, or None if the header is invalid.
+    """
+    try:
+        reset = datetime.datetime.fromisoformat(value.replace("Z", "+00:00"))
+    except (AttributeError, ValueError):
+        return None
+    if reset.tzinfo is None:
+        reset = reset.replace(tzinfo=datetime.timezone.utc)
+    now = datetime.datetime.now(datetime.timezone.utc)
+    return max(0, (reset - now).total_seconds())
+
+
+class Throttle:
+    """
+    Token bucket pacing requests to the API.
+
+    The bucket holds up to `burst` tokens and is refilled at `rate` tokens per
+    second. The rate is adjusted with the X-RateLimit-* headers returned by
+    the server, so the remaining budget is spread over the time left until
+    the server resets it. When requests are waiting for a token, those with
+    the highest priority are served first.
+    """
+
+    def __init__(self, rate, burst, clock=time.monotonic):
+        self.default_rate = rate
+        self.rate = rate
+        self.burst = burst
+        self.clock = clock
+        self.tokens = burst
+        self.updated_at = clock()
+        self.waiters = []
+        self.counter = itertools.count()
+
+    def reset(self):
+        self.rate = self.default_rate
+        self.tokens = self.burst
+        self.updated_at = self.clock()
+
+    def configure(self, rate, burst):
+        """
+        Change the default rate and the burst, e.g. when settings are
+        reloaded. A rate lowered by the server is kept, up to the new rate.
+        """
+        self.refill()
+        if self.rate == self.default_rate:
+            self.rate = rate
+        else:
+            self.rate = min(self.rate, rate)
+        self.default_rate = rate
+        self.burst = burst
+        self.tokens = min(self.tokens, burst)
+
+    def refill(self):
+        now = self.clock()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+
+    def update(self, headers):
+        remaining = headers.get("x-ratelimit-remaining")
+        reset_in = parse_reset(headers.get("x-ratelimit-reset"))
+        if remaining is None or reset_in is None:
+            return
+        try:
+            remaining = int(remaining)
+        except ValueError:
+            return
+        self.refill()
+        # never spend more than what the server allows
+        self.tokens = min(self.tokens, remaining)
+        if reset_in > 0:
+            # the headers can only slow the bot down below its configured pace
+            self.rate = min(self.default_rate, max(remaining, 1) / reset_in)
+        else:
+            self.rate = self.default_rate
+        logging.debug(
+            "[Throttle] %s requests remaining, pacing at %.2f requests/s",
+            remaining,
+            self.rate,
+        )
+
+    async def acquire(self, priority=NORMAL):
+        entry = [priority, next(self.counter)]
+        heapq.heappush(self.waiters, entry)
+        try:
+            while True:
+                self.refill()
+                if self.waiters[0] is entry and self.tokens >= 1:
+                    heapq.heappop(self.waiters)
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep(max(0.001, (1 - self.tokens) / self.rate))
+        except BaseException:
+            if entry in self.waiters:
+                self.waiters.remove(entry)
+                heapq.heapify(self.waiters)
+            raise
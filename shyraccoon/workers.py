@@ -0,0 +1,63 @@
+import asyncio
+import logging
+import zlib
+
+
+class WorkerPool:
+    """
+    Dispatch events to a fixed number of concurrent workers.
+
+    Events sharing the same key are always handled by the same worker, in the
+    order they were submitted. Once `high_water` events are waiting, `submit`
+    blocks until workers catch up.
+    """
+
+    def __init__(self, handler, key, size, high_water):
+        self.handler = handler
+        self.key = key
+        self.queues = [asyncio.Queue() for _ in range(size)]
+        self.high_water = high_water
+        self.slots = asyncio.Semaphore(high_water)
+        self.tasks = []
+
+    @property
+    def depth(self):
+        return sum(queue.qsize() for queue in self.queues)
+
+    def start(self):
+        self.tasks = [
+            asyncio.create_task(self.work(queue), name=f"worker-{i}")
+            for i, queue in enumerate(self.queues)
+        ]
+
+    async def stop(self):
+        for task in self.tasks:
+            task.cancel()
+        await asyncio.gather(*self.tasks, return_exceptions=True)
+        self.tasks = []
+
+    async def join(self):
+        await asyncio.gather(*[queue.join() for queue in self.queues])
+
+    def get_queue(self, event):
+        key = str(self.key(event) or "")
+        return self.queues[zlib.crc32(key.encode()) % len(self.queues)]
+
+    async def submit(self, event):
+        if self.slots.locked():
+            logging.warning(
+                "[Workers] Queue reached %s pending events, waiting…", self.high_water
+            )
+        await self.slots.acquire()
+        self.get_queue(event).put_nowait(event)
+
+    async def work(self, queue):
+        while True:
+            event = await queue.get()
+            try:
+                await self.handler(event)
+            except Exception:
+                logging.exception("Error while handling event %s", event)
+            finally:
+                queue.task_done()
+                self.slots.release()
@@ -0,0 +1,25 @@
+import pytest
+
+from shyraccoon import db, main, metrics
+
+
+@pytest.fixture(autouse=True)
+async def http_client():
+    yield
+    # the shared client is bound to the test event loop
+    await main.close_http_client()
+
+
+@pytest.fixture(autouse=True)
+def bots():
+    yield
+    # drop caches, follower index, throttle state…
+    main.BOTS = None
+    main.limits_storage.reset()
+    metrics.REGISTRY.reset()
+
+
+@pytest.fixture(autouse=True)
+def database():
+    yield
+    db.close_connection()
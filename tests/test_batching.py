@@ -0,0 +1,91 @@
+import asyncio
+
+import pytest
+
+from shyraccoon import batching, main, settings
+
+
+async def test_batcher_coalesces_concurrent_lookups():
+    calls = []
+
+    async def fetch(keys):
+        calls.append(keys)
+        return {key: key.upper() for key in keys}
+
+    batcher = batching.Batcher(fetch, delay=0.001, max_size=10)
+    results = await asyncio.gather(batcher.get("a"), batcher.get("b"), batcher.get("a"))
+
+    assert results == ["A", "B", "A"]
+    assert calls == [["a", "b"]]
+
+
+async def test_batcher_flushes_when_full():
+    calls = []
+
+    async def fetch(keys):
+        calls.append(keys)
+        return {key: key for key in keys}
+
+    batcher = batching.Batcher(fetch, delay=10, max_size=2)
+    results = await asyncio.wait_for(
+        asyncio.gather(batcher.get("a"), batcher.get("b")), 1
+    )
+
+    assert results == ["a", "b"]
+    assert calls == [["a", "b"]]
+
+
+async def test_batcher_propagates_errors():
+    async def fetch(keys):
+        raise ValueError()
+
+    batcher = batching.Batcher(fetch, delay=0.001, max_size=10)
+    with pytest.raises(ValueError):
+        await batcher.get("a")
+
+
+async def test_get_relationship_batches_requests(respx_mock):
+    route = respx_mock.get(
+        f"{settings.SERVER_URL}/api/v1/accounts/relationships?id[]=1&id[]=2"
+    ).respond(
+        json=[
+            {"id": "2", "followed_by": False},
+            {"id": "1", "followed_by": True},
+        ]
+    )
+
+    results = await asyncio.gather(
+        main.get_relationship(settings.SERVER_URL, "1", settings.ACCESS_TOKEN),
+        main.get_relationship(settings.SERVER_URL, "2", settings.ACCESS_TOKEN),
+    )
+
+    assert [r["followed_by"] for r in results] == [True, False]
+    assert route.call_count == 1
+
+
+async def test_get_relationship_in_workers_only_caches_followers(
+    respx_mock, monkeypatch
+):
+    monkeypatch.setattr(main, "CACHE_NOT_FOLLOWED", False)
+    route = respx_mock.get(
+        f"{settings.SERVER_URL}/api/v1/accounts/relationships?id[]=1&id[]=2"
+    ).respond(
+        json=[
+            {"id": "1", "followed_by": True},
+            {"id": "2", "followed_by": False},
+        ]
+    )
+    not_followed = respx_mock.get(
+        f"{settings.SERVER_URL}/api/v1/accounts/relationships?id[]=2"
+    ).respond(json=[{"id": "2", "followed_by": True}])
+
+    for i in range(2):
+        results = await asyncio.gather(
+            main.get_relationship(settings.SERVER_URL, "1", settings.ACCESS_TOKEN),
+            main.get_relationship(settings.SERVER_URL, "2", settings.ACCESS_TOKEN),
+        )
+
+    # e.g. account 2 followed the bot, with the follow handled by another worker
+    assert [r["followed_by"] for r in results] == [True, True]
+    assert route.call_count == 1
+    assert not_followed.call_count == 1
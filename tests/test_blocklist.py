@@ -0,0 +1,104 @@
+import sqlite3
+
+import pytest
+
+from shyraccoon import blocklist, db, main, settings
+
+bot_data = {"id": "bot", "acct": "ShyRaccoon"}
+
+
+class Clock:
+    def __init__(self):
+        self.now = 0
+
+    def __call__(self):
+        return self.now
+
+
+def test_blocklist_blocks_senders_and_pairs():
+    blocked = blocklist.Blocklist(db.get_connection(), reload_interval=10)
+
+    blocked.block("@Spammer@server.test")
+    blocked.block("stalker", recipient="Victim@server.test", reason="harassment")
+
+    assert blocked.is_blocked("spammer@server.test")
+    assert blocked.is_blocked("spammer@server.test", "anyone")
+    assert blocked.is_blocked("stalker", "victim@server.test")
+    assert not blocked.is_blocked("stalker")
+    assert not blocked.is_blocked("stalker", "someone")
+
+    assert blocked.unblock("spammer@server.test") is True
+    assert blocked.unblock("spammer@server.test") is False
+    assert not blocked.is_blocked("spammer@server.test")
+
+
+def test_blocklist_picks_up_changes_from_other_processes(tmp_path):
+    path = str(tmp_path / "blocklist.sqlite3")
+    clock = Clock()
+    running = blocklist.Blocklist(
+        db.get_connection(path), reload_interval=10, clock=clock
+    )
+    # e.g. the block command
+    connection = sqlite3.connect(path, isolation_level=None)
+    connection.row_factory = sqlite3.Row
+    blocklist.Blocklist(connection, reload_interval=10).block("spammer")
+    connection.close()
+
+    assert not running.is_blocked("spammer")
+    clock.now += 10
+    assert running.is_blocked("spammer")
+
+
+def test_blocklist_counts_reported_statuses():
+    blocked = blocklist.Blocklist(db.get_connection(), reload_interval=10)
+
+    assert blocked.add_report("status1", "anonymous") == 1
+    # reported twice
+    assert blocked.add_report("status1", "anonymous") == 1
+    assert blocked.add_report("status2", "Anonymous") == 2
+
+
+async def test_handle_message_drops_blocked_senders(respx_mock):
+    main.get_blocklist().block("spammer")
+    main.get_blocklist().block("stalker", recipient="victim")
+    payload = {
+        "id": "postid",
+        "visibility": "direct",
+        "content": "<p>for ?victim:</p><p>Hello</p>",
+        "mentions": [{"id": bot_data["id"]}],
+    }
+
+    for sender in ["spammer", "stalker"]:
+        action = await main.handle_message(
+            {**payload, "account": {"id": sender, "acct": sender}},
+            bot_data=bot_data,
+            server_url=settings.SERVER_URL,
+            access_token=settings.ACCESS_TOKEN,
+        )
+        assert action == main.SKIP
+
+    # no API call
+    assert respx_mock.calls.call_count == 0
+
+
+@pytest.mark.respx(assert_all_called=False)
+async def test_handle_report_blocks_sender_after_reports(respx_mock, monkeypatch):
+    monkeypatch.setattr(settings, "BLOCK_AFTER_REPORTS", 2)
+    respx_mock.post(url__regex=r".*/bookmark").respond(json={})
+    respx_mock.post(f"{settings.SERVER_URL}/api/v1/statuses").respond(
+        json={"id": "resultid"}
+    )
+
+    for status_id in ["reported1", "reported2"]:
+        assert not main.get_blocklist().is_blocked("anonymous")
+        await main.handle_report(
+            {
+                "action": "report",
+                "anonymous_sender": {"acct": "anonymous", "url": "https://a.test"},
+                "sender": {"acct": "sender"},
+                "report": {"id": f"report-{status_id}"},
+                "reported_message": {"id": status_id, "url": "https://r.test"},
+            }
+        )
+
+    assert main.get_blocklist().is_blocked("anonymous")
@@ -0,0 +1,51 @@
+import asyncio
+
+from shyraccoon import main, settings
+
+
+def test_load_profile(monkeypatch):
+    monkeypatch.setenv("FR_SERVER_URL", "https://fr.test")
+    monkeypatch.setenv("FR_FORWARD_MESSAGE", "Message : {message}")
+    monkeypatch.setenv("FR_BOT_HASHTAGS", "raton")
+
+    profile = settings.load_profile("fr")
+
+    assert profile.BOT_NAME == "fr"
+    assert profile.SERVER_URL == "https://fr.test"
+    # not overridden
+    assert profile.ACCESS_TOKEN == settings.ACCESS_TOKEN
+    assert profile.MODERATORS_USERNAMES == settings.MODERATORS_USERNAMES
+    assert profile.FORWARD_MESSAGE == "Message : {message} #raton"
+    assert profile.FOLLOW_MESSAGE.endswith(" #raton")
+
+
+def test_get_database_path(monkeypatch):
+    monkeypatch.setattr(settings, "DATABASE_PATH", "/srv/shyraccoon.sqlite3")
+
+    assert settings.get_database_path("") == "/srv/shyraccoon.sqlite3"
+    assert settings.get_database_path("fr") == "/srv/shyraccoon-fr.sqlite3"
+
+
+async def test_bots_act_with_their_own_account(respx_mock, monkeypatch, tmp_path):
+    monkeypatch.setattr(settings, "BOTS", ["en", "fr"])
+    monkeypatch.setenv("FR_SERVER_URL", "https://fr.test")
+    monkeypatch.setenv("FR_ACCESS_TOKEN", "frtoken")
+    monkeypatch.setenv("FR_DATABASE_PATH", str(tmp_path / "fr.sqlite3"))
+    en_route = respx_mock.post(f"{settings.SERVER_URL}/api/v1/statuses").respond(
+        json={"id": "1"}
+    )
+    fr_route = respx_mock.post("https://fr.test/api/v1/statuses").respond(
+        json={"id": "2"}
+    )
+    en, fr = main.get_bots()
+    action = {"action": "reply", "message": "hello", "recipient": {"acct": "someone"}}
+
+    await asyncio.gather(
+        main.run_as(en, main.handle_reply(action)),
+        main.run_as(fr, main.handle_reply(action)),
+    )
+
+    assert en_route.calls[0].request.headers["authorization"] == "Bearer faketoken"
+    assert fr_route.calls[0].request.headers["authorization"] == "Bearer frtoken"
+    assert en.outbox is not fr.outbox
+    assert main.get_bot() is en
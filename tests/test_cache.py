@@ -0,0 +1,52 @@
+from shyraccoon import cache
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0
+
+    def __call__(self):
+        return self.now
+
+
+def test_ttl_cache_get_set():
+    c = cache.TTLCache(maxsize=10, ttl=60)
+
+    assert c.get("key") is cache.MISSING
+    c.set("key", "value")
+    assert c.get("key") == "value"
+    assert c.stats() == {"size": 1, "hits": 1, "misses": 1}
+
+
+def test_ttl_cache_expiry():
+    clock = FakeClock()
+    c = cache.TTLCache(maxsize=10, ttl=60, clock=clock)
+    c.set("key", "value")
+
+    clock.now = 59
+    assert c.get("key") == "value"
+    clock.now = 60
+    assert c.get("key") is cache.MISSING
+    assert len(c) == 0
+
+
+def test_ttl_cache_lru_eviction():
+    c = cache.TTLCache(maxsize=2, ttl=60)
+    c.set("a", 1)
+    c.set("b", 2)
+    # a is now the most recently used entry
+    c.get("a")
+    c.set("c", 3)
+
+    assert c.get("a") == 1
+    assert c.get("b") is cache.MISSING
+    assert c.get("c") == 3
+
+
+def test_ttl_cache_invalidate():
+    c = cache.TTLCache(maxsize=2, ttl=60)
+    c.set("a", 1)
+    c.invalidate("a")
+    c.invalidate("unknown")
+
+    assert c.get("a") is cache.MISSING
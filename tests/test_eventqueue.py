@@ -0,0 +1,111 @@
+import pytest
+
+from shyraccoon import db, eventqueue, main, settings
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock():
+    return Clock()
+
+
+@pytest.fixture
+def queue(clock):
+    return eventqueue.EventQueue(db.get_connection(), lease=30, clock=clock)
+
+
+def get_event(notification_id):
+    return {"event": "notification", "data": {"id": notification_id}}
+
+
+def test_event_queue_ignores_duplicates(queue):
+    assert queue.publish("bot", get_event("1"), sender="alice") is True
+    assert queue.publish("bot", get_event("1"), sender="alice") is False
+    # notification ids are only unique for a given bot
+    assert queue.publish("other", get_event("1"), sender="alice") is True
+
+    assert queue.depth() == 2
+
+
+def test_event_queue_claims_events_of_a_sender_in_order(queue):
+    queue.publish("bot", get_event("1"), sender="alice")
+    queue.publish("bot", get_event("2"), sender="alice")
+    queue.publish("bot", get_event("3"), sender="bob")
+
+    first_id, bot, event = queue.claim("worker1")
+    assert (bot, event) == ("bot", get_event("1"))
+    # alice's second message waits for the first one to be handled
+    _, _, event = queue.claim("worker2")
+    assert event == get_event("3")
+    assert queue.claim("worker2") is None
+
+    queue.complete(first_id)
+    _, _, event = queue.claim("worker2")
+    assert event == get_event("2")
+
+
+def test_event_queue_reclaims_expired_events(queue, clock):
+    queue.publish("bot", get_event("1"), sender="alice")
+    queue_id, _, _ = queue.claim("worker1")
+    assert queue.claim("worker2") is None
+
+    clock.now += 20
+    assert queue.extend(queue_id, "worker1") is True
+    clock.now += 20
+    assert queue.claim("worker2") is None
+
+    # worker1 died
+    clock.now += 20
+    assert queue.claim("worker2")[0] == queue_id
+    assert queue.extend(queue_id, "worker1") is False
+
+    queue.complete(queue_id)
+    assert queue.depth() == 0
+    clock.now += 100
+    assert queue.prune(50) == 1
+    # pruned events are not detected as duplicates anymore
+    assert queue.publish("bot", get_event("1")) is True
+
+
+def test_event_queue_lease_is_taken_over_once_expired(queue, clock):
+    assert queue.acquire_lease("reader", "reader1") is True
+    assert queue.acquire_lease("reader", "reader2") is False
+
+    clock.now += 20
+    assert queue.acquire_lease("reader", "reader1") is True
+    clock.now += 20
+    assert queue.acquire_lease("reader", "reader2") is False
+
+    # reader1 stopped renewing its lease
+    clock.now += 20
+    assert queue.acquire_lease("reader", "reader2") is True
+    assert queue.acquire_lease("reader", "reader1") is False
+
+    queue.release_lease("reader", "reader2")
+    assert queue.acquire_lease("reader", "reader1") is True
+
+
+async def test_run_steps_resumes_action_of_reclaimed_event(respx_mock):
+    route = respx_mock.post(f"{settings.SERVER_URL}/api/v1/statuses").respond(
+        json={"id": "reply"}
+    )
+    steps = [{"name": "reply", "path": "/api/v1/statuses", "data": {}}]
+
+    token = main.EVENT_ID.set("bot:1")
+    try:
+        first = await main.run_steps("reply", steps)
+        # the event is handled again, e.g. after the worker lost its lease
+        second = await main.run_steps("reply", steps)
+    finally:
+        main.EVENT_ID.reset(token)
+
+    assert first == second == {"reply": {"id": "reply"}}
+    assert route.call_count == 1
+    assert len(main.get_outbox().get_steps("bot:1:reply")) == 1
@@ -0,0 +1,62 @@
+import pytest
+
+from shyraccoon import followers, main, settings
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0
+
+    def __call__(self):
+        return self.now
+
+
+def test_follower_index_staleness():
+    clock = FakeClock()
+    index = followers.FollowerIndex(max_age=60, clock=clock)
+    assert index.is_stale()
+
+    index.start_reload()
+    index.finish_reload({"1", "2"})
+    assert not index.is_stale()
+    assert "1" in index
+    assert "3" not in index
+
+    clock.now = 61
+    assert index.is_stale()
+
+
+def test_follower_index_keeps_follows_received_during_reload():
+    index = followers.FollowerIndex(max_age=60)
+    index.start_reload()
+    index.add("3")
+    index.finish_reload({"1", "2"})
+
+    assert index.ids == {"1", "2", "3"}
+
+
+@pytest.mark.parametrize(
+    "link_host",
+    [
+        settings.SERVER_URL,
+        # e.g. a server with a WEB_DOMAIN
+        "https://Web.Domain.test",
+    ],
+)
+async def test_reload_followers_paginates(respx_mock, link_host):
+    respx_mock.get(
+        f"{settings.SERVER_URL}/api/v1/accounts/bot/followers?limit=80"
+    ).respond(
+        json=[{"id": "1"}, {"id": "2"}],
+        headers={
+            "link": f'<{link_host}/api/v1/accounts/bot/followers?limit=80&max_id=2>; rel="next"'
+        },
+    )
+    respx_mock.get(
+        f"{settings.SERVER_URL}/api/v1/accounts/bot/followers?limit=80&max_id=2"
+    ).respond(json=[{"id": "3"}])
+
+    await main.reload_followers(settings.SERVER_URL, "bot", settings.ACCESS_TOKEN)
+
+    assert main.get_bot().followers.ids == {"1", "2", "3"}
+    assert not main.get_bot().followers.is_stale()
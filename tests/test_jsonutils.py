@@ -0,0 +1,21 @@
+import json
+
+from shyraccoon import jsonutils
+
+
+def test_loads():
+    assert jsonutils.loads('{"hello": ["world", 1]}') == {"hello": ["world", 1]}
+    assert jsonutils.loads(b'{"hello": null}') == {"hello": None}
+
+
+def test_peek_event():
+    message = json.dumps(
+        {
+            "stream": ["user"],
+            "event": "update",
+            "payload": json.dumps({"event": "notification", "content": "hello"}),
+        }
+    )
+
+    assert jsonutils.peek_event(message) == "update"
+    assert jsonutils.peek_event('{"stream": ["user"]}') is None
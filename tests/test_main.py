@@ -1,7 +1,12 @@
-import pytest
-from shyraccoon import main, settings
+import asyncio
+import json
+import time
 
-import requests_mock
+import httpx
+import limits
+import pytest
+import websockets
+from shyraccoon import main, metrics, settings
 
 bot_data = {
     "id": "110108208783335072",
@@ -47,13 +52,13 @@ bot_data = {
                 "id": "postid",
                 "visibility": "direct",
                 "content": "Question pour quelqu'un",
-                "account": {"id": "someone"},
+                "account": {"id": "someone", "acct": "someone"},
                 "mentions": [{"id": bot_data["id"]}],
             },
             {
                 "action": "reply",
                 "in_reply_to_id": "postid",
-                "recipient": {"id": "someone"},
+                "recipient": {"id": "someone", "acct": "someone"},
                 "message": settings.ERROR_INVALID_ACCOUNT.format(
                     account="",
                     bot_account="ShyRaccoon",
@@ -164,42 +169,38 @@ bot_data = {
         ),
     ],
 )
-def test_handle_message(payload, expected, requests_mock):
-    requests_mock.get(
+@pytest.mark.respx(assert_all_called=False)
+async def test_handle_message(payload, expected, respx_mock):
+    respx_mock.get(
         f"{settings.SERVER_URL}/api/v1/statuses/someshyraccoonpost",
+    ).respond(
         json={
             "id": "someshyraccoonpost",
             "account": {"id": bot_data["id"]},
             "in_reply_to_account_id": "not_following",
-        },
+        }
     )
-    requests_mock.get(
+    respx_mock.get(
         f"{settings.SERVER_URL}/api/v1/statuses/somerandompost",
-        json={"account": {"id": "randomuser"}},
-    )
-    requests_mock.get(
+    ).respond(json={"account": {"id": "randomuser"}})
+    respx_mock.get(
         f"{settings.SERVER_URL}/api/v1/accounts/relationships?id[]=not_following",
-        json=[{"followed_by": False}],
-    )
-    requests_mock.get(
+    ).respond(json=[{"followed_by": False}])
+    respx_mock.get(
         f"{settings.SERVER_URL}/api/v1/accounts/relationships?id[]=following",
-        json=[{"followed_by": True}],
-    )
-    requests_mock.get(
+    ).respond(json=[{"followed_by": True}])
+    respx_mock.get(
         f"{settings.SERVER_URL}/api/v1/accounts/lookup?acct=not_following",
-        json={"id": "not_following", "acct": "not_following"},
-    )
-    requests_mock.get(
+    ).respond(json={"id": "not_following", "acct": "not_following"})
+    respx_mock.get(
         f"{settings.SERVER_URL}/api/v1/accounts/lookup?acct=following",
-        json={"id": "following", "acct": "following"},
-    )
-    requests_mock.get(
+    ).respond(json={"id": "following", "acct": "following"})
+    respx_mock.get(
         f"{settings.SERVER_URL}/api/v1/accounts/not_following",
-        json={"id": "not_following"},
-    )
+    ).respond(json={"id": "not_following"})
 
     assert (
-        main.handle_message(
+        await main.handle_message(
             payload,
             bot_data=bot_data,
             server_url=settings.SERVER_URL,
@@ -209,26 +210,13 @@ def test_handle_message(payload, expected, requests_mock):
     )
 
 
-@pytest.mark.parametrize(
-    "content,expected",
-    [
-        ("question for ?toto\n\n", None),
-        ("question for ?toto\n\ncoucou  ", "coucou"),
-        ("question for ?toto:\n\nbonjour\n\ncoucou  ", "bonjour\n\ncoucou"),
-        ("for ?toto : \nSome content\n", "Some content"),
-    ],
-)
-def test_prepare_for_forward(content, expected):
-    assert main.prepare_for_forward(content) == expected
+async def test_handle_skip():
+    await main.handle_skip({"action": "skip"})
 
 
-def test_handle_skip():
-    main.handle_skip({"action": "skip"})
-
-
-def test_handle_notification_follow(requests_mock):
-    requests_mock.post(f"{settings.SERVER_URL}/api/v1/statuses", json={})
-    main.handle_follow(
+async def test_handle_notification_follow(respx_mock):
+    respx_mock.post(f"{settings.SERVER_URL}/api/v1/statuses").respond(json={})
+    await main.handle_follow(
         {
             "action": "follow",
             "sender": {"acct": "hello@world"},
@@ -236,22 +224,22 @@ def test_handle_notification_follow(requests_mock):
         }
     )
 
-    request = requests_mock.request_history[0]
+    request = respx_mock.calls[0].request
 
     message = settings.FOLLOW_MESSAGE.format(
         bot_account="shyraccoon",
         recipient="hello@world",
     )
-    assert request.json() == {
+    assert json.loads(request.content) == {
         "status": f"@hello@world {message}",
         "visibility": "direct",
     }
 
 
-def test_handle_reply(requests_mock):
-    requests_mock.post(f"{settings.SERVER_URL}/api/v1/statuses", json={})
+async def test_handle_reply(respx_mock):
+    respx_mock.post(f"{settings.SERVER_URL}/api/v1/statuses").respond(json={})
 
-    main.handle_reply(
+    await main.handle_reply(
         {
             "action": "reply",
             "message": "hello",
@@ -260,19 +248,19 @@ def test_handle_reply(requests_mock):
         }
     )
 
-    request = requests_mock.request_history[0]
+    request = respx_mock.calls[0].request
 
-    assert request.json() == {
+    assert json.loads(request.content) == {
         "status": f"@hello@world hello",
         "visibility": "direct",
         "in_reply_to_id": "previous",
     }
 
 
-def test_handle_forward(requests_mock):
-    requests_mock.post(f"{settings.SERVER_URL}/api/v1/statuses", json={})
+async def test_handle_forward(respx_mock):
+    respx_mock.post(f"{settings.SERVER_URL}/api/v1/statuses").respond(json={})
 
-    main.handle_forward(
+    await main.handle_forward(
         {
             "action": "forward",
             "spoiler_text": "cw",
@@ -283,27 +271,78 @@ def test_handle_forward(requests_mock):
         }
     )
 
-    forward = requests_mock.request_history[0]
-    confirmation = requests_mock.request_history[1]
+    # the forward and the confirmation are posted concurrently
+    forward, confirmation = sorted(
+        [call.request for call in respx_mock.calls],
+        key=lambda request: "spoiler_text" not in json.loads(request.content),
+    )
 
     forward_message = settings.FORWARD_MESSAGE.format(
         message="hello",
         report_hashtags=", ".join(f"#\\{t}" for t in settings.REPORT_HASHTAGS),
     )
-    assert forward.json() == {
+    assert json.loads(forward.content) == {
         "status": f"@recipient@world {forward_message}",
         "visibility": "direct",
         "spoiler_text": "cw",
         "in_reply_to_id": "previous",
     }
-    assert confirmation.json() == {
+    assert json.loads(confirmation.content) == {
         "status": f"@sender@world {settings.SUCCESS_FORWARD_MESSAGE.format('recipient@world')}",
         "visibility": "direct",
         "in_reply_to_id": "previous",
     }
 
 
-def test_handle_report(requests_mock):
+async def test_handle_message_resolves_forwarded_reports_locally(respx_mock):
+    def post_status(request):
+        if "spoiler_text" in json.loads(request.content):
+            return httpx.Response(200, json={"id": "forwarded", "url": "https://f"})
+        return httpx.Response(200, json={"id": "confirmation"})
+
+    respx_mock.post(f"{settings.SERVER_URL}/api/v1/statuses").mock(
+        side_effect=post_status
+    )
+    sender = {"id": "sender", "acct": "sender@world", "url": "https://sender"}
+    await main.handle_forward(
+        {
+            "action": "forward",
+            "spoiler_text": "cw",
+            "message": "hello",
+            "sender": sender,
+            "recipient": {"acct": "recipient@world"},
+            "in_reply_to_id": "previous",
+        }
+    )
+    calls = len(respx_mock.calls)
+    payload = {
+        "id": "postid",
+        "visibility": "direct",
+        "account": {"id": "recipient"},
+        "in_reply_to_id": "forwarded",
+        "content": "noop",
+        "tags": [{"name": "report", "url": "https://server.test/tags/report"}],
+        "mentions": [{"id": bot_data["id"]}],
+    }
+
+    action = await main.handle_message(
+        payload,
+        bot_data=bot_data,
+        server_url=settings.SERVER_URL,
+        access_token=settings.ACCESS_TOKEN,
+    )
+
+    assert len(respx_mock.calls) == calls
+    assert action == {
+        "action": "report",
+        "anonymous_sender": {"acct": "sender@world", "url": "https://sender"},
+        "sender": {"id": "recipient"},
+        "reported_message": {"id": "forwarded", "url": "https://f"},
+        "report": payload,
+    }
+
+
+async def test_handle_report(respx_mock):
     payload = {
         "action": "report",
         "anonymous_sender": {
@@ -317,28 +356,37 @@ def test_handle_report(requests_mock):
             "url": "http://url.test/reported",
         },
     }
-    requests_mock.post(
-        f"{settings.SERVER_URL}/api/v1/statuses/reportedpost/bookmark", json={}
-    )
-    requests_mock.post(
-        f"{settings.SERVER_URL}/api/v1/statuses/resultid/bookmark", json={}
+    respx_mock.post(
+        f"{settings.SERVER_URL}/api/v1/statuses/reportedpost/bookmark"
+    ).respond(json={})
+    respx_mock.post(f"{settings.SERVER_URL}/api/v1/statuses/resultid/bookmark").respond(
+        json={}
     )
-    requests_mock.post(
-        f"{settings.SERVER_URL}/api/v1/statuses", json={"id": "resultid"}
+    respx_mock.post(f"{settings.SERVER_URL}/api/v1/statuses").respond(
+        json={"id": "resultid"}
     )
-    main.handle_report(payload)
-
-    reported_bookmark = requests_mock.request_history[0]
-    mod_notification = requests_mock.request_history[1]
-    mod_notification_bookmark = requests_mock.request_history[2]
-    sender_reply = requests_mock.request_history[3]
-    sender_reply_bookmark = requests_mock.request_history[4]
+    await main.handle_report(payload)
 
+    # independent posts go out together, bookmarks wait for their status
+    requests = [call.request for call in respx_mock.calls]
+    assert len(requests) == 5
+    first_batch = sorted(r.url.path for r in requests[:3])
+    assert first_batch == [
+        "/api/v1/statuses",
+        "/api/v1/statuses",
+        "/api/v1/statuses/reportedpost/bookmark",
+    ]
     # all posts related to moderation/reports should be bookmarked
     # to avoid deletion
-    assert reported_bookmark.path == "/api/v1/statuses/reportedpost/bookmark"
-    assert mod_notification_bookmark.path == "/api/v1/statuses/resultid/bookmark"
-    assert sender_reply_bookmark.path == "/api/v1/statuses/resultid/bookmark"
+    assert [r.url.path for r in requests[3:]] == [
+        "/api/v1/statuses/resultid/bookmark",
+        "/api/v1/statuses/resultid/bookmark",
+    ]
+    mod_notification, sender_reply = [
+        r for r in requests if r.url.path == "/api/v1/statuses"
+    ]
+    if json.loads(mod_notification.content)["status"].startswith("@sender"):
+        mod_notification, sender_reply = sender_reply, mod_notification
 
     mod_message = settings.REPORT_MOD_MESSAGE.format(
         sender="sender",
@@ -347,13 +395,189 @@ def test_handle_report(requests_mock):
         anonymous_sender_url="https://anonymous.test",
     )
     mods = [f"@{m}" for m in settings.MODERATORS_USERNAMES]
-    assert mod_notification.json() == {
+    assert json.loads(mod_notification.content) == {
         "status": f"{' '.join(mods)} {mod_message}",
         "visibility": "direct",
         "in_reply_to_id": "reportid",
     }
-    assert sender_reply.json() == {
+    assert json.loads(sender_reply.content) == {
         "status": f"@sender {settings.REPORT_CONFIRMATION_MESSAGE.format(mods=', '.join(settings.MODERATORS_USERNAMES))}",
         "visibility": "direct",
         "in_reply_to_id": "reportid",
     }
+
+
+async def test_http_client_is_shared(respx_mock):
+    respx_mock.get(f"{settings.SERVER_URL}/api/v1/accounts/lookup?acct=a").respond(
+        json={}
+    )
+    respx_mock.post(f"{settings.SERVER_URL}/api/v1/statuses").respond(json={})
+    client = main.get_http_client()
+
+    await main.get_data(
+        settings.SERVER_URL, "/api/v1/accounts/lookup?acct=a", settings.ACCESS_TOKEN
+    )
+    await main.post_data(
+        settings.SERVER_URL, "/api/v1/statuses", settings.ACCESS_TOKEN, data={}
+    )
+
+    assert main.get_http_client() is client
+    assert len(respx_mock.calls) == 2
+
+
+async def test_handle_message_caches_lookups(respx_mock):
+    lookup = respx_mock.get(
+        f"{settings.SERVER_URL}/api/v1/accounts/lookup?acct=following",
+    ).respond(json={"id": "following", "acct": "following"})
+    relationships = respx_mock.get(
+        f"{settings.SERVER_URL}/api/v1/accounts/relationships?id[]=following",
+    ).respond(json=[{"followed_by": True}])
+    payload = {
+        "id": "postid",
+        "visibility": "direct",
+        "account": {"id": "someone", "acct": "someone"},
+        "content": "<p>for ?following:</p><p>How old are you?</p>",
+        "mentions": [{"id": bot_data["id"]}],
+    }
+
+    for i in range(2):
+        action = await main.handle_message(
+            payload,
+            bot_data=bot_data,
+            server_url=settings.SERVER_URL,
+            access_token=settings.ACCESS_TOKEN,
+        )
+        assert action["action"] == "forward"
+
+    assert lookup.call_count == 1
+    assert relationships.call_count == 1
+
+    main.invalidate_account({"id": "following", "acct": "following"})
+    await main.handle_message(
+        payload,
+        bot_data=bot_data,
+        server_url=settings.SERVER_URL,
+        access_token=settings.ACCESS_TOKEN,
+    )
+    assert lookup.call_count == 2
+    assert relationships.call_count == 2
+
+
+@pytest.mark.respx(assert_all_called=False)
+async def test_handle_message_uses_follower_index(respx_mock):
+    respx_mock.get(
+        f"{settings.SERVER_URL}/api/v1/accounts/lookup?acct=following",
+    ).respond(json={"id": "following", "acct": "following"})
+    relationships = respx_mock.get(
+        f"{settings.SERVER_URL}/api/v1/accounts/relationships?id[]=following",
+    ).respond(json=[{"followed_by": False}])
+    main.get_bot().followers.start_reload()
+    main.get_bot().followers.finish_reload({"following"})
+
+    action = await main.handle_message(
+        {
+            "id": "postid",
+            "visibility": "direct",
+            "account": {"id": "someone", "acct": "someone"},
+            "content": "<p>for ?following:</p><p>How old are you?</p>",
+            "mentions": [{"id": bot_data["id"]}],
+        },
+        bot_data=bot_data,
+        server_url=settings.SERVER_URL,
+        access_token=settings.ACCESS_TOKEN,
+    )
+
+    assert action["action"] == "forward"
+    assert relationships.call_count == 0
+
+
+async def test_start_stream_only_decodes_handled_events():
+    messages = [
+        {"event": "update", "payload": "not even json"},
+        {"event": "notification", "payload": json.dumps({"id": "1"})},
+    ]
+    received = asyncio.Queue()
+    paths = []
+
+    async def send_messages(websocket):
+        paths.append(websocket.path)
+        for message in messages:
+            await websocket.send(json.dumps(message))
+
+    async with websockets.serve(send_messages, "localhost", 0) as server:
+        port = server.sockets[0].getsockname()[1]
+        stream = asyncio.create_task(
+            main.start_stream(
+                server_url=f"http://localhost:{port}",
+                streaming_url="/api/v1/streaming",
+                access_token=settings.ACCESS_TOKEN,
+                callback=received.put,
+                events={"notification"},
+                stream="user:notification",
+            )
+        )
+        event = await asyncio.wait_for(received.get(), 5)
+        stream.cancel()
+
+    assert event == {"event": "notification", "data": {"id": "1"}}
+    assert paths == ["/api/v1/streaming?stream=user:notification"]
+
+
+@pytest.mark.respx(assert_all_called=False)
+async def test_handle_message_rejects_senders_over_limits_early(
+    respx_mock, monkeypatch, mocker
+):
+    respx_mock.get(
+        f"{settings.SERVER_URL}/api/v1/accounts/lookup?acct=following",
+    ).respond(json={"id": "following", "acct": "following"})
+    respx_mock.get(
+        f"{settings.SERVER_URL}/api/v1/accounts/relationships?id[]=following",
+    ).respond(json=[{"followed_by": True}])
+    monkeypatch.setattr(main, "GLOBAL_LIMITS", limits.parse_many("2/day"))
+    lookup_account = mocker.spy(main, "lookup_account")
+    payload = {
+        "id": "postid",
+        "visibility": "direct",
+        "account": {"id": "flooder", "acct": "flooder"},
+        "content": "<p>for ?following:</p><p>How old are you?</p>",
+        "mentions": [{"id": bot_data["id"]}],
+    }
+
+    actions = [
+        await main.handle_message(
+            payload,
+            bot_data=bot_data,
+            server_url=settings.SERVER_URL,
+            access_token=settings.ACCESS_TOKEN,
+        )
+        for i in range(3)
+    ]
+
+    assert [a["action"] for a in actions] == ["forward", "forward", "skip"]
+    # the third message is rejected before looking up the recipient
+    assert lookup_account.call_count == 2
+
+
+def test_admit_limits_bursts(monkeypatch):
+    monkeypatch.setattr(main, "BURST_LIMITS", limits.parse_many("3/minute"))
+
+    assert [main.admit("Burster") for i in range(4)] == [True, True, True, False]
+    assert main.admit("someone_else")
+    assert metrics.RATE_LIMIT_REJECTIONS.get(limit="burst") == 1
+
+
+def test_forward_index_only_keeps_what_reports_need(mocker):
+    index = main.get_forwards()
+    index.add(
+        {"id": "forwarded", "url": "https://f", "content": "secret"},
+        {"id": "sender", "acct": "sender@world", "url": "https://sender"},
+    )
+
+    assert index.get("forwarded") == (
+        {"id": "forwarded", "url": "https://f"},
+        {"acct": "sender@world", "url": "https://sender"},
+    )
+    assert index.prune(60) == 0
+    mocker.patch("time.time", return_value=time.time() + 120)
+    assert index.prune(60) == 1
+    assert index.get("forwarded") is None
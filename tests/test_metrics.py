@@ -0,0 +1,102 @@
+import asyncio
+
+import pytest
+
+from shyraccoon import main, metrics, settings
+
+
+@pytest.mark.parametrize(
+    "path, expected",
+    [
+        ("/api/v1/statuses", "/api/v1/statuses"),
+        (
+            "/api/v1/statuses/110108208783335072/bookmark",
+            "/api/v1/statuses/:id/bookmark",
+        ),
+        ("/api/v1/accounts/42", "/api/v1/accounts/:id"),
+        ("/api/v1/accounts/lookup?acct=someone", "/api/v1/accounts/lookup"),
+    ],
+)
+def test_get_path_label(path, expected):
+    assert metrics.get_path_label(path) == expected
+
+
+def test_render():
+    registry = metrics.Registry()
+    counter = registry.register(metrics.Counter("test_total", "Test.", ["action"]))
+    gauge = registry.register(metrics.Gauge("test_depth", "Depth."))
+    histogram = registry.register(
+        metrics.Histogram("test_seconds", "Duration.", ["stage"], buckets=[0.1, 1])
+    )
+    counter.inc(action="reply")
+    counter.inc(2, action="reply")
+    gauge.set_function(lambda: 7)
+    histogram.observe(0.1, stage="decode")
+    histogram.observe(0.5, stage="decode")
+    histogram.observe(3, stage="decode")
+
+    assert registry.render() == (
+        "# HELP test_total Test.\n"
+        "# TYPE test_total counter\n"
+        'test_total{action="reply"} 3\n'
+        "# HELP test_depth Depth.\n"
+        "# TYPE test_depth gauge\n"
+        "test_depth 7\n"
+        "# HELP test_seconds Duration.\n"
+        "# TYPE test_seconds histogram\n"
+        'test_seconds_bucket{stage="decode",le="0.1"} 1\n'
+        'test_seconds_bucket{stage="decode",le="1.0"} 2\n'
+        'test_seconds_bucket{stage="decode",le="+Inf"} 3\n'
+        'test_seconds_sum{stage="decode"} 3.6\n'
+        'test_seconds_count{stage="decode"} 3\n'
+    )
+
+
+def test_counter_can_read_counts_kept_elsewhere():
+    counter = metrics.Counter("test_hits_total", "Hits.", ["cache"])
+    counter.set_function(lambda: 4, cache="accounts")
+
+    assert counter.get(cache="accounts") == 4
+    assert counter.render() == (
+        "# HELP test_hits_total Hits.\n"
+        "# TYPE test_hits_total counter\n"
+        'test_hits_total{cache="accounts"} 4'
+    )
+
+
+async def test_api_requests_are_measured(respx_mock):
+    respx_mock.get(f"{settings.SERVER_URL}/api/v1/accounts/42").respond(json={})
+
+    await main.get_data(
+        settings.SERVER_URL, "/api/v1/accounts/42", access_token="token"
+    )
+
+    labels = {"method": "GET", "path": "/api/v1/accounts/:id"}
+    assert metrics.API_SECONDS.get_count(**labels) == 1
+    assert metrics.API_RESPONSES.get(status=200, **labels) == 1
+
+
+def test_rate_limit_rejections_are_counted():
+    for _ in range(10):
+        main.pass_limits("metrics_sender", "recipient")
+
+    assert not main.pass_limits("metrics_sender", "recipient")
+    assert metrics.RATE_LIMIT_REJECTIONS.get(limit="couple") == 1
+
+
+async def test_serve():
+    registry = metrics.Registry()
+    registry.register(metrics.Counter("test_total", "Test.")).inc()
+    server = asyncio.create_task(metrics.serve("127.0.0.1", 9581, registry))
+    await asyncio.sleep(0.05)
+    try:
+        reader, writer = await asyncio.open_connection("127.0.0.1", 9581)
+        writer.write(b"GET /metrics HTTP/1.1\r\nHost: localhost\r\n\r\n")
+        response = (await reader.read()).decode()
+    finally:
+        server.cancel()
+
+    assert response.startswith("HTTP/1.1 200 OK\r\n")
+    assert response.endswith(
+        "\r\n\r\n# HELP test_total Test.\n# TYPE test_total counter\ntest_total 1\n"
+    )
@@ -0,0 +1,143 @@
+import asyncio
+
+import pytest
+
+from shyraccoon import main, notifications, settings
+
+
+def test_id_key():
+    ids = ["110108208783335072", "99", "110108208783335071", "100"]
+    assert sorted(ids, key=notifications.id_key) == [
+        "99",
+        "100",
+        "110108208783335071",
+        "110108208783335072",
+    ]
+
+
+def test_tracker_skips_duplicates():
+    tracker = notifications.NotificationTracker(
+        cursor="10", save_cursor=lambda c: None, seen_size=10, seen_ttl=60
+    )
+
+    assert tracker.start("11")
+    assert not tracker.start("11")
+    # already handled before the cursor was saved
+    assert not tracker.start("9")
+
+
+def test_tracker_cursor_waits_for_pending_notifications():
+    saved = []
+    tracker = notifications.NotificationTracker(
+        cursor=None, save_cursor=saved.append, seen_size=10, seen_ttl=60
+    )
+    for id in ["1", "2", "3"]:
+        tracker.start(id)
+
+    tracker.finish("2")
+    assert tracker.cursor is None
+    tracker.finish("1")
+    assert tracker.cursor == "2"
+    tracker.finish("3")
+    assert tracker.cursor == "3"
+    assert saved == ["2", "3"]
+
+
+def test_tracker_cursor_is_held_while_catching_up():
+    saved = []
+    tracker = notifications.NotificationTracker(
+        cursor="10", save_cursor=saved.append, seen_size=10, seen_ttl=60
+    )
+    cursor = tracker.hold()
+    # a live event is handled before the missed ones are fetched
+    assert tracker.start("20")
+    tracker.finish("20")
+    assert tracker.cursor == "10"
+
+    assert tracker.start("11")
+    assert tracker.start("15")
+    # also received live
+    assert not tracker.start("20")
+    tracker.finish("11")
+    tracker.release(cursor)
+    assert tracker.cursor == "11"
+    tracker.finish("15")
+    assert tracker.cursor == "20"
+    assert saved == ["11", "20"]
+
+
+async def test_tracker_cursor_is_persisted():
+    tracker = main.get_notification_tracker()
+    tracker.start("42")
+    tracker.finish("42")
+
+    main.get_bot().notifications = None
+    assert main.get_notification_tracker().cursor == "42"
+
+
+async def test_fetch_notifications(respx_mock):
+    base_url = (
+        f"{settings.SERVER_URL}/api/v1/notifications?min_id={{}}"
+        "&types[]=mention&types[]=follow&limit=40"
+    )
+    respx_mock.get(base_url.format("10")).respond(json=[{"id": "12"}, {"id": "11"}])
+    respx_mock.get(base_url.format("12")).respond(json=[{"id": "13"}])
+    respx_mock.get(base_url.format("13")).respond(json=[])
+
+    fetched = [
+        n["id"]
+        async for n in main.fetch_notifications(
+            settings.SERVER_URL, settings.ACCESS_TOKEN, min_id="10"
+        )
+    ]
+
+    assert fetched == ["11", "12", "13"]
+
+
+async def test_poll_notifications(respx_mock, mocker):
+    base_url = f"{settings.SERVER_URL}/api/v1/notifications?{{}}types[]=mention&types[]=follow&limit={{}}"
+    respx_mock.get(base_url.format("", "1")).respond(json=[{"id": "10"}])
+    respx_mock.get(base_url.format("min_id=10&", "40")).respond(json=[{"id": "11"}])
+    respx_mock.get(base_url.format("min_id=11&", "40")).respond(json=[])
+    received = []
+    intervals = []
+
+    async def callback(event):
+        received.append(event["data"]["id"])
+
+    async def sleep(interval):
+        intervals.append(interval)
+        if len(intervals) == 3:
+            raise asyncio.CancelledError()
+
+    mocker.patch("asyncio.sleep", sleep)
+    with pytest.raises(asyncio.CancelledError):
+        await main.poll_notifications(
+            settings.SERVER_URL,
+            settings.ACCESS_TOKEN,
+            callback=callback,
+            get_cursor=lambda: None,
+            min_interval=5,
+            max_interval=15,
+        )
+
+    # notifications received before the first poll are ignored
+    assert received == ["11"]
+    assert intervals == [5, 10, 15]
+
+
+async def test_poll_notifications_paused(mocker):
+    sleep = mocker.patch("asyncio.sleep", side_effect=[None, asyncio.CancelledError])
+
+    with pytest.raises(asyncio.CancelledError):
+        await main.poll_notifications(
+            settings.SERVER_URL,
+            settings.ACCESS_TOKEN,
+            callback=None,
+            get_cursor=lambda: None,
+            min_interval=5,
+            max_interval=15,
+            should_poll=lambda: False,
+        )
+
+    assert sleep.call_count == 2
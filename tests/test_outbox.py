@@ -0,0 +1,241 @@
+import asyncio
+import json
+import time
+
+import httpx
+import pytest
+
+from shyraccoon import db, main, outbox, settings
+
+
+@pytest.fixture
+def sleep(mocker):
+    return mocker.patch("asyncio.sleep")
+
+
+async def test_outbox_retries_on_rate_limit(respx_mock, sleep):
+    route = respx_mock.post(f"{settings.SERVER_URL}/api/v1/statuses")
+    route.side_effect = [
+        httpx.Response(429, headers={"retry-after": "12"}),
+        httpx.Response(503),
+        httpx.Response(200, json={"id": "status"}),
+    ]
+
+    results = await main.run_steps(
+        "reply", [{"name": "reply", "path": "/api/v1/statuses", "data": {}}]
+    )
+
+    assert results == {"reply": {"id": "status"}}
+    assert route.call_count == 3
+    assert sleep.call_args_list[0].args == (12,)
+    # the same idempotency key is used on every attempt
+    keys = {call.request.headers["idempotency-key"] for call in route.calls}
+    assert len(keys) == 1
+
+
+async def test_outbox_does_not_retry_client_errors(respx_mock, sleep):
+    route = respx_mock.post(f"{settings.SERVER_URL}/api/v1/statuses").respond(422)
+
+    with pytest.raises(httpx.HTTPStatusError):
+        await main.run_steps(
+            "reply", [{"name": "reply", "path": "/api/v1/statuses", "data": {}}]
+        )
+
+    assert route.call_count == 1
+    assert main.get_outbox().get_pending_actions() == []
+
+
+async def test_outbox_resumes_without_repeating_steps(respx_mock, sleep):
+    statuses = respx_mock.post(f"{settings.SERVER_URL}/api/v1/statuses")
+    statuses.side_effect = [
+        httpx.Response(200, json={"id": "modpost"}),
+        httpx.Response(200, json={"id": "confirmation"}),
+    ]
+    bookmark = respx_mock.post(
+        f"{settings.SERVER_URL}/api/v1/statuses/modpost/bookmark"
+    ).respond(json={})
+    stopped = False
+
+    async def execute(step):
+        nonlocal stopped
+        if step["name"] == "confirmation" and not stopped:
+            # e.g. the bot is stopped while sending the confirmation
+            stopped = True
+            raise asyncio.CancelledError()
+        return await main.execute_step(step)
+
+    box = outbox.Outbox(
+        db.get_connection(),
+        execute=execute,
+        max_attempts=1,
+        retry_delay=1,
+        max_retry_delay=1,
+    )
+    action_id = box.add(
+        "report",
+        [
+            {"name": "mod_post", "path": "/api/v1/statuses", "data": {"status": "a"}},
+            {"name": "confirmation", "path": "/api/v1/statuses", "data": {}},
+            {
+                "name": "mod_post_bookmark",
+                "path": "/api/v1/statuses/{mod_post[id]}/bookmark",
+                "depends_on": ["mod_post"],
+            },
+        ],
+    )
+    with pytest.raises(asyncio.CancelledError):
+        await box.run(action_id)
+
+    await box.resume()
+
+    assert statuses.call_count == 2
+    assert json.loads(statuses.calls[1].request.content) == {}
+    assert bookmark.call_count == 1
+    assert box.get_pending_actions() == []
+
+
+async def test_outbox_runs_independent_steps_concurrently():
+    running = set()
+    started = []
+
+    async def execute(step):
+        started.append((step["name"], set(running)))
+        running.add(step["name"])
+        await asyncio.sleep(0.01)
+        running.remove(step["name"])
+        return {"id": step["name"]}
+
+    box = outbox.Outbox(
+        db.get_connection(),
+        execute=execute,
+        max_attempts=1,
+        retry_delay=1,
+        max_retry_delay=1,
+    )
+    action_id = box.add(
+        "report",
+        [
+            {"name": "mod_post", "path": "/api/v1/statuses"},
+            {"name": "confirmation", "path": "/api/v1/statuses"},
+            {
+                "name": "mod_post_bookmark",
+                "path": "/api/v1/statuses/{mod_post[id]}/bookmark",
+                "depends_on": ["mod_post"],
+            },
+        ],
+    )
+    results = await box.run(action_id)
+
+    assert started == [
+        ("mod_post", set()),
+        ("confirmation", {"mod_post"}),
+        ("mod_post_bookmark", set()),
+    ]
+    assert results["mod_post_bookmark"] == {"id": "mod_post_bookmark"}
+
+
+def test_outbox_rejects_unknown_dependencies():
+    box = outbox.Outbox(
+        db.get_connection(),
+        execute=None,
+        max_attempts=1,
+        retry_delay=1,
+        max_retry_delay=1,
+    )
+
+    with pytest.raises(ValueError):
+        box.add("reply", [{"name": "reply", "path": "/", "depends_on": ["nope"]}])
+
+
+def test_get_retry_delay():
+    box = outbox.Outbox(
+        db.get_connection(),
+        execute=None,
+        max_attempts=5,
+        retry_delay=1,
+        max_retry_delay=10,
+    )
+    error = httpx.HTTPStatusError(
+        "", request=None, response=httpx.Response(429, headers={"retry-after": "60"})
+    )
+
+    assert box.get_retry_delay(error, 1) == 10
+    assert 0 <= box.get_retry_delay(httpx.ConnectError(""), 2) <= 2
+    assert 0 <= box.get_retry_delay(httpx.ConnectError(""), 8) <= 10
+
+
+async def test_outbox_keeps_actions_pending_after_retryable_errors(respx_mock, sleep):
+    route = respx_mock.post(f"{settings.SERVER_URL}/api/v1/statuses")
+    route.side_effect = [httpx.Response(503), httpx.Response(503)] + [
+        httpx.Response(200, json={"id": "status"})
+    ]
+    box = outbox.Outbox(
+        db.get_connection(),
+        execute=main.execute_step,
+        max_attempts=2,
+        retry_delay=1,
+        max_retry_delay=1,
+    )
+    action_id = box.add(
+        "reply", [{"name": "reply", "path": "/api/v1/statuses", "data": {}}]
+    )
+
+    # e.g. the server is down for a while
+    with pytest.raises(httpx.HTTPStatusError):
+        await box.run(action_id)
+    assert box.get_pending_actions() == [action_id]
+
+    await box.resume()
+
+    assert route.call_count == 3
+    assert box.get_pending_actions() == []
+    assert box.get_steps(action_id)[0]["result"] == {"id": "status"}
+
+
+async def test_outbox_runs_an_action_once_at_a_time():
+    calls = []
+
+    async def execute(step):
+        calls.append(step["name"])
+        await asyncio.sleep(0.01)
+        return {"id": step["name"]}
+
+    box = outbox.Outbox(
+        db.get_connection(),
+        execute=execute,
+        max_attempts=1,
+        retry_delay=1,
+        max_retry_delay=1,
+    )
+    action_id = box.add("reply", [{"name": "reply", "path": "/api/v1/statuses"}])
+
+    # e.g. resumed while its event is handled again
+    results = await asyncio.gather(box.run(action_id), box.run(action_id))
+
+    assert calls == ["reply"]
+    assert results == [{"reply": {"id": "reply"}}] * 2
+
+
+async def test_outbox_prunes_old_actions(mocker):
+    async def execute(step):
+        return {"id": step["name"]}
+
+    box = outbox.Outbox(
+        db.get_connection(),
+        execute=execute,
+        max_attempts=1,
+        retry_delay=1,
+        max_retry_delay=1,
+    )
+    steps = [{"name": "reply", "path": "/api/v1/statuses"}]
+    done = box.add("reply", steps)
+    await box.run(done)
+    pending = box.add("reply", steps)
+    mocker.patch("time.time", return_value=time.time() + 100)
+    recent = box.add("reply", steps)
+    await box.run(recent)
+
+    assert box.prune(50) == 1
+    assert box.get_steps(done) == []
+    assert box.get_pending_actions() == [pending]
+    assert len(box.get_steps(recent)) == 1
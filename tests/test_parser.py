@@ -0,0 +1,71 @@
+import pytest
+
+from shyraccoon import parser
+
+
+@pytest.mark.parametrize(
+    "content, expected",
+    [
+        ("<p>Hello</p><p>World</p>", "Hello\n\nWorld\n\n"),
+        ("<p>Hello<br />World<br>!</p>", "Hello\nWorld\n!\n\n"),
+        ("<p>Fish &amp; chips &#39;n&#x27; &lt;3</p>", "Fish & chips 'n' <3\n\n"),
+        (
+            '<p><a href="https://server.test/about" rel="nofollow noopener noreferrer"'
+            ' target="_blank"><span class="invisible">https://</span><span class="">'
+            'server.test/about</span><span class="invisible"></span></a></p>',
+            "https://server.test/about\n\n",
+        ),
+        # not actual tags
+        ("<p>1 < 2 and 3 > 2 &amp</p>", "1 < 2 and 3 > 2 &amp\n\n"),
+    ],
+)
+def test_html_to_text(content, expected):
+    assert parser.html_to_text(content) == expected
+
+
+@pytest.mark.parametrize(
+    "text, expected",
+    [
+        ("question for ?toto\n\n", None),
+        ("question for ?toto\n\ncoucou  ", "coucou"),
+        ("question for ?toto:\n\nbonjour\n\ncoucou  ", "bonjour\n\ncoucou"),
+        ("for ?toto : \nSome content\n", "Some content"),
+    ],
+)
+def test_get_body(text, expected):
+    assert parser.get_body(parser.get_lines(text)) == expected
+
+
+@pytest.mark.parametrize(
+    "content, expected",
+    [
+        (
+            '<p><span class="h-card"><a href="https://server/@ShyRaccoon" class="u-url mention">'
+            "@<span>ShyRaccoon</span></a></span> for ?user@server.test:</p>"
+            "<p>How old are you?<br />And where do you live?</p>",
+            ("user@server.test", "How old are you?\n\nAnd where do you live?"),
+        ),
+        # a line break instead of a new paragraph
+        (
+            "<p>for ?toto<br />coucou</p>",
+            ("toto", "coucou"),
+        ),
+        # question marks in the message aren't usernames
+        (
+            "<p>for ?toto,</p><p>are you ok ?! ? really</p>",
+            ("toto", "are you ok ?! ? really"),
+        ),
+        # no message
+        ("<p>for ?toto</p>", ("toto", None)),
+        # no recipient on the first line
+        ("<p>hello</p><p>this is for ?toto</p>", ("toto", "this is for ?toto")),
+        ("<p>hello</p>", (None, None)),
+        ("", (None, None)),
+    ],
+)
+def test_parse_message(content, expected):
+    assert parser.parse_message(content, "?") == expected
+
+
+def test_parse_message_custom_placeholder():
+    assert parser.parse_message("<p>for $toto?</p><p>hi</p>", "$") == ("toto", "hi")
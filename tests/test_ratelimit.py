@@ -0,0 +1,77 @@
+import time
+
+import limits
+import pytest
+
+from shyraccoon import ratelimit, storage
+
+
+@pytest.fixture
+def memory_storage():
+    s = limits.storage.MemoryStorage()
+    yield s
+    s.reset()
+
+
+def test_get_limiter(memory_storage):
+    limiter = ratelimit.get_limiter("fixed-window", memory_storage)
+    assert isinstance(limiter, limits.strategies.FixedWindowRateLimiter)
+
+    with pytest.raises(ValueError):
+        ratelimit.get_limiter("unknown", memory_storage)
+
+
+def test_sliding_window_counter(memory_storage, mocker):
+    now = mocker.patch("time.time", return_value=3600 * 10)
+    limiter = ratelimit.SlidingWindowCounterRateLimiter(memory_storage)
+    limit = limits.parse("4/hour")
+
+    for _ in range(4):
+        assert limiter.hit(limit, "alice")
+    assert not limiter.hit(limit, "alice")
+    assert limiter.hit(limit, "bob")
+
+    # a quarter through the next window, 3 of the previous 4 hits still count
+    now.return_value += 3600 * 1.25
+    assert limiter.get_window_stats(limit, "alice")[1] == 1
+    assert limiter.hit(limit, "alice")
+    assert not limiter.hit(limit, "alice")
+
+    limiter.clear(limit, "alice")
+    assert limiter.test(limit, "alice")
+
+
+def test_sliding_window_counter_counts_before_checking(memory_storage, mocker):
+    mocker.patch("time.time", return_value=3600 * 10)
+    limiter = ratelimit.SlidingWindowCounterRateLimiter(memory_storage)
+    limit = limits.parse("2/hour")
+    key, _, _ = limiter.get_keys(limit, ("alice",), 3600 * 10)
+    # e.g. another process hits the limit between our increment and check
+    incr = memory_storage.incr
+
+    def concurrent_incr(*args, **kwargs):
+        value = incr(*args, **kwargs)
+        if kwargs.get("amount", 1) > 0:
+            incr(key, 7200, amount=1)
+            value += 1
+        return value
+
+    mocker.patch.object(memory_storage, "incr", side_effect=concurrent_incr)
+    assert limiter.hit(limit, "alice")
+    assert not limiter.hit(limit, "alice")
+    # the rejected hit isn't counted
+    assert memory_storage.get(key) == 3
+
+
+def test_prune_memory_storage(memory_storage, mocker):
+    limiter = limits.strategies.MovingWindowRateLimiter(memory_storage)
+    limiter.hit(limits.parse("1/second"), "alice")
+    limiter.hit(limits.parse("1/hour"), "bob")
+
+    mocker.patch("time.time", return_value=time.time() + 2)
+    memory_storage.timer.join()
+    # the storage timer removes expired events, but keeps the keys
+    memory_storage._MemoryStorage__expire_events()
+
+    assert storage.prune(memory_storage) == 1
+    assert len(memory_storage.events) == 1
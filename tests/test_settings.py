@@ -0,0 +1,80 @@
+import os
+
+import pytest
+
+from shyraccoon import main, settings
+
+
+@pytest.fixture
+def env_file(monkeypatch, tmp_path):
+    # reload_settings() updates the settings module and the environment
+    for key, value in vars(settings).items():
+        if key.isupper():
+            monkeypatch.setattr(settings, key, value)
+    for key in ["GLOBAL_LIMITS", "COUPLE_LIMITS", "BURST_LIMITS", "LIMITER"]:
+        monkeypatch.setattr(main, key, getattr(main, key))
+    monkeypatch.setattr(os, "environ", os.environ.copy())
+    path = tmp_path / ".env"
+    monkeypatch.setattr(settings, "ENV_FILE", str(path))
+    return path
+
+
+def test_read_env_file(tmp_path):
+    path = tmp_path / ".env"
+    path.write_text("""
+# a comment
+SERVER_URL=https://raccoon.test
+export BOT_HASHTAGS = raccoon, bot
+FORWARD_MESSAGE="{message}
+
+Sent with Shy Raccoon"
+MENTION_PLACEHOLDER='?'
+""")
+
+    assert settings.read_env_file(path) == {
+        "SERVER_URL": "https://raccoon.test",
+        "BOT_HASHTAGS": "raccoon, bot",
+        "FORWARD_MESSAGE": "{message}\n\nSent with Shy Raccoon",
+        "MENTION_PLACEHOLDER": "?",
+    }
+
+
+def test_reload_settings(env_file):
+    bot = main.get_bot()
+    bot.accounts_cache.set("someone", {"id": "1"})
+    env_file.write_text("""
+RATE_LIMIT_USER=3/day
+MODERATORS_USERNAMES=newmod@server.test
+FORWARD_MESSAGE=New message: {message}
+API_RATE=2
+SERVER_URL=https://other.test
+""")
+
+    main.reload_settings()
+
+    assert main.GLOBAL_LIMITS[0].amount == 3
+    assert main.get_bot() is bot
+    assert bot.settings.MODERATORS_USERNAMES == ["newmod@server.test"]
+    assert bot.templates["forward"].format(message="hi").startswith("New message: hi")
+    assert bot.throttle.default_rate == 2
+    # requires a restart
+    assert bot.settings.SERVER_URL == "https://hello.devserver"
+    assert bot.accounts_cache.get("someone") == {"id": "1"}
+
+
+def test_reload_settings_keeps_current_ones_if_invalid(env_file):
+    bot = main.get_bot()
+    bot_settings, bot_templates = bot.settings, bot.templates
+    global_limits = main.GLOBAL_LIMITS
+    env_file.write_text("""
+RATE_LIMIT_USER=3/day
+FORWARD_MESSAGE=New message: {unknown}
+""")
+
+    with pytest.raises(ValueError):
+        main.reload_settings()
+
+    assert main.GLOBAL_LIMITS is global_limits
+    assert bot.settings is bot_settings
+    assert bot.templates is bot_templates
+    assert "FORWARD_MESSAGE" not in os.environ
@@ -0,0 +1,58 @@
+import time
+
+import limits
+
+from shyraccoon import storage
+
+
+def test_sqlite_storage_from_string(tmp_path):
+    s = limits.storage.storage_from_string(f"sqlite://{tmp_path}/limits.sqlite3")
+
+    assert isinstance(s, storage.SQLiteStorage)
+    assert s.check()
+
+
+def test_sqlite_storage_moving_window(tmp_path):
+    s = storage.SQLiteStorage(f"sqlite://{tmp_path}/limits.sqlite3")
+    limiter = limits.strategies.MovingWindowRateLimiter(s)
+    limit = limits.parse("2/hour")
+
+    assert limiter.hit(limit, "alice")
+    assert limiter.hit(limit, "alice")
+    assert not limiter.hit(limit, "alice")
+    assert not limiter.test(limit, "alice")
+    assert limiter.hit(limit, "bob")
+    assert limiter.get_window_stats(limit, "bob")[1] == 1
+
+
+def test_sqlite_storage_fixed_window(tmp_path):
+    s = storage.SQLiteStorage(f"sqlite://{tmp_path}/limits.sqlite3")
+    limiter = limits.strategies.FixedWindowRateLimiter(s)
+    limit = limits.parse("2/hour")
+
+    assert limiter.hit(limit, "alice")
+    assert limiter.hit(limit, "alice")
+    assert not limiter.hit(limit, "alice")
+    assert limiter.get_window_stats(limit, "alice")[1] == 0
+
+
+def test_sqlite_storage_survives_restarts(tmp_path):
+    uri = f"sqlite://{tmp_path}/limits.sqlite3"
+    limit = limits.parse("1/hour")
+    limiter = limits.strategies.MovingWindowRateLimiter(storage.SQLiteStorage(uri))
+    assert limiter.hit(limit, "alice")
+
+    # e.g. after a restart, or from another process
+    limiter = limits.strategies.MovingWindowRateLimiter(storage.SQLiteStorage(uri))
+    assert not limiter.hit(limit, "alice")
+
+
+def test_sqlite_storage_prune(tmp_path):
+    s = storage.SQLiteStorage(f"sqlite://{tmp_path}/limits.sqlite3")
+    s.acquire_entry("moving", limit=10, expiry=0)
+    s.incr("fixed", expiry=0)
+    s.incr("kept", expiry=60)
+    time.sleep(0.01)
+
+    assert s.prune() == 2
+    assert s.get("kept") == 1
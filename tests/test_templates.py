@@ -0,0 +1,45 @@
+import pytest
+
+from shyraccoon import settings, templates
+
+
+def test_template_renders_like_format():
+    source = "Hello {name}, {0} {count:>3} {name!r} {{literal}} #\\{tag}"
+    template = templates.Template(
+        "TEST", source, fields=["name", "0", "count"], static={"tag": "report"}
+    )
+
+    assert template.format("first", name="you", count=7) == source.format(
+        "first", name="you", count=7, tag="report"
+    )
+
+
+def test_template_prerenders_static_fields():
+    template = templates.Template(
+        "TEST", "{a} and {b}", fields=["b"], static={"a": "static"}
+    )
+
+    assert template.chunks == ["static and ", ("b", None, "")]
+
+
+@pytest.mark.parametrize(
+    "source",
+    ["Hello {unknown}", "Hello {", "Hello {0}"],
+)
+def test_template_invalid(source):
+    with pytest.raises(ValueError, match="Invalid template TEST"):
+        templates.Template("TEST", source, fields=["name"])
+
+
+def test_load_default_templates():
+    loaded = templates.load(settings)
+
+    assert loaded["forward"].format(message="hello") == settings.FORWARD_MESSAGE.format(
+        message="hello",
+        report_hashtags=", ".join(f"#\\{t}" for t in settings.REPORT_HASHTAGS),
+    )
+    assert loaded["error_invalid_account"].format(
+        account="a", bot_account="b"
+    ) == settings.ERROR_INVALID_ACCOUNT.format(
+        account="a", bot_account="b", recipient=settings.EXAMPLE_USERNAME
+    )
@@ -0,0 +1,73 @@
+import asyncio
+import datetime
+
+from shyraccoon import throttle
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0
+
+    def __call__(self):
+        return self.now
+
+
+def reset_in(seconds):
+    reset = datetime.datetime.now(datetime.timezone.utc) + datetime.timedelta(
+        seconds=seconds
+    )
+    return reset.isoformat().replace("+00:00", "Z")
+
+
+def test_parse_reset():
+    assert 99 < throttle.parse_reset(reset_in(100)) <= 100
+    assert throttle.parse_reset(reset_in(-10)) == 0
+    assert throttle.parse_reset("nope") is None
+    assert throttle.parse_reset(None) is None
+
+
+def test_throttle_update_from_headers():
+    t = throttle.Throttle(rate=1, burst=10, clock=FakeClock())
+    t.update({"x-ratelimit-remaining": "5", "x-ratelimit-reset": reset_in(100)})
+
+    assert t.tokens == 5
+    assert 0.049 < t.rate < 0.051
+
+    # invalid headers are ignored
+    t.update({"x-ratelimit-remaining": "nope", "x-ratelimit-reset": reset_in(1)})
+    assert t.tokens == 5
+
+    # plenty of requests remaining, but the configured pace is a maximum
+    t.update({"x-ratelimit-remaining": "290", "x-ratelimit-reset": reset_in(10)})
+    assert t.rate == 1
+
+
+async def test_throttle_burst_then_pace():
+    t = throttle.Throttle(rate=20, burst=2)
+    await t.acquire()
+    await t.acquire()
+
+    waiting = asyncio.create_task(t.acquire())
+    await asyncio.sleep(0.01)
+    assert not waiting.done()
+    await asyncio.wait_for(waiting, 1)
+
+
+async def test_throttle_serves_high_priority_first():
+    t = throttle.Throttle(rate=100, burst=1)
+    await t.acquire()
+    served = []
+
+    async def acquire(priority, name):
+        await t.acquire(priority)
+        served.append(name)
+
+    await asyncio.wait_for(
+        asyncio.gather(
+            acquire(throttle.LOW, "bookmark"),
+            acquire(throttle.HIGH, "forward"),
+        ),
+        1,
+    )
+
+    assert served == ["forward", "bookmark"]
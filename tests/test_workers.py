@@ -0,0 +1,91 @@
+import asyncio
+
+from shyraccoon import main, workers
+
+
+def notification(sender, id):
+    return {"event": "notification", "data": {"id": id, "account": {"acct": sender}}}
+
+
+async def test_worker_pool_keeps_order_per_sender():
+    handled = []
+
+    async def handler(event):
+        # the first events are the slowest, to detect reordering
+        await asyncio.sleep(0.01 / int(event["data"]["id"]))
+        handled.append((event["data"]["account"]["acct"], event["data"]["id"]))
+
+    pool = workers.WorkerPool(
+        handler, key=main.get_event_sender, size=4, high_water=100
+    )
+    pool.start()
+    for i in range(1, 6):
+        await pool.submit(notification("alice", str(i)))
+        await pool.submit(notification("bob", str(i)))
+    await pool.join()
+    await pool.stop()
+
+    for sender in ["alice", "bob"]:
+        assert [id for s, id in handled if s == sender] == ["1", "2", "3", "4", "5"]
+
+
+async def test_worker_pool_handles_senders_concurrently():
+    running = set()
+    max_running = 0
+
+    async def handler(event):
+        nonlocal max_running
+        running.add(event["data"]["account"]["acct"])
+        max_running = max(max_running, len(running))
+        await asyncio.sleep(0.01)
+        running.discard(event["data"]["account"]["acct"])
+
+    pool = workers.WorkerPool(
+        handler, key=lambda event: event["data"]["id"], size=4, high_water=100
+    )
+    pool.start()
+    for i in range(8):
+        await pool.submit(notification(f"user{i}", str(i)))
+    await pool.join()
+    await pool.stop()
+
+    assert max_running > 1
+
+
+async def test_worker_pool_backpressure():
+    release = asyncio.Event()
+
+    async def handler(event):
+        await release.wait()
+
+    pool = workers.WorkerPool(handler, key=main.get_event_sender, size=1, high_water=2)
+    pool.start()
+    await pool.submit(notification("alice", "1"))
+    await pool.submit(notification("alice", "2"))
+
+    blocked = asyncio.create_task(pool.submit(notification("alice", "3")))
+    await asyncio.sleep(0.01)
+    assert not blocked.done()
+
+    release.set()
+    await asyncio.wait_for(blocked, 1)
+    await pool.join()
+    await pool.stop()
+
+
+async def test_worker_pool_survives_handler_errors():
+    handled = []
+
+    async def handler(event):
+        if event["data"]["id"] == "1":
+            raise ValueError()
+        handled.append(event["data"]["id"])
+
+    pool = workers.WorkerPool(handler, key=main.get_event_sender, size=1, high_water=10)
+    pool.start()
+    await pool.submit(notification("alice", "1"))
+    await pool.submit(notification("alice", "2"))
+    await pool.join()
+    await pool.stop()
+
+    assert handled == ["2"]